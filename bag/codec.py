@@ -0,0 +1,89 @@
+import json
+
+# Version 1 of the stored bag is a list made up of the format version
+# followed by one [product_id, size_code, quantity] entry per line, e.g.
+# [1, [12, 0, 2], [40, 3, 1]]
+BAG_FORMAT_VERSION = 1
+
+# Sizes are stored as small integer codes, 0 meaning the product has no
+# size. Any size not listed here is stored as its original string.
+SIZES = ('xs', 's', 'm', 'l', 'xl')
+SIZE_CODES = {size: code for code, size in enumerate(SIZES, start=1)}
+
+
+def _encode_size(size):
+    if not size:
+        return 0
+    return SIZE_CODES.get(size, size)
+
+
+def _decode_size(code):
+    if isinstance(code, str):
+        return code
+    if not code:
+        return None
+    return SIZES[code - 1]
+
+
+def bag_lines(bag):
+    """ Yield a (item_id, size, quantity) tuple for each line in the bag,
+        size being None for products without sizes """
+    for item_id, item_data in bag.items():
+        if isinstance(item_data, int):
+            yield item_id, None, item_data
+        else:
+            for size, quantity in item_data['items_by_size'].items():
+                yield item_id, size, quantity
+
+
+def encode_bag(bag):
+    """ Convert a bag into the compact format stored in the session """
+    lines = sorted(
+        ([int(item_id), _encode_size(size), quantity]
+         for item_id, size, quantity in bag_lines(bag)),
+        key=lambda line: (line[0], str(line[1])))
+    return [BAG_FORMAT_VERSION] + lines
+
+
+def decode_bag(data):
+    """ Convert a stored bag back into the dict of item ids used by the
+        views, accepting both the compact and the original dict format """
+    if not data:
+        return {}
+    if isinstance(data, dict):
+        # Bags stored before the compact format was introduced
+        return {str(item_id): item_data for item_id, item_data in data.items()}
+    if data[0] != BAG_FORMAT_VERSION:
+        raise ValueError(f'Unknown bag format version: {data[0]}')
+
+    bag = {}
+    for item_id, size_code, quantity in data[1:]:
+        item_id = str(item_id)
+        size = _decode_size(size_code)
+        if size:
+            item_data = bag.setdefault(item_id, {'items_by_size': {}})
+            item_data['items_by_size'][size] = quantity
+        else:
+            bag[item_id] = quantity
+    return bag
+
+
+def dumps_bag(bag):
+    """ Serialize a bag to the compact JSON used in Stripe metadata and
+        on the order """
+    return json.dumps(encode_bag(bag), separators=(',', ':'))
+
+
+def loads_bag(text):
+    """ Read a bag serialized by dumps_bag, or the original json.dumps """
+    return decode_bag(json.loads(text))
+
+
+def load_bag(request):
+    """ Get the bag from the session, or an empty one """
+    return decode_bag(request.session.get('bag'))
+
+
+def save_bag(request, bag):
+    """ Store the bag in the session in the compact format """
+    request.session['bag'] = encode_bag(bag)
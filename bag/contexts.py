@@ -1,38 +1,54 @@
 from decimal import Decimal
+from functools import partial
+
 from django.conf import settings
-from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+
 from products.models import Product
+from products.versions import get_version
+from .codec import bag_lines, load_bag
 
+# The bag values kept in the session summary, so the navbar and
+# toasts can show them without loading any products
+SUMMARY_KEYS = ('product_count', 'total', 'delivery',
+                'free_delivery_delta', 'grand_total')
 
-def bag_contents(request):  # This function is available to all templates
+
+def get_bag_products(bag):
+    """ Fetch every product referenced by the bag in a single query,
+        keyed by the string item id used in the session """
+
+    # Only numeric ids can ever match a product, anything else
+    # (e.g. a tampered session) is simply ignored
+    item_ids = [item_id for item_id in bag if str(item_id).isdigit()]
+    products = Product.objects.in_bulk(item_ids)
+    return {str(pk): product for pk, product in products.items()}
+
+
+def calculate_bag_contents(bag):
+    """ Work out the bag items and totals for the given decoded bag """
 
     bag_items = []
     total = 0
     product_count = 0
-    # If the bag is empty, it will return an empty dict
-    bag = request.session.get('bag', {})
-
-    for item_id, item_data in bag.items():
-        if isinstance(item_data, int):
-            product = get_object_or_404(Product, pk=item_id)
-            total += item_data * product.price
-            product_count += item_data
-            bag_items.append({  # This is a list of dictionaries
-                'item_id': item_id,
-                'quantity': item_data,
-                'product': product,
-            })
-        else:  # If the item has a size
-            product = get_object_or_404(Product, pk=item_id)
-            for size, quantity in item_data['items_by_size'].items():
-                total += quantity * product.price
-                product_count += quantity
-                bag_items.append({  # This is a list of dictionaries
-                    'item_id': item_id,
-                    'quantity': quantity,
-                    'product': product,
-                    'size': size,
-                })
+    products = get_bag_products(bag)
+
+    for item_id, size, quantity in bag_lines(bag):
+        product = products.get(item_id)
+        if product is None:
+            # The product was deleted since it was added to the bag, so
+            # we skip it rather than raising a 404 on an unrelated page
+            continue
+        total += quantity * product.price
+        product_count += quantity
+        bag_item = {
+            'item_id': item_id,
+            'quantity': quantity,
+            'product': product,
+        }
+        if size:  # If the item has a size
+            bag_item['size'] = size
+        bag_items.append(bag_item)  # This is a list of dictionaries
 
     if total < settings.FREE_DELIVERY_THRESHOLD:
         delivery = total * Decimal(settings.STANDARD_DELIVERY_PERCENTAGE / 100)
@@ -43,7 +59,7 @@ def bag_contents(request):  # This function is available to all templates
 
     grand_total = delivery + total
 
-    context = {
+    contents = {
         'bag_items': bag_items,
         'total': total,
         'product_count': product_count,
@@ -53,4 +69,91 @@ def bag_contents(request):  # This function is available to all templates
         'grand_total': grand_total,
     }
 
+    return contents
+
+
+def update_bag_summary(request, contents=None):
+    """ Store a small summary of the bag totals in the session, stamped
+        with the price version it was calculated against """
+
+    bag = load_bag(request)
+    if not bag:
+        request.session.pop('bag_summary', None)
+        return None
+
+    # Read the version first so a price change made while we are
+    # calculating leaves the summary stale rather than wrongly current
+    price_version = get_version('prices')
+    if contents is None:
+        contents = calculate_bag_contents(bag)
+    summary = {key: str(contents[key]) for key in SUMMARY_KEYS}
+    summary['price_version'] = price_version
+    request.session['bag_summary'] = summary
+    return summary
+
+
+def get_bag_summary(request):
+    """ Return the bag totals from the session summary, recalculating it
+        only if product prices have changed since it was stored """
+
+    if not load_bag(request):
+        return {key: 0 for key in SUMMARY_KEYS}
+
+    summary = request.session.get('bag_summary')
+    if not summary or summary['price_version'] != get_version('prices'):
+        summary = update_bag_summary(
+            request, get_bag_contents(request).contents)
+
+    return {
+        'product_count': int(summary['product_count']),
+        'total': Decimal(summary['total']),
+        'delivery': Decimal(summary['delivery']),
+        'free_delivery_delta': Decimal(summary['free_delivery_delta']),
+        'grand_total': Decimal(summary['grand_total']),
+    }
+
+
+class BagContents:
+    """ The bag contents for a single request, only calculated the
+        first time one of its values is actually looked up """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def contents(self):
+        # If the bag is empty, it will return an empty dict
+        return calculate_bag_contents(load_bag(self.request))
+
+    @cached_property
+    def summary(self):
+        return get_bag_summary(self.request)
+
+    def __getitem__(self, key):
+        # Totals come from the session summary, only the items
+        # themselves need the products loading
+        if key in SUMMARY_KEYS:
+            return self.summary[key]
+        return self.contents[key]
+
+
+def get_bag_contents(request):
+    """ Return the bag contents for this request, memoized on the request
+        so views and templates share a single calculation """
+    if not hasattr(request, '_bag_contents'):
+        request._bag_contents = BagContents(request)
+    return request._bag_contents
+
+
+def bag_contents(request):  # This function is available to all templates
+
+    contents = get_bag_contents(request)
+    # Templates call any callable they are given, so each value is only
+    # worked out if the page being rendered actually uses it
+    context = {
+        key: partial(contents.__getitem__, key)
+        for key in ('bag_items',) + SUMMARY_KEYS
+    }
+    context['free_delivery_threshold'] = settings.FREE_DELIVERY_THRESHOLD
+
     return context
@@ -1,3 +1,158 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
 
-# Create your tests here.
+from django.template import engines
+from django.test import TestCase, RequestFactory
+from django.urls import reverse
+
+from products.models import Product
+from .codec import decode_bag, dumps_bag, encode_bag, loads_bag
+from .contexts import bag_contents, calculate_bag_contents
+
+
+class BagContentsTest(TestCase):
+    """ Tests for the bag_contents context processor """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='Test', price='10.00')
+            for i in range(100)
+        ])
+        self.product_ids = list(
+            Product.objects.values_list('id', flat=True).order_by('id'))
+
+    def _request_with_bag(self, bag):
+        request = self.factory.get('/')
+        request.session = {'bag': bag}
+        return request
+
+    def _render(self, template_code, request):
+        template = engines['django'].from_string(template_code)
+        return template.render({}, request)
+
+    def test_product_lookup_is_a_single_query(self):
+        """ The number of queries must not grow with the bag size """
+        for size in (1, 10, 100):
+            bag = {str(pk): 1 for pk in self.product_ids[:size]}
+            with self.assertNumQueries(1):
+                contents = calculate_bag_contents(bag)
+            self.assertEqual(len(contents['bag_items']), size)
+            self.assertEqual(contents['product_count'], size)
+
+    def test_sized_items_are_expanded(self):
+        pk = str(self.product_ids[0])
+        contents = calculate_bag_contents(
+            {pk: {'items_by_size': {'s': 2, 'm': 1}}})
+        self.assertEqual(len(contents['bag_items']), 2)
+        self.assertEqual(contents['product_count'], 3)
+        self.assertEqual(contents['total'], 30)
+
+    def test_missing_products_are_skipped(self):
+        pk = str(self.product_ids[0])
+        contents = calculate_bag_contents({pk: 1, '999999': 2, 'abc': 1})
+        self.assertEqual(len(contents['bag_items']), 1)
+        self.assertEqual(contents['product_count'], 1)
+
+    def test_empty_bag_does_not_query(self):
+        with self.assertNumQueries(0):
+            contents = calculate_bag_contents({})
+        self.assertEqual(contents['grand_total'], 0)
+
+    def test_context_is_lazy(self):
+        """ Pages which don't use the bag shouldn't query for it """
+        request = self._request_with_bag({str(self.product_ids[0]): 1})
+        with self.assertNumQueries(0):
+            bag_contents(request)
+            self._render('{{ free_delivery_threshold }}', request)
+
+    def test_context_is_calculated_once_per_request(self):
+        request = self._request_with_bag({str(self.product_ids[0]): 3})
+        with self.assertNumQueries(1):
+            rendered = self._render(
+                '{{ product_count }}|{{ total }}|{{ grand_total|floatformat:2 }}'
+                '{% for item in bag_items %}|{{ item.quantity }}{% endfor %}',
+                request)
+        self.assertEqual(rendered, '3|30.00|33.00|3')
+
+
+class BagSummaryTest(TestCase):
+    """ Tests for the bag summary kept in the session """
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Product', description='Test', price='20.00')
+        self.item_id = str(self.product.id)
+
+    def _add_to_bag(self, quantity):
+        return self.client.post(
+            reverse('add_to_bag', args=[self.item_id]),
+            {'quantity': quantity, 'redirect_url': '/'})
+
+    def test_bag_views_keep_the_summary_up_to_date(self):
+        self._add_to_bag(2)
+        summary = self.client.session['bag_summary']
+        self.assertEqual(summary['product_count'], '2')
+        self.assertEqual(Decimal(summary['total']), Decimal('40.00'))
+
+        self.client.post(
+            reverse('adjust_bag', args=[self.item_id]), {'quantity': 3})
+        summary = self.client.session['bag_summary']
+        self.assertEqual(summary['product_count'], '3')
+        self.assertEqual(Decimal(summary['grand_total']), Decimal('60.00'))
+
+        self.client.post(reverse('remove_from_bag', args=[self.item_id]))
+        self.assertNotIn('bag_summary', self.client.session)
+
+    def test_summary_is_used_without_loading_products(self):
+        self._add_to_bag(1)
+        request = RequestFactory().get('/')
+        request.session = dict(self.client.session.items())
+        with self.assertNumQueries(0):
+            rendered = engines['django'].from_string(
+                '{{ grand_total|floatformat:2 }}').render({}, request)
+        self.assertEqual(rendered, '22.00')
+
+    def test_summary_is_recalculated_when_prices_change(self):
+        self._add_to_bag(1)
+        self.product.price = Decimal('60.00')
+        self.product.save()
+        request = RequestFactory().get('/')
+        request.session = dict(self.client.session.items())
+        rendered = engines['django'].from_string(
+            '{{ grand_total|floatformat:2 }}').render({}, request)
+        self.assertEqual(rendered, '60.00')
+        self.assertEqual(
+            Decimal(request.session['bag_summary']['total']),
+            Decimal('60.00'))
+
+
+class BagCodecTest(TestCase):
+    """ Tests for the compact session bag format """
+
+    bag = {
+        '12': 2,
+        '3': {'items_by_size': {'m': 1, 'xl': 4}},
+    }
+
+    def test_round_trip(self):
+        encoded = encode_bag(self.bag)
+        self.assertEqual(encoded, [1, [3, 3, 1], [3, 5, 4], [12, 0, 2]])
+        self.assertEqual(decode_bag(encoded), self.bag)
+        self.assertEqual(loads_bag(dumps_bag(self.bag)), self.bag)
+
+    def test_original_format_is_migrated_on_read(self):
+        self.assertEqual(decode_bag(self.bag), self.bag)
+        self.assertEqual(loads_bag(json.dumps(self.bag)), self.bag)
+        self.assertEqual(decode_bag(None), {})
+
+    def test_unknown_sizes_are_kept(self):
+        bag = {'5': {'items_by_size': {'xxl': 1}}}
+        self.assertEqual(decode_bag(encode_bag(bag)), bag)
+
+    def test_unknown_version_is_rejected(self):
+        with self.assertRaises(ValueError):
+            decode_bag([99, [1, 0, 1]])
+
+    def test_compact_format_is_smaller(self):
+        self.assertLess(len(dumps_bag(self.bag)), len(json.dumps(self.bag)))
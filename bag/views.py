@@ -3,6 +3,8 @@ from django.shortcuts import (
 from django.contrib import messages
 
 from products.models import Product
+from .codec import load_bag, save_bag
+from .contexts import update_bag_summary
 
 
 def view_bag(request):
@@ -22,7 +24,7 @@ def add_to_bag(request, item_id):
         size = request.POST['product_size']
     # Gets the bag variable from the session, or create a new one in an
         # empty dict if it doesn't exist
-    bag = request.session.get('bag', {})
+    bag = load_bag(request)
 
     if size:
         # If the item is already in the bag, update the quantity
@@ -54,7 +56,8 @@ def add_to_bag(request, item_id):
             messages.success(request, f'Added {product.name} to your bag')
 
     # Overwrite the bag variable in the session with the updated version
-    request.session['bag'] = bag
+    save_bag(request, bag)
+    update_bag_summary(request)
     return redirect(redirect_url)
 
 
@@ -66,7 +69,7 @@ def adjust_bag(request, item_id):
     size = None
     if 'product_size' in request.POST:
         size = request.POST['product_size']
-    bag = request.session.get('bag', {})
+    bag = load_bag(request)
 
     if size:
         # If the quantity is greater than 0, update the quantity
@@ -91,7 +94,8 @@ def adjust_bag(request, item_id):
             messages.success(request, f'Removed {product.name} from your bag')
 
     # Overwrite the bag variable in the session with the updated version
-    request.session['bag'] = bag
+    save_bag(request, bag)
+    update_bag_summary(request)
     return redirect(reverse('view_bag'))
 
 
@@ -103,7 +107,7 @@ def remove_from_bag(request, item_id):
         size = None
         if 'product_size' in request.POST:
             size = request.POST['product_size']
-        bag = request.session.get('bag', {})
+        bag = load_bag(request)
 
         if size:
             del bag[item_id]['items_by_size'][size]
@@ -115,7 +119,8 @@ def remove_from_bag(request, item_id):
             bag.pop(item_id)
             messages.success(request, f'Removed {product.name} from your bag')
 
-        request.session['bag'] = bag
+        save_bag(request, bag)
+        update_bag_summary(request)
         return HttpResponse(status=200)
 
     except Exception as e:
@@ -0,0 +1,51 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Tables with fewer rows than this are always counted exactly
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+def estimate_count(queryset):
+    """ The number of rows the database's statistics say the queryset's
+        table has, or None if it is filtered or there are no statistics.
+        Counting every row of a large table reads all of it. """
+    if queryset.query.where or queryset.query.distinct:
+        return None
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # reltuples is -1 until the table is first vacuumed or analyzed
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(table)])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE has been run
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute(
+                'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1',
+                [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    estimate = int(float(str(row[0]).split()[0]))
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """ A paginator for the admin which takes the count of a large
+        unfiltered table from the database's statistics. Filtered lists
+        are counted exactly, as they are usually far smaller. """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+            return estimate
+        return super().count
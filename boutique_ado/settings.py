@@ -93,6 +93,7 @@ TEMPLATES = [
                 'bag.contexts.bag_contents',
                 # This allows us to access the bag_contents function
                 # from anywhere within our site
+                'products.contexts.category_nav',
             ],
             'builtins': [
                 'crispy_forms.templatetags.crispy_forms_tags',
@@ -142,6 +143,42 @@ else:
     }
 
 
+# Cache
+# The catalog versions kept in the cache have to be shared between
+# every worker, so production uses the database cache. The table is
+# created with: python manage.py createcachetable
+# Rendered template fragments and whole catalog pages are stamped with
+# those versions, so each worker can keep its own copy in memory. Pages
+# are far bigger than product cards, so they get a small cache of their
+# own rather than pushing the cards out.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {
+            # room for a card for every product in the catalog
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {
+            # at up to about 80KB a page, this is 25MB per worker
+            'MAX_ENTRIES': 300,
+        },
+    },
+}
+if 'DATABASE_URL' in os.environ:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -188,9 +225,7 @@ STATICFILES_DIRS = [
 ]
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = [
-    BASE_DIR / 'media',
-]
+MEDIA_ROOT = BASE_DIR / 'media'
 
 # AWS
 if 'USE_AWS' in os.environ:
@@ -217,6 +252,18 @@ if 'USE_AWS' in os.environ:
     STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{STATICFILES_LOCATION}/'
     MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{MEDIAFILES_LOCATION}/'
 
+# Products listing
+PRODUCTS_PER_PAGE = 24
+# Serve the listing and product pages from a cache, filling in the
+# parts which differ from visitor to visitor on each request
+CATALOG_PAGE_CACHE = True
+# How many seconds each process goes on using the categories it has
+# loaded before checking whether another process changed them
+CATEGORY_VERSION_CHECK_INTERVAL = 5
+# The widths product image thumbnails are generated at, in pixels. They
+# are made by: python manage.py generate_thumbnails
+PRODUCT_IMAGE_WIDTHS = [200, 400, 800]
+
 # Stripe
 FREE_DELIVERY_THRESHOLD = 50
 STANDARD_DELIVERY_PERCENTAGE = 10
@@ -224,6 +271,17 @@ STRIPE_CURRENCY = 'usd'
 STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_WH_SECRET = os.getenv('STRIPE_WH_SECRET', '')
+# How long the webhook waits for the checkout view to save an order, in
+# seconds, and the first delay between lookups, which doubles each time
+STRIPE_WH_ORDER_WAIT_TIMEOUT = float(
+    os.getenv('STRIPE_WH_ORDER_WAIT_TIMEOUT', 3))
+STRIPE_WH_ORDER_WAIT_DELAY = 0.05
+# Webhook events are processed by: python manage.py process_webhook_events
+# A failed event is retried until it has been attempted this many times,
+# and an event claimed by a worker which died is released after this
+# many seconds
+STRIPE_WH_MAX_ATTEMPTS = 5
+STRIPE_WH_CLAIM_TIMEOUT = 300
 
 # Email
 if 'DEVELOPMENT' in os.environ:
@@ -238,6 +296,12 @@ else:
     EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASS')
     DEFAULT_FROM_EMAIL = os.environ.get('EMAIL_HOST_USER')
 
+# Queued emails are sent by: python manage.py send_queued_emails
+# and given up on after this many attempts. An email claimed by a sender
+# which died is released after this many seconds.
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+EMAIL_QUEUE_CLAIM_TIMEOUT = 300
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Order, OrderLineItem
+
+from boutique_ado.paginators import EstimatedCountPaginator
+from .exports import export_response
+from .models import Order, OrderLineItem, QueuedEmail, WebhookEvent
 
 
 class OrderLineItemAdminInline(admin.TabularInline):
@@ -7,12 +10,21 @@ class OrderLineItemAdminInline(admin.TabularInline):
         right from inside the order model. """
     model = OrderLineItem
     readonly_fields = ('lineitem_total',)
+    # a search box rather than a dropdown of the whole catalog
+    autocomplete_fields = ('product',)
+
+    def get_queryset(self, request):
+        # each line item is shown by its product's sku and order number
+        return super().get_queryset(request).select_related(
+            'product', 'order')
 
 
 class OrderAdmin(admin.ModelAdmin):
     """ Define the admin order display """
     inlines = (OrderLineItemAdminInline,)
 
+    raw_id_fields = ('user_profile',)
+
     readonly_fields = ('order_number', 'date',
                        'delivery_cost', 'order_total',
                        'grand_total', 'original_bag', 'stripe_pid',)
@@ -31,5 +43,53 @@ class OrderAdmin(admin.ModelAdmin):
     ordering = ('-date',)
     # The minus sign indicates descending order
 
+    # its change list template swaps in the indexed_date_hierarchy tag
+    date_hierarchy = 'date'
+    search_fields = ('order_number', 'email', 'full_name',)
+
+    # we only count the orders shown, and estimate that for a large table
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    actions = ('export_csv', 'export_jsonl',)
+
+    @admin.action(description='Export selected orders as CSV')
+    def export_csv(self, request, queryset):
+        # the orders are streamed a chunk at a time, so selecting every
+        # order doesn't load them all
+        return export_response(queryset, 'csv')
+
+    @admin.action(description='Export selected orders as JSON Lines')
+    def export_jsonl(self, request, queryset):
+        return export_response(queryset, 'jsonl')
+
+
+class WebhookEventAdmin(admin.ModelAdmin):
+    """ Define the admin webhook event display """
+    list_display = ('stripe_event_id', 'event_type', 'status',
+                    'attempts', 'received', 'processed_at',)
+
+    list_filter = ('status', 'event_type',)
+
+    readonly_fields = ('stripe_event_id', 'event_type', 'payload',
+                       'received', 'claimed_at', 'processed_at',
+                       'last_error',)
+
+    ordering = ('-received',)
+
+
+class QueuedEmailAdmin(admin.ModelAdmin):
+    """ Define the admin queued email display """
+    list_display = ('to', 'subject', 'status', 'attempts',
+                    'created', 'sent_at',)
+
+    list_filter = ('status',)
+
+    readonly_fields = ('created', 'claimed_at', 'sent_at', 'last_error',)
+
+    ordering = ('-created',)
+
 
 admin.site.register(Order, OrderAdmin)
+admin.site.register(WebhookEvent, WebhookEventAdmin)
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
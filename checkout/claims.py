@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+
+def claim_rows(model, batch_size, pending, claimed, failed, timeout,
+               max_attempts):
+    """ Claim up to batch_size rows of a queue model which are ready,
+        moving them from the pending status to the claimed one. The
+        model needs status, attempts, last_error, available_at and
+        claimed_at fields.
+
+        Each row is claimed with its own conditional update, so when
+        several workers race for the same row only one of them wins.
+        Rows left claimed by a worker which died are claimed again once
+        timeout seconds have passed. That counts as an attempt, as the
+        row may be what killed the worker, and a row which has used up
+        max_attempts that way is given the failed status instead. """
+    now = timezone.now()
+    stale = now - timedelta(seconds=timeout)
+    candidates = model.objects.filter(
+        Q(status=pending, available_at__lte=now)
+        | Q(status=claimed, claimed_at__lt=stale)
+    ).order_by('available_at').values_list(
+        'id', 'status', 'claimed_at', 'attempts')[:batch_size]
+
+    won = []
+    for row_id, status, claimed_at, attempts in candidates:
+        rows = model.objects.filter(
+            id=row_id, status=status, claimed_at=claimed_at)
+        if status == pending:
+            if rows.update(status=claimed, claimed_at=now):
+                won.append(row_id)
+        elif attempts + 1 >= max_attempts:
+            rows.update(status=failed, attempts=F('attempts') + 1,
+                        last_error='The worker stopped before finishing it')
+        elif rows.update(status=claimed, claimed_at=now,
+                         attempts=F('attempts') + 1):
+            won.append(row_id)
+    return list(model.objects.filter(id__in=won).order_by('available_at'))
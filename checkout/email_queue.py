@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.utils import timezone
+
+from .claims import claim_rows
+from .models import QueuedEmail
+
+
+def queue_email(subject, body, to, from_email=None):
+    """ Store an email for the send_queued_emails command to send """
+    return QueuedEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or '',
+        to=','.join(to),
+    )
+
+
+def claim_emails(batch_size):
+    """ Claim up to batch_size emails which are ready to be sent. Emails
+        left sending by a sender which died are claimed again once
+        EMAIL_QUEUE_CLAIM_TIMEOUT seconds have passed, up to
+        EMAIL_QUEUE_MAX_ATTEMPTS times. """
+    return claim_rows(
+        QueuedEmail, batch_size, pending=QueuedEmail.PENDING,
+        claimed=QueuedEmail.SENDING, failed=QueuedEmail.FAILED,
+        timeout=settings.EMAIL_QUEUE_CLAIM_TIMEOUT,
+        max_attempts=settings.EMAIL_QUEUE_MAX_ATTEMPTS)
+
+
+def send_queued_emails(connection, batch_size):
+    """ Send up to batch_size queued emails over the given, already open,
+        connection and return how many were sent and how many failed.
+        Failed emails are retried later with a growing delay. """
+    sent = failed = 0
+    for email in claim_emails(batch_size):
+        message = EmailMessage(
+            email.subject, email.body, email.from_email or None,
+            email.to.split(','), connection=connection)
+        email.attempts += 1
+        try:
+            message.send()
+        except Exception as e:
+            failed += 1
+            email.last_error = str(e)
+            if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+                email.status = QueuedEmail.FAILED
+            else:
+                email.status = QueuedEmail.PENDING
+                email.available_at = timezone.now() + timedelta(
+                    seconds=min(2 ** email.attempts * 30, 3600))
+        else:
+            # each email is marked as soon as it has gone, so a sender
+            # which dies part way through a batch doesn't send it again
+            sent += 1
+            email.status = QueuedEmail.SENT
+            email.sent_at = timezone.now()
+        email.save(update_fields=[
+            'attempts', 'last_error', 'status', 'available_at', 'sent_at'])
+    return sent, failed
@@ -0,0 +1,115 @@
+import csv
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Order, OrderLineItem
+
+# How many orders are read from the database at a time
+EXPORT_CHUNK_SIZE = 2000
+
+ORDER_COLUMNS = ('order_number', 'date', 'full_name', 'email',
+                 'phone_number', 'country', 'postcode', 'town_or_city',
+                 'street_address1', 'street_address2', 'county',
+                 'delivery_cost', 'order_total', 'grand_total', 'stripe_pid')
+LINEITEM_COLUMNS = ('product__sku', 'product__name', 'product_size',
+                    'quantity', 'lineitem_total')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def iter_order_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """ Yield the orders in the queryset a chunk at a time, as lists of
+        (order, line items) with each as a dict of the exported columns.
+
+        The orders are read through one server side cursor, and the line
+        items for each chunk with one more query, so only one chunk is
+        ever held in memory. """
+    orders = queryset.order_by('pk').values_list('pk', *ORDER_COLUMNS)
+    chunk = []
+    for row in orders.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _with_lineitems(chunk)
+            chunk = []
+    if chunk:
+        yield _with_lineitems(chunk)
+
+
+def _with_lineitems(rows):
+    lineitems = defaultdict(list)
+    for order_id, *values in OrderLineItem.objects.filter(
+            order_id__in=[row[0] for row in rows]).order_by(
+            'pk').values_list('order_id', *LINEITEM_COLUMNS):
+        lineitems[order_id].append(dict(zip(LINEITEM_COLUMNS, values)))
+    return [(dict(zip(ORDER_COLUMNS, row[1:])), lineitems[row[0]])
+            for row in rows]
+
+
+# A spreadsheet runs a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Echo:
+    """ A file for csv.writer which hands back each line it is given """
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    # text the customer typed is quoted so a spreadsheet shows it as it
+    # is, numbers like a negative total are left alone
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def export_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """ Yield the orders as CSV, a chunk of orders at a time, with a row
+        for each line item. Orders without line items get one row. """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(ORDER_COLUMNS + LINEITEM_COLUMNS)
+    empty = [''] * len(LINEITEM_COLUMNS)
+    for chunk in iter_order_chunks(queryset, chunk_size):
+        lines = []
+        for order, lineitems in chunk:
+            order_values = [_cell(order[column])
+                            for column in ORDER_COLUMNS]
+            for lineitem in lineitems or [None]:
+                lineitem_values = ([_cell(lineitem[column])
+                                    for column in LINEITEM_COLUMNS]
+                                   if lineitem else empty)
+                lines.append(writer.writerow(order_values + lineitem_values))
+        yield ''.join(lines)
+
+
+def export_jsonl(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """ Yield the orders as JSON Lines, a chunk of orders at a time, with
+        each order's line items in a list on its line """
+    encoder = DjangoJSONEncoder()
+    for chunk in iter_order_chunks(queryset, chunk_size):
+        yield ''.join(
+            encoder.encode(dict(order, lineitems=lineitems)) + '\n'
+            for order, lineitems in chunk)
+
+
+def export_orders(queryset, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """ Yield the orders in the given format, 'csv' or 'jsonl' """
+    exporter = export_csv if export_format == 'csv' else export_jsonl
+    return exporter(queryset, chunk_size)
+
+
+def export_response(queryset, export_format):
+    """ A response which streams the orders to the browser as a download,
+        so it starts straight away and never holds them all """
+    response = StreamingHttpResponse(
+        export_orders(queryset, export_format),
+        content_type=EXPORT_FORMATS[export_format])
+    filename = f'orders-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,100 @@
+import os
+import resource
+import tempfile
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from checkout.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_orders
+from checkout.models import Order, OrderLineItem
+from products.models import Product
+
+SEED_BATCH_SIZE = 5000
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = ('Time exporting a synthetic set of orders in each format, '
+            'with the peak memory of the process. The orders are added in '
+            'a transaction which is rolled back, so the database is left '
+            'as it was.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--orders', type=int, default=100000,
+            help='Number of synthetic orders to export')
+        parser.add_argument(
+            '--lines', type=int, default=2,
+            help='Number of line items on each order')
+        parser.add_argument(
+            '--format', choices=sorted(EXPORT_FORMATS), action='append',
+            help='Format to time, every format if none is given')
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help='Number of orders read from the database at a time')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options)
+            transaction.set_rollback(True)
+
+    def _run(self, options):
+        start = time.monotonic()
+        self._seed(options['orders'], options['lines'])
+        self.stdout.write(
+            f'{options["orders"]} orders with {options["lines"]} line items '
+            f'each, seeded in {time.monotonic() - start:.1f}s, peak RSS '
+            f'{_peak_rss_mb():.0f} MB')
+
+        for export_format in options['format'] or sorted(EXPORT_FORMATS):
+            with tempfile.TemporaryFile(
+                    'w', newline='', encoding='utf-8') as output:
+                start = time.monotonic()
+                output.writelines(export_orders(
+                    Order.objects.all(), export_format,
+                    options['chunk_size']))
+                output.flush()
+                elapsed = time.monotonic() - start
+                written = os.fstat(output.fileno()).st_size
+            self.stdout.write(
+                f'  {export_format}: {elapsed:.1f}s, peak RSS '
+                f'{_peak_rss_mb():.0f} MB, {written / 1e6:.1f} MB written')
+
+    def _seed(self, count, lines):
+        """ Add count orders with lines line items each, a batch at a time
+            without the save signals, so seeding itself stays small """
+        product, = Product.objects.bulk_create([Product(
+            sku=f'bench-{uuid.uuid4().hex[:8]}', name='Benchmark product',
+            description='Synthetic', price=Decimal('12.50'))])
+        if product.pk is None:
+            # not every database hands back the pks from a bulk insert
+            product = Product.objects.get(sku=product.sku)
+        last_pk = Order.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        for first in range(0, count, SEED_BATCH_SIZE):
+            Order.objects.bulk_create([
+                Order(order_number=f'{number:032X}',
+                      full_name=f'Customer {number}',
+                      email=f'customer{number}@example.com',
+                      phone_number='0123456789', country='GB',
+                      postcode='AB1 2CD', town_or_city='Town',
+                      street_address1=f'{number} Street',
+                      order_total=Decimal('12.50') * lines,
+                      grand_total=Decimal('12.50') * lines)
+                for number in range(first,
+                                    min(first + SEED_BATCH_SIZE, count))])
+            order_ids = list(Order.objects.filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', flat=True))
+            last_pk = order_ids[-1]
+            OrderLineItem.objects.bulk_create([
+                OrderLineItem(order_id=order_id, product=product,
+                              product_size='M', quantity=1,
+                              lineitem_total=Decimal('12.50'))
+                for order_id in order_ids for _ in range(lines)])
@@ -0,0 +1,69 @@
+import argparse
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from checkout.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_orders
+from checkout.models import Order
+
+
+def date(value):
+    """ An argparse type for a YYYY-MM-DD date """
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise argparse.ArgumentTypeError(
+            f'{value!r} is not a date as YYYY-MM-DD')
+    return parsed
+
+
+class Command(BaseCommand):
+    help = 'Export orders and their line items as CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=sorted(EXPORT_FORMATS), default='csv',
+            help='csv has a row per line item, jsonl a line per order')
+        parser.add_argument(
+            '--output', '-o',
+            help='File to write to, instead of standard output')
+        parser.add_argument(
+            '--since', type=date,
+            help='Only export orders made on or after this date, '
+                 'as YYYY-MM-DD')
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help='Number of orders read from the database at a time')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['since']:
+            # compared with the start of the day rather than the date of
+            # each order, so the index on date can be used
+            orders = orders.filter(date__gte=timezone.make_aware(
+                datetime.datetime.combine(options['since'],
+                                          datetime.time.min)))
+
+        parts = export_orders(orders, options['format'],
+                              options['chunk_size'])
+        start = time.monotonic()
+        if not options['output']:
+            for part in parts:
+                self.stdout.write(part, ending='')
+            return
+        try:
+            with open(options['output'], 'w', newline='',
+                      encoding='utf-8') as output:
+                output.writelines(parts)
+        except OSError as error:
+            raise CommandError(
+                f'Could not write {options["output"]}: {error}')
+        elapsed = time.monotonic() - start
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {orders.count()} orders to {options["output"]} '
+            f'in {elapsed:.1f}s'))
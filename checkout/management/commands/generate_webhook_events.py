@@ -0,0 +1,76 @@
+import json
+import random
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bag.codec import dumps_bag
+from checkout.models import WebhookEvent
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Store synthetic payment_intent.succeeded events so the '
+            'webhook worker can be exercised without Stripe')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100)
+        parser.add_argument(
+            '--lines', type=int, default=3,
+            help='Number of products in the bag of each event')
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        if not product_ids:
+            raise CommandError('There are no products to put in the bags')
+
+        events = []
+        for _ in range(options['count']):
+            pid = f'pi_{uuid.uuid4().hex}'
+            bag = {
+                str(product_id): random.randint(1, 3)
+                for product_id in random.sample(
+                    product_ids, min(options['lines'], len(product_ids)))
+            }
+            payload = {
+                'id': f'evt_{uuid.uuid4().hex}',
+                'object': 'event',
+                'type': 'payment_intent.succeeded',
+                'data': {'object': {
+                    'id': pid,
+                    'object': 'payment_intent',
+                    'metadata': {
+                        'bag': dumps_bag(bag),
+                        'save_info': '',
+                        'username': 'AnonymousUser',
+                    },
+                    # the charge is included expanded, so the handler
+                    # doesn't need to retrieve it from Stripe
+                    'latest_charge': {
+                        'id': f'ch_{uuid.uuid4().hex}',
+                        'object': 'charge',
+                        'billing_details': {'email': 'test@example.com'},
+                    },
+                    'shipping': {
+                        'name': 'Test Customer',
+                        'phone': '0123456789',
+                        'address': {
+                            'city': 'Town',
+                            'country': 'GB',
+                            'line1': '1 Street',
+                            'line2': 'Flat 1',
+                            'postal_code': 'AB1 2CD',
+                            'state': 'County',
+                        },
+                    },
+                }},
+            }
+            events.append(WebhookEvent(
+                stripe_event_id=payload['id'],
+                event_type=payload['type'],
+                payload=json.dumps(payload),
+            ))
+
+        WebhookEvent.objects.bulk_create(events, batch_size=500)
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {len(events)} webhook events'))
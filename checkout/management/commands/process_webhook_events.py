@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from checkout.webhook_inbox import claim_events, process_event
+
+import stripe
+
+
+class Command(BaseCommand):
+    help = 'Process the Stripe webhook events stored by the webhook view'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of events to process concurrently')
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help='Number of events each worker claims at a time')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1,
+            help='Seconds to wait when there are no events to process')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Stop once there are no events left instead of waiting')
+
+    def handle(self, *args, **options):
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        self.stopping = threading.Event()
+
+        work_args = (options['batch_size'], options['poll_interval'],
+                     options['once'])
+        start = time.monotonic()
+        if options['workers'] == 1:
+            results = [self._work(*work_args)]
+        else:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                futures = [pool.submit(self._work, *work_args)
+                           for _ in range(options['workers'])]
+                try:
+                    results = [future.result() for future in futures]
+                except KeyboardInterrupt:
+                    # let the workers finish the events they have claimed
+                    self.stopping.set()
+                    results = [future.result() for future in futures]
+        elapsed = time.monotonic() - start
+
+        processed = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} events ({failed} failed or retrying) '
+            f'in {elapsed:.2f}s, {rate:.1f} events/s'))
+
+    def _work(self, batch_size, poll_interval, once):
+        """ Claim and process events until told to stop """
+        processed = failed = 0
+        try:
+            while not self.stopping.is_set():
+                events = claim_events(batch_size)
+                if not events:
+                    if once:
+                        break
+                    self.stopping.wait(poll_interval)
+                    continue
+                for event in events:
+                    if process_event(event):
+                        processed += 1
+                    else:
+                        failed += 1
+        except KeyboardInterrupt:
+            # only reached when running in the main thread
+            pass
+        finally:
+            # each worker thread has its own database connection
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+        return processed, failed
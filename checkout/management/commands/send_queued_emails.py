@@ -0,0 +1,60 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from checkout.email_queue import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Send the emails queued by the site over a single connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Number of emails to send in each batch')
+        parser.add_argument(
+            '--poll-interval', type=float, default=5,
+            help='Seconds to wait when there are no emails to send')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Stop once the queue is empty instead of waiting')
+
+    def handle(self, *args, **options):
+        sent = failed = 0
+        start = time.monotonic()
+        connection = None
+        try:
+            while True:
+                if connection is None:
+                    # the connection is kept open between batches and only
+                    # reopened after the queue has been empty for a while
+                    connection = get_connection()
+                    connection.open()
+                batch_sent, batch_failed = send_queued_emails(
+                    connection, options['batch_size'])
+                sent += batch_sent
+                failed += batch_failed
+                if batch_failed:
+                    # start the next batch on a fresh connection in case
+                    # this one was dropped by the server
+                    connection.close()
+                    connection = None
+                if batch_sent or batch_failed:
+                    continue
+                if options['once']:
+                    break
+                connection.close()
+                connection = None
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if connection is not None:
+                connection.close()
+
+        elapsed = time.monotonic() - start
+        rate = sent / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {sent} emails ({failed} failed) in {elapsed:.2f}s, '
+            f'{rate:.1f} emails/s'))
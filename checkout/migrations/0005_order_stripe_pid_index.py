@@ -0,0 +1,42 @@
+# Generated by Django 3.2.24 on 2026-10-18 01:16
+
+from django.db import migrations, models
+
+
+def suffix_duplicate_stripe_pids(apps, schema_editor):
+    """ The webhook used to miss orders it should have matched and
+        create a second order for the same payment intent. The earliest
+        order keeps the stripe_pid, and the later ones get their own pk
+        added to it so the unique constraint can be added while the
+        payment intent they came from can still be seen. """
+    Order = apps.get_model('checkout', 'Order')
+    duplicated = Order.objects.exclude(stripe_pid='').values(
+        'stripe_pid').annotate(orders=models.Count('pk')).filter(
+        orders__gt=1).values_list('stripe_pid', flat=True)
+    for stripe_pid in list(duplicated):
+        orders = Order.objects.filter(stripe_pid=stripe_pid).order_by(
+            'date', 'pk')
+        for order in orders[1:]:
+            order.stripe_pid = f'{stripe_pid}-duplicate-{order.pk}'
+            order.save(update_fields=['stripe_pid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0004_order_user_profile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='stripe_pid',
+            field=models.CharField(db_index=True, default='', max_length=254),
+        ),
+        migrations.RunPython(suffix_duplicate_stripe_pids,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_pid', ''), _negated=True), fields=('stripe_pid',), name='unique_order_stripe_pid'),
+        ),
+    ]
@@ -3,6 +3,7 @@ import uuid
 from django.db import models
 from django.db.models import Sum
 from django.conf import settings
+from django.utils import timezone
 
 from django_countries.fields import CountryField
 
@@ -12,6 +13,18 @@ from profiles.models import UserProfile
 
 class Order(models.Model):
     """ A model to store order information """
+
+    class Meta:
+        constraints = [
+            # Each payment intent can only ever produce one order, which
+            # stops the checkout view and the webhook both creating it
+            models.UniqueConstraint(
+                fields=['stripe_pid'],
+                condition=~models.Q(stripe_pid=''),
+                name='unique_order_stripe_pid',
+            ),
+        ]
+
     order_number = models.CharField(max_length=32, null=False, editable=False)
     user_profile = models.ForeignKey(UserProfile,
                                      on_delete=models.SET_NULL,
@@ -26,7 +39,7 @@ class Order(models.Model):
     street_address1 = models.CharField(max_length=80, null=False, blank=False)
     street_address2 = models.CharField(max_length=80, null=False, blank=True)
     county = models.CharField(max_length=80, null=False, blank=True)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
     delivery_cost = models.DecimalField(max_digits=6, decimal_places=2,
                                         null=False, default=0)
     order_total = models.DecimalField(max_digits=10, decimal_places=2,
@@ -35,25 +48,31 @@ class Order(models.Model):
                                       null=False, default=0)
     original_bag = models.TextField(null=False, blank=False, default='')
     stripe_pid = models.CharField(max_length=254,
-                                  null=False, blank=False, default='')
+                                  null=False, blank=False, default='',
+                                  db_index=True)
 
     def _generate_order_number(self):
         """ Generate a random, unique 32 char order number using UUID """
         return uuid.uuid4().hex.upper()
 
-    def update_total(self):
-        """ Update grand total each time a line item is added,
-            accounting for delivery costs """
-
-        self.order_total = (
-            self.lineitems.aggregate(
-                Sum('lineitem_total'))['lineitem_total__sum'] or 0)
+    def calculate_totals(self, order_total):
+        """ Set the order total, accounting for delivery costs,
+            without saving the order """
+        self.order_total = order_total
         if self.order_total < settings.FREE_DELIVERY_THRESHOLD:
             self.delivery_cost = (
                 self.order_total * settings.STANDARD_DELIVERY_PERCENTAGE / 100)
         else:
             self.delivery_cost = 0
         self.grand_total = self.order_total + self.delivery_cost
+
+    def update_total(self):
+        """ Update grand total each time a line item is added,
+            accounting for delivery costs """
+
+        self.calculate_totals(
+            self.lineitems.aggregate(
+                Sum('lineitem_total'))['lineitem_total__sum'] or 0)
         self.save()
 
     def save(self, *args, **kwargs):
@@ -86,13 +105,97 @@ class OrderLineItem(models.Model):
         editable=False
     )
 
+    def calculate_lineitem_total(self):
+        """ Set the line item total from the product price """
+        self.lineitem_total = self.product.price * self.quantity
+
     def save(self, *args, **kwargs):
         """ Override the original save method to set the
             line item total and update the order total """
-        self.lineitem_total = self.product.price * self.quantity
+        self.calculate_lineitem_total()
         super().save(*args, **kwargs)
 
     def __str__(self):
         """ Return the product sku and the order number
             its apart of as a string """
         return f'SKU {self.product.sku} on order {self.order.order_number}'
+
+
+class WebhookEvent(models.Model):
+    """ A model to store Stripe webhook events until a worker
+        has processed them """
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    class Meta:
+        indexes = [
+            # Used by the workers to find the next events to process
+            models.Index(fields=['status', 'available_at'],
+                         name='webhookevent_status_idx'),
+        ]
+
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    received = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """ Return the Stripe event id and type as a string """
+        return f'{self.stripe_event_id} ({self.event_type})'
+
+
+class QueuedEmail(models.Model):
+    """ A model to store emails until the send_queued_emails
+        command sends them """
+
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    class Meta:
+        indexes = [
+            # Used by the sender to find the next emails to send
+            models.Index(fields=['status', 'available_at'],
+                         name='queuedemail_status_idx'),
+        ]
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField()
+    # Left blank to send from DEFAULT_FROM_EMAIL
+    from_email = models.CharField(max_length=254, blank=True, default='')
+    to = models.TextField(help_text='Comma separated recipients')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """ Return the recipients and subject as a string """
+        return f'{self.to}: {self.subject}'
@@ -0,0 +1,41 @@
+from django.db import transaction
+
+from bag.codec import bag_lines
+from bag.contexts import get_bag_products
+from products.models import Product
+from .models import OrderLineItem
+
+
+def save_order(order, bag):
+    """ Save a new order along with a line item for each line in the
+        decoded bag.
+
+        The products are fetched in one query and the line items are built
+        in memory, so the totals are worked out once and every line item is
+        inserted with a single query instead of each save firing the signal
+        that recalculates the order. Everything is saved in one transaction,
+        so if a product in the bag no longer exists Product.DoesNotExist is
+        raised and nothing is left behind. """
+
+    products = get_bag_products(bag)
+    line_items = []
+    for item_id, size, quantity in bag_lines(bag):
+        product = products.get(item_id)
+        if product is None:
+            raise Product.DoesNotExist(
+                f'Product {item_id} in the bag does not exist')
+        line_item = OrderLineItem(
+            order=order,
+            product=product,
+            quantity=quantity,
+            product_size=size,
+        )
+        line_item.calculate_lineitem_total()
+        line_items.append(line_item)
+
+    order.calculate_totals(
+        sum(line_item.lineitem_total for line_item in line_items))
+    with transaction.atomic():
+        order.save()
+        OrderLineItem.objects.bulk_create(line_items)
+    return order
@@ -1,3 +1,593 @@
-from django.test import TestCase
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from bag.codec import dumps_bag, encode_bag, loads_bag
+from products.models import Product
+from .exports import export_csv, export_jsonl
+from .models import Order, QueuedEmail, WebhookEvent
+from .templatetags.order_admin import indexed_date_hierarchy
+from .email_queue import claim_emails, queue_email, send_queued_emails
+from .orders import save_order
+from .webhook_handler import StripeWH_Handler
+from .webhook_inbox import claim_events, process_event
+
+import stripe
+
+
+class CheckoutOrderTest(TestCase):
+    """ Tests for creating orders from the checkout form """
+
+    form_data = {
+        'full_name': 'Test User',
+        'email': 'test@example.com',
+        'phone_number': '0123456789',
+        'country': 'GB',
+        'postcode': 'AB1 2CD',
+        'town_or_city': 'Town',
+        'street_address1': '1 Street',
+        'street_address2': '',
+        'county': '',
+        'client_secret': 'pi_123_secret_456',
+    }
+
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='Test', price='5.00')
+            for i in range(20)
+        ])
+        self.product_ids = list(
+            Product.objects.values_list('id', flat=True).order_by('id'))
+
+    def _set_bag(self, bag):
+        session = self.client.session
+        session['bag'] = encode_bag(bag)
+        session.save()
+
+    def _checkout(self, bag, pid='pi_123'):
+        self._set_bag(bag)
+        form_data = dict(self.form_data, client_secret=f'{pid}_secret_456')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('checkout'), form_data)
+        return response, len(queries)
+
+    def test_order_is_created_with_totals(self):
+        pk = str(self.product_ids[0])
+        response, _ = self._checkout(
+            {pk: {'items_by_size': {'s': 2, 'm': 1}}})
+        order = Order.objects.get()
+        self.assertRedirects(
+            response, reverse('checkout_success', args=[order.order_number]),
+            fetch_redirect_response=False)
+        self.assertEqual(order.lineitems.count(), 2)
+        self.assertEqual(order.order_total, Decimal('15.00'))
+        self.assertEqual(order.delivery_cost, Decimal('1.50'))
+        self.assertEqual(order.grand_total, Decimal('16.50'))
+        self.assertEqual(order.stripe_pid, 'pi_123')
+
+    def test_query_count_does_not_grow_with_the_bag(self):
+        _, one_line = self._checkout({str(self.product_ids[0]): 1})
+        _, many_lines = self._checkout(
+            {str(pk): 2 for pk in self.product_ids}, pid='pi_456')
+        self.assertEqual(one_line, many_lines)
+        order = Order.objects.latest('id')
+        self.assertEqual(order.lineitems.count(), 20)
+        self.assertEqual(order.grand_total, Decimal('200.00'))
+
+    def test_missing_product_leaves_no_order(self):
+        response, _ = self._checkout(
+            {str(self.product_ids[0]): 1, '999999': 1})
+        self.assertRedirects(
+            response, reverse('view_bag'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class SaveOrderTest(TestCase):
+    """ Tests for the order builder shared by checkout and the webhook """
+
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='Test', price='1.00')
+            for i in range(500)
+        ])
+        self.product_ids = list(
+            Product.objects.values_list('id', flat=True).order_by('id'))
+
+    def _order(self):
+        return Order(
+            full_name='Test User', email='test@example.com',
+            phone_number='0123456789', country='GB',
+            town_or_city='Town', street_address1='1 Street')
+
+    def test_query_count_is_constant(self):
+        for size in (1, 100):
+            bag = {str(pk): 1 for pk in self.product_ids[:size]}
+            with CaptureQueriesContext(connection) as queries:
+                order = save_order(self._order(), bag)
+            if size == 1:
+                expected = len(queries)
+            self.assertEqual(len(queries), expected)
+            self.assertEqual(order.lineitems.count(), size)
+            self.assertEqual(order.order_total, size)
+
+    def test_missing_product_raises(self):
+        with self.assertRaises(Product.DoesNotExist):
+            save_order(self._order(), {'999999': 1})
+        self.assertFalse(Order.objects.exists())
+
+
+def make_payment_intent_event(pid, bag, username='AnonymousUser'):
+    """ Build a payment_intent.succeeded event like the one Stripe sends """
+    return stripe.Event.construct_from({
+        'id': f'evt_{pid}',
+        'type': 'payment_intent.succeeded',
+        'data': {'object': {
+            'id': pid,
+            'latest_charge': f'ch_{pid}',
+            'metadata': {
+                'bag': bag, 'save_info': '', 'username': username},
+            'shipping': {
+                'name': 'Test User',
+                'phone': '0123456789',
+                'address': {
+                    'city': 'Town', 'country': 'GB', 'line1': '1 Street',
+                    'line2': 'Flat 1', 'postal_code': 'AB1 2CD',
+                    'state': 'County',
+                },
+            },
+        }},
+    }, 'sk_test')
+
+
+@override_settings(STRIPE_WH_ORDER_WAIT_TIMEOUT=0)
+class WebhookHandlerTest(TestCase):
+    """ Tests for the payment_intent.succeeded webhook handler """
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Product', description='Test', price='10.00')
+        self.bag = dumps_bag({str(self.product.id): 2})
+        charge = stripe.Charge.construct_from({
+            'amount': 2200,
+            'billing_details': {'email': 'test@example.com'},
+        }, 'sk_test')
+        patcher = mock.patch('stripe.Charge.retrieve', return_value=charge)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _handle(self, pid):
+        handler = StripeWH_Handler(RequestFactory().post('/checkout/wh/'))
+        return handler.handle_payment_intent_succeeded(
+            make_payment_intent_event(pid, self.bag))
+
+    def test_creates_missing_order(self):
+        response = self._handle('pi_new')
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(stripe_pid='pi_new')
+        self.assertEqual(order.lineitems.count(), 1)
+        self.assertEqual(order.grand_total, Decimal('22.00'))
+        # the confirmation email is queued rather than sent
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            QueuedEmail.objects.get().to, 'test@example.com')
+
+    def test_finds_existing_order_by_payment_intent(self):
+        save_order(Order(
+            full_name='Test User', email='test@example.com',
+            phone_number='0123456789', country='GB', town_or_city='Town',
+            street_address1='1 Street', stripe_pid='pi_existing',
+            original_bag=self.bag), loads_bag(self.bag))
+        # one query to find the order and one to queue the email
+        with self.assertNumQueries(2):
+            response = self._handle('pi_existing')
+        self.assertIn(b'already in database', response.content)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_checkout_uses_order_saved_by_webhook(self):
+        self._handle('pi_123')
+        session = self.client.session
+        session['bag'] = encode_bag(loads_bag(self.bag))
+        session.save()
+        response = self.client.post(
+            reverse('checkout'), CheckoutOrderTest.form_data)
+        order = Order.objects.get()
+        self.assertRedirects(
+            response, reverse('checkout_success', args=[order.order_number]),
+            fetch_redirect_response=False)
+
+
+@override_settings(STRIPE_WH_ORDER_WAIT_TIMEOUT=0)
+class WebhookInboxTest(TestCase):
+    """ Tests for storing webhook events and processing them later """
+
+    def setUp(self):
+        Product.objects.create(name='Product', description='Test', price='10')
+
+    def test_webhook_view_only_stores_the_event(self):
+        event = make_payment_intent_event('pi_view', '[1]')
+        payload = json.dumps(event.to_dict_recursive())
+        with mock.patch('stripe.Webhook.construct_event', return_value=event):
+            for _ in range(2):
+                response = self.client.post(
+                    reverse('webhook'), payload,
+                    content_type='application/json',
+                    HTTP_STRIPE_SIGNATURE='sig')
+                self.assertEqual(response.status_code, 200)
+        webhook_event = WebhookEvent.objects.get()
+        self.assertEqual(webhook_event.stripe_event_id, 'evt_pi_view')
+        self.assertEqual(webhook_event.status, WebhookEvent.PENDING)
+        self.assertFalse(Order.objects.exists())
+
+    def test_worker_processes_generated_events(self):
+        call_command('generate_webhook_events', count=5, stdout=StringIO())
+        out = StringIO()
+        call_command(
+            'process_webhook_events', once=True, stdout=out)
+        self.assertIn('Processed 5 events', out.getvalue())
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertFalse(WebhookEvent.objects.exclude(
+            status=WebhookEvent.DONE).exists())
+        self.assertEqual(claim_events(10), [])
+
+    def test_failed_events_are_retried_then_given_up(self):
+        WebhookEvent.objects.create(
+            stripe_event_id='evt_bad', event_type='payment_intent.succeeded',
+            payload='not json')
+        for _ in range(settings.STRIPE_WH_MAX_ATTEMPTS):
+            webhook_event = WebhookEvent.objects.get()
+            webhook_event.available_at = timezone.now()
+            webhook_event.save()
+            self.assertEqual(len(claim_events(10)), 1)
+            self.assertFalse(process_event(WebhookEvent.objects.get()))
+        webhook_event = WebhookEvent.objects.get()
+        self.assertEqual(webhook_event.status, WebhookEvent.FAILED)
+        self.assertEqual(webhook_event.attempts,
+                         settings.STRIPE_WH_MAX_ATTEMPTS)
+
+    @override_settings(STRIPE_WH_CLAIM_TIMEOUT=-1, STRIPE_WH_MAX_ATTEMPTS=3)
+    def test_an_event_which_kills_the_worker_is_given_up(self):
+        WebhookEvent.objects.create(
+            stripe_event_id='evt_crash', event_type='payment_intent.succeeded',
+            payload='{}')
+        # the worker dies each time before it can record the attempt, and
+        # each claim made again once it has timed out counts as one
+        for attempts in (0, 0, 1):
+            self.assertEqual(WebhookEvent.objects.get().attempts, attempts)
+            self.assertEqual(len(claim_events(10)), 1)
+        self.assertEqual(claim_events(10), [])
+        webhook_event = WebhookEvent.objects.get()
+        self.assertEqual(webhook_event.status, WebhookEvent.FAILED)
+        self.assertEqual(webhook_event.attempts, 3)
+
+
+class EmailQueueTest(TestCase):
+    """ Tests for queueing emails and sending them in batches """
+
+    def test_queued_emails_are_sent_over_one_connection(self):
+        for i in range(5):
+            queue_email(f'Subject {i}', 'Body', [f'user{i}@example.com'])
+        out = StringIO()
+        with mock.patch('checkout.management.commands.send_queued_emails.'
+                        'get_connection', wraps=get_connection) as connect:
+            call_command(
+                'send_queued_emails', once=True, batch_size=2, stdout=out)
+        self.assertEqual(connect.call_count, 1)
+        self.assertIn('Sent 5 emails', out.getvalue())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].to, ['user0@example.com'])
+        self.assertFalse(QueuedEmail.objects.exclude(
+            status=QueuedEmail.SENT).exists())
+
+    def test_failed_emails_are_retried_later(self):
+        queue_email('Subject', 'Body', ['user@example.com'])
+        with mock.patch('django.core.mail.EmailMessage.send',
+                        side_effect=OSError('Connection refused')):
+            self.assertEqual(send_queued_emails(get_connection(), 10), (0, 1))
+        email = QueuedEmail.objects.get()
+        self.assertEqual(email.status, QueuedEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.available_at, timezone.now())
+        # it isn't sent again until the retry delay has passed
+        self.assertEqual(send_queued_emails(get_connection(), 10), (0, 0))
+
+    def test_an_email_is_claimed_by_one_sender(self):
+        for i in range(3):
+            queue_email(f'Subject {i}', 'Body', ['user@example.com'])
+        first = claim_emails(2)
+        self.assertEqual(len(first), 2)
+        # a second sender only gets the email the first didn't claim
+        self.assertEqual([email.subject for email in claim_emails(10)],
+                         ['Subject 2'])
+        self.assertEqual(claim_emails(10), [])
+
+    def test_emails_sent_before_a_crash_are_not_sent_again(self):
+        for i in range(3):
+            queue_email(f'Subject {i}', 'Body', ['user@example.com'])
+        send = mock.Mock(side_effect=[1, KeyboardInterrupt])
+        with mock.patch('django.core.mail.EmailMessage.send', send):
+            with self.assertRaises(KeyboardInterrupt):
+                send_queued_emails(get_connection(), 10)
+        self.assertEqual(
+            QueuedEmail.objects.get(subject='Subject 0').status,
+            QueuedEmail.SENT)
+        # the rest stay claimed until the claim times out, and the one
+        # which went out isn't sent again
+        self.assertEqual(send_queued_emails(get_connection(), 10), (0, 0))
+        with override_settings(EMAIL_QUEUE_CLAIM_TIMEOUT=-1):
+            self.assertEqual(send_queued_emails(get_connection(), 10), (2, 0))
+        self.assertEqual([message.subject for message in mail.outbox],
+                         ['Subject 1', 'Subject 2'])
+
+
+class PaymentIntentCacheTest(TestCase):
+    """ Tests for reusing the Stripe payment intent for the bag """
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Product', description='Test', price='10.00')
+        self.item_id = str(self.product.id)
+        intent = stripe.PaymentIntent.construct_from(
+            {'id': 'pi_1', 'client_secret': 'pi_1_secret_1'}, 'sk_test')
+        create = mock.patch(
+            'stripe.PaymentIntent.create', return_value=intent)
+        modify = mock.patch('stripe.PaymentIntent.modify')
+        self.create = create.start()
+        self.modify = modify.start()
+        self.addCleanup(create.stop)
+        self.addCleanup(modify.stop)
+
+    def _set_bag(self, bag):
+        session = self.client.session
+        session['bag'] = encode_bag(bag)
+        session.save()
+
+    def test_unchanged_bag_reuses_the_intent(self):
+        self._set_bag({self.item_id: 1})
+        for _ in range(3):
+            response = self.client.get(reverse('checkout'))
+            self.assertEqual(response.context['client_secret'],
+                             'pi_1_secret_1')
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(self.create.call_args.kwargs['amount'], 1100)
+        self.modify.assert_not_called()
+
+    def test_intent_is_not_reused_after_a_failed_post(self):
+        self._set_bag({self.item_id: 1})
+        self.client.get(reverse('checkout'))
+        # the card has been charged, but the form is then rejected
+        self.client.post(reverse('checkout'), {
+            'client_secret': 'pi_1_secret_1', 'full_name': '',
+            'email': 'test@example.com', 'phone_number': '0123456789',
+            'country': 'GB', 'postcode': '', 'town_or_city': 'Town',
+            'street_address1': '1 Street', 'street_address2': '',
+            'county': ''})
+        # the form shown again gets a new intent
+        self.assertEqual(self.create.call_count, 2)
+        # and the new one is what the page keeps using
+        self.client.get(reverse('checkout'))
+        self.assertEqual(self.create.call_count, 2)
+        self.modify.assert_not_called()
+
+    def test_changed_total_updates_the_intent(self):
+        self._set_bag({self.item_id: 1})
+        self.client.get(reverse('checkout'))
+        self._set_bag({self.item_id: 2})
+        response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.context['client_secret'], 'pi_1_secret_1')
+        self.assertEqual(self.create.call_count, 1)
+        self.modify.assert_called_once_with('pi_1', amount=2200)
+
+    def test_intent_is_not_reused_after_a_successful_order(self):
+        self._set_bag({self.item_id: 1})
+        self.client.get(reverse('checkout'))
+        order = save_order(Order(
+            full_name='Test User', email='test@example.com',
+            phone_number='0123456789', country='GB', town_or_city='Town',
+            street_address1='1 Street', stripe_pid='pi_1'),
+            {self.item_id: 1})
+        self.client.get(
+            reverse('checkout_success', args=[order.order_number]))
+        self.assertNotIn('payment_intent', self.client.session)
+
+
+class OrderExportTest(TestCase):
+    """ Tests for streaming orders out as CSV and JSON Lines """
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            sku='sku1', name='Shirt', description='Test', price='10.00')
+        self.orders = [save_order(Order(
+            full_name=f'Customer {i}', email='test@example.com',
+            phone_number='0123456789', country='GB', town_or_city='Town',
+            street_address1='1 Street'), {str(self.product.id): i + 1})
+            for i in range(5)]
+        self.empty = Order.objects.create(
+            full_name='No Items', email='test@example.com',
+            phone_number='0123456789', country='GB', town_or_city='Town',
+            street_address1='1 Street')
+
+    def test_csv_has_a_row_per_line_item(self):
+        rows = list(csv.DictReader(
+            StringIO(''.join(export_csv(Order.objects.all())))))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['order_number'],
+                         self.orders[0].order_number)
+        self.assertEqual(rows[2]['product__sku'], 'sku1')
+        self.assertEqual(rows[2]['quantity'], '3')
+        self.assertEqual(rows[2]['lineitem_total'], '30.00')
+        self.assertEqual(rows[5]['full_name'], 'No Items')
+        self.assertEqual(rows[5]['product__sku'], '')
+
+    def test_csv_cells_are_not_run_as_formulas(self):
+        Order.objects.filter(pk=self.empty.pk).update(
+            full_name='=HYPERLINK("http://example.com")',
+            street_address1='@SUM(1)', phone_number='+44 123')
+        rows = list(csv.DictReader(
+            StringIO(''.join(export_csv(Order.objects.all())))))
+        self.assertEqual(rows[5]['full_name'],
+                         '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(rows[5]['street_address1'], "'@SUM(1)")
+        self.assertEqual(rows[5]['phone_number'], "'+44 123")
+        self.assertEqual(rows[0]['order_total'], '10.00')
+
+    def test_command_rejects_a_date_it_cannot_read(self):
+        for since in ('yesterday', '01/02/2024', '2024-02-30'):
+            with self.assertRaises(CommandError):
+                call_command('export_orders', '--since', since,
+                             stdout=StringIO(), stderr=StringIO())
+        out = StringIO()
+        call_command('export_orders', '--since', '2999-01-01', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+    def test_command_exports_orders_since_midnight(self):
+        Order.objects.update(date=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        Order.objects.filter(pk=self.orders[0].pk).update(
+            date=datetime(2024, 3, 1, 23, 59, tzinfo=timezone.utc))
+        Order.objects.filter(pk=self.orders[1].pk).update(
+            date=datetime(2024, 3, 2, 0, 0, tzinfo=timezone.utc))
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('export_orders', '--since', '2024-03-02',
+                         '--format', 'jsonl', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([json.loads(line)['order_number'] for line in lines],
+                         [self.orders[1].order_number])
+        # the dates themselves are compared, not a date cast from each
+        self.assertNotIn('cast_date', queries[0]['sql'])
+
+    def test_benchmark_is_rolled_back(self):
+        out = StringIO()
+        call_command('benchmark_export_orders', '--orders', '30',
+                     '--chunk-size', '7', stdout=out)
+        self.assertIn('csv: ', out.getvalue())
+        self.assertIn('jsonl: ', out.getvalue())
+        self.assertEqual(Order.objects.count(), 6)
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_jsonl_has_a_line_per_order(self):
+        lines = ''.join(export_jsonl(Order.objects.all())).splitlines()
+        self.assertEqual(len(lines), 6)
+        order = json.loads(lines[1])
+        self.assertEqual(order['order_number'], self.orders[1].order_number)
+        self.assertEqual(order['country'], 'GB')
+        self.assertEqual(order['lineitems'][0]['quantity'], 2)
+        self.assertEqual(order['lineitems'][0]['lineitem_total'], '20.00')
+        self.assertEqual(json.loads(lines[5])['lineitems'], [])
+
+    def test_queries_are_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(export_jsonl(Order.objects.all(), chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        # the orders in one query, and the line items once for each chunk
+        self.assertEqual(len(queries), 4)
+
+    def test_command_writes_the_export(self):
+        out = StringIO()
+        call_command('export_orders', '--format', 'jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 6)
+
+    def test_admin_action_streams_a_download(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.post(
+            reverse('admin:checkout_order_changelist'),
+            {'action': 'export_csv',
+             '_selected_action': [order.pk for order in self.orders]})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 6)
+
+
+class OrderAdminTest(TestCase):
+    """ Tests that the order admin stays quick with a large history """
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.product = Product.objects.create(
+            sku='sku1', name='Shirt', description='Test', price='10.00')
+
+    def _add_orders(self, count):
+        Order.objects.bulk_create([Order(
+            order_number=f'{i:032d}', full_name='Test User',
+            email='test@example.com', phone_number='0123456789',
+            country='GB', town_or_city='Town', street_address1='1 Street')
+            for i in range(Order.objects.count(), count)])
+
+    def _queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_changelist_queries_do_not_grow_with_orders(self):
+        url = reverse('admin:checkout_order_changelist')
+        self._add_orders(10)
+        self.client.get(url)
+        few, _ = self._queries(url)
+        self._add_orders(10000)
+        many, response = self._queries(url)
+        self.assertEqual(many, few)
+        self.assertEqual(response.context['cl'].result_count, 10000)
+
+    def test_large_tables_are_counted_from_statistics(self):
+        self._add_orders(10000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        Order.objects.filter(pk__lte=10).delete()
+        url = reverse('admin:checkout_order_changelist')
+        with mock.patch('boutique_ado.paginators.ESTIMATED_COUNT_THRESHOLD',
+                        1000):
+            _, response = self._queries(url)
+            # a filtered list is still counted exactly
+            _, filtered = self._queries(url + '?q=0000000000000000000000000')
+        self.assertEqual(response.context['cl'].result_count, 10000)
+        self.assertEqual(filtered.context['cl'].result_count, 9990)
+
+    def test_date_drill_down_matches_the_admin(self):
+        self._add_orders(40)
+        for pk in Order.objects.values_list('pk', flat=True):
+            Order.objects.filter(pk=pk).update(date=timezone.make_aware(
+                timezone.datetime(2021 + pk % 3, 1 + pk % 12, 1 + pk % 5)))
+        url = reverse('admin:checkout_order_changelist')
+        for params in ('', '?date__year=2022',
+                       '?date__year=2022&date__month=5',
+                       '?date__year=2022&date__month=5&date__day=3'):
+            cl = self.client.get(url + params).context['cl']
+            with CaptureQueriesContext(connection) as queries:
+                hierarchy = indexed_date_hierarchy(cl)
+            self.assertEqual(hierarchy, date_hierarchy(cl))
+            self.assertLessEqual(len(queries), 31)
+
+    def test_change_form_does_not_list_the_catalog(self):
+        order = save_order(Order(
+            full_name='Test User', email='test@example.com',
+            phone_number='0123456789', country='GB', town_or_city='Town',
+            street_address1='1 Street'), {str(self.product.id): 1})
+        url = reverse('admin:checkout_order_change', args=[order.pk])
+        self.client.get(url)
+        few, _ = self._queries(url)
+        Product.objects.bulk_create([
+            Product(sku=f'bulk{i}', name=f'Product {i}', description='Test',
+                    price='1.00') for i in range(10000)])
+        many, response = self._queries(url)
+        self.assertEqual(many, few)
+        self.assertNotContains(response, 'Product 9999')
@@ -3,19 +3,22 @@ from django.shortcuts import (
 from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.conf import settings
+from django.db import IntegrityError
 
 from .forms import OrderForm
-from .models import Order, OrderLineItem
+from .models import Order
+from .orders import save_order
 
 from products.models import Product
 from profiles.models import UserProfile
 from profiles.forms import UserProfileForm
-from bag.contexts import bag_contents
-# this is the context processor we created in the bag app that
-# returns a dictionary of the bag contents
+from bag.codec import dumps_bag, load_bag
+from bag.contexts import get_bag_contents, update_bag_summary
+# this returns the bag contents the bag context processor
+# gives to the templates
 
+import hashlib
 import stripe
-import json
 
 
 @require_POST
@@ -28,8 +31,8 @@ def cache_checkout_data(request):
         stripe.api_key = settings.STRIPE_SECRET_KEY
         # we update the payment intent with the form data
         stripe.PaymentIntent.modify(pid, metadata={
-            'bag': json.dumps(request.session.get('bag', {})),
-            # we add the bag to the metadata in a json format
+            'bag': dumps_bag(load_bag(request)),
+            # we add the bag to the metadata in the compact json format
             'save_info': request.POST.get('save_info'),
             # we add the save info to the metadata
             'username': request.user,
@@ -43,6 +46,42 @@ def cache_checkout_data(request):
         return HttpResponse(content=str(e), status=400)
 
 
+def _get_payment_intent_secret(request, bag):
+    """ Return the client secret of a Stripe payment intent for the bag.
+        The intent is kept in the session along with a fingerprint of the
+        bag, so refreshing the page reuses it and a changed total only
+        updates its amount rather than creating a new one """
+    current_bag = get_bag_contents(request)
+    stripe_total = round(current_bag.contents['grand_total'] * 100)
+    fingerprint = hashlib.sha256(dumps_bag(bag).encode()).hexdigest()
+
+    intent = request.session.get('payment_intent')
+    if intent:
+        if (intent['fingerprint'] == fingerprint
+                and intent['amount'] == stripe_total):
+            return intent['client_secret']
+        if intent['amount'] != stripe_total:
+            try:
+                stripe.PaymentIntent.modify(intent['id'], amount=stripe_total)
+            except stripe.error.StripeError:
+                # e.g. the intent has already been paid or cancelled
+                intent = None
+
+    if not intent:
+        new_intent = stripe.PaymentIntent.create(
+            amount=stripe_total,
+            currency=settings.STRIPE_CURRENCY,
+        )
+        intent = {
+            'id': new_intent.id,
+            'client_secret': new_intent.client_secret,
+        }
+
+    intent.update(fingerprint=fingerprint, amount=stripe_total)
+    request.session['payment_intent'] = intent
+    return intent['client_secret']
+
+
 def checkout(request):
     """ A view to return the checkout page """
 
@@ -52,7 +91,10 @@ def checkout(request):
     # if the request method is POST, then the form has been submitted
     # and we can process the data
     if request.method == 'POST':
-        bag = request.session.get('bag', {})
+        bag = load_bag(request)
+        # the form is only posted once the card has been charged, so the
+        # intent is never handed out again, even if the order then fails
+        request.session.pop('payment_intent', None)
 
         form_data = {
             # the form data is the same as the order model fields
@@ -84,45 +126,23 @@ def checkout(request):
             # we set the order stripe pid to the payment intent id
             order.stripe_pid = pid
             # we set the original bag to the bag in the session
-            order.original_bag = json.dumps(bag)
-            # we save the order
-            order.save()
-            # we loop through the bag items and create an order line item
-            # for each one
-            for item_id, item_data in bag.items():
-                try:
-                    # we get the product id from the bag
-                    product = Product.objects.get(id=item_id)
-                    # if the item has no size, we set the size to none
-                    if isinstance(item_data, int):
-                        order_line_item = OrderLineItem(
-                            order=order,
-                            product=product,
-                            quantity=item_data,
-                        )
-                        order_line_item.save()
-                    # if the item has a size, we set the size to the item
-                    # data
-                    else:
-                        for size, quantity in item_data['items_by_size'].items(): # noqa
-                            order_line_item = OrderLineItem(
-                                order=order,
-                                product=product,
-                                quantity=quantity,
-                                product_size=size,
-                            )
-                            order_line_item.save()
-                # if there is an error, we display a message to the user
-                except Product.DoesNotExist:
-                    messages.error(request, (
-                        "One of the products in your bag wasn't"
-                        "found in our database. "
-                        "Please call us for assistance!"
-                    ))
-                    # we delete the order if there is an error
-                    order.delete()
-                    # we redirect the user to the bag page
-                    return redirect(reverse('view_bag'))
+            order.original_bag = dumps_bag(bag)
+            try:
+                # we save the order and a line item for each item in the bag
+                save_order(order, bag)
+            # if the webhook already saved the order for this payment
+            # we use that one instead
+            except IntegrityError:
+                order = get_object_or_404(Order, stripe_pid=pid)
+            # if there is an error, we display a message to the user
+            except Product.DoesNotExist:
+                messages.error(request, (
+                    "One of the products in your bag wasn't"
+                    "found in our database. "
+                    "Please call us for assistance!"
+                ))
+                # we redirect the user to the bag page
+                return redirect(reverse('view_bag'))
 
             # we save the user's info to their profile if they are logged in
             request.session['save_info'] = 'save-info' in request.POST
@@ -133,20 +153,11 @@ def checkout(request):
         else:
             messages.error(request, 'There was an error with your form. Please double check your information.')  # noqa
     else:
-        bag = request.session.get('bag', {})
+        bag = load_bag(request)
         if not bag:
             messages.error(request, "There's nothing in your bag right now")
             return redirect(reverse('products'))
 
-        current_bag = bag_contents(request)
-        total = current_bag['grand_total']
-        stripe_total = round(total * 100)
-        stripe.api_key = stripe_secret_key
-        intent = stripe.PaymentIntent.create(
-            amount=stripe_total,
-            currency=settings.STRIPE_CURRENCY,
-        )
-
         # Attempt to prefill the form with any info the user maintains in
         # their profile
         if request.user.is_authenticated:
@@ -168,6 +179,11 @@ def checkout(request):
         else:
             order_form = OrderForm()
 
+    # we reuse the payment intent for this bag if we already have one,
+    # this also covers the form being shown again after a failed POST
+    stripe.api_key = stripe_secret_key
+    client_secret = _get_payment_intent_secret(request, bag)
+
     if not stripe_public_key:
         messages.warning(request, 'Stripe public key is missing. Did you forget to set it in your environment?')  # noqa
 
@@ -175,7 +191,7 @@ def checkout(request):
     context = {
         'order_form': order_form,
         'stripe_public_key': stripe_public_key,
-        'client_secret': intent.client_secret,
+        'client_secret': client_secret,
     }
 
     return render(request, template, context)
@@ -218,6 +234,9 @@ def checkout_success(request, order_number):
     # if the user has a bag in the session, we delete it
     if 'bag' in request.session:
         del request.session['bag']
+        update_bag_summary(request)
+    # the payment intent has been used, so the next bag gets a new one
+    request.session.pop('payment_intent', None)
 
     # we render the checkout success template
     template = 'checkout/checkout_success.html'
@@ -1,14 +1,15 @@
 from django.http import HttpResponse
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.db import IntegrityError
 
-from .models import Order, OrderLineItem
-from products.models import Product
+from .models import Order
+from .email_queue import queue_email
+from .orders import save_order
 from profiles.models import UserProfile
+from bag.codec import loads_bag
 
 import stripe
-import json
 import time
 
 
@@ -21,7 +22,7 @@ class StripeWH_Handler:
         # so it can be accessed from stripe events
 
     def _send_confirmation_email(self, order):
-        """Send the user a confirmation email"""
+        """Queue a confirmation email for the user"""
         cust_email = order.email
         subject = render_to_string(
             'checkout/confirmation_emails/confirmation_email_subject.txt',
@@ -30,12 +31,42 @@ class StripeWH_Handler:
             'checkout/confirmation_emails/confirmation_email_body.txt',
             {'order': order, 'contact_email': settings.DEFAULT_FROM_EMAIL})
 
-        send_mail(
-            subject,
-            body,
-            settings.DEFAULT_FROM_EMAIL,
-            [cust_email]
-        )
+        # the email is sent by the send_queued_emails command, so the
+        # webhook doesn't wait on the mail server
+        queue_email(subject, body, [cust_email])
+
+    def _wait_for_order(self, pid):
+        """ Look up the order for the payment intent, waiting with a
+            bounded backoff in case the checkout view is still saving it """
+        delay = settings.STRIPE_WH_ORDER_WAIT_DELAY
+        deadline = time.monotonic() + settings.STRIPE_WH_ORDER_WAIT_TIMEOUT
+        while True:
+            # stripe_pid is indexed and unique, so this stays fast however
+            # many orders there are
+            order = Order.objects.filter(stripe_pid=pid).first()
+            remaining = deadline - time.monotonic()
+            if order or remaining <= 0:
+                return order
+            time.sleep(min(delay, remaining))
+            delay *= 2
+
+    def dispatch(self, event):
+        """
+        Pass the event to the handler for its type
+        """
+        # Map webhook events to relevant handler functions
+        event_map = {
+            'payment_intent.succeeded': self.handle_payment_intent_succeeded,
+            'payment_intent.payment_failed':
+                self.handle_payment_intent_payment_failed,
+        }
+
+        # If there's a handler for it, get it from the event map
+        # Use the generic one by default
+        event_handler = event_map.get(event['type'], self.handle_event)
+
+        # Call the event handler with the event
+        return event_handler(event)
 
     def handle_event(self, event):
         """
@@ -55,15 +86,16 @@ class StripeWH_Handler:
         bag = intent.metadata.bag  # we get the bag from the metadata
         save_info = intent.metadata.save_info  # we get the save info from the metadata # noqa
 
-        # Get the Charge object from the payment intent
-        stripe_charge = stripe.Charge.retrieve(intent.latest_charge)
+        # Get the Charge object from the payment intent, unless the event
+        # already has it expanded
+        stripe_charge = intent.latest_charge
+        if isinstance(stripe_charge, str):
+            stripe_charge = stripe.Charge.retrieve(stripe_charge)
 
         # we then get the billing details from the payment intent object
         billing_details = stripe_charge.billing_details
         # we get the shipping details from the payment intent object
         shipping_details = intent.shipping
-        # we convert the total to an integer
-        grand_total = round(stripe_charge.amount / 100, 2)
 
         # Clean data in the shipping details
         for field, value in shipping_details.address.items():
@@ -90,37 +122,9 @@ class StripeWH_Handler:
                 profile.default_county = shipping_details.address.state
                 profile.save()
 
-        order_exists = False  # we set the order exists variable to false
-        attempt = 1  # we set the attempt variable to 1
-        while attempt <= 5:  # as long as the attempt is <=5
-            try:
-                # we try to get the order using the information in the payment
-                # iexact lookup field to get exact match but case insensitive
-                order = Order.objects.get(
-                    full_name__iexact=shipping_details.name,
-                    email__iexact=billing_details.email,
-                    phone_number__iexact=shipping_details.phone,
-                    country__iexact=shipping_details.address.country,
-                    postcode__iexact=shipping_details.address.postal_code,
-                    town_or_city__iexact=shipping_details.address.city,
-                    street_address1__iexact=shipping_details.address.line1,
-                    street_address2__iexact=shipping_details.address.line2,
-                    county__iexact=shipping_details.address.state,
-                    grand_total=grand_total,
-                    original_bag=bag,
-                    stripe_pid=pid,
-                )
-                # we check if the order exists
-                order_exists = True
-                # if it does, we break out of the loop
-                break
-            except Order.DoesNotExist:
-                # if the order does not exist, we create a delay
-                # for 1 second
-                # and increment the attempt variable
-                attempt += 1
-                time.sleep(1)
-        if order_exists:
+        # we give the checkout view a moment to save the order
+        order = self._wait_for_order(pid)
+        if order:
             # if the order exists, we send a confirmation email
             self._send_confirmation_email(order)
             # if it does, we return a HTTP response object indicating it that
@@ -130,10 +134,9 @@ class StripeWH_Handler:
                     Verified order already in database',
                 status=200)
         else:
-            order = None
             # if the order does not exist, we try to create the order
             try:
-                order = Order.objects.create(
+                order = Order(
                     # we create the order using the information in the payment
                     # intent
                     full_name=shipping_details.name,
@@ -146,42 +149,29 @@ class StripeWH_Handler:
                     street_address1=shipping_details.address.line1,
                     street_address2=shipping_details.address.line2,
                     county=shipping_details.address.state,
-                    # we set the grand total to 0 as it will be updated
-                    # later
-                    grand_total=0,
                     original_bag=bag,
                     # we set the stripe pid to the payment intent id
                     stripe_pid=pid,
                 )
-                for item_id, item_data in json.loads(bag).items():
-                    # we get the product id from the bag
-                    product = Product.objects.get(id=item_id)
-                    # if the item has no size, we set the size to none
-                    if isinstance(item_data, int):
-                        order_line_item = OrderLineItem(
-                            order=order,
-                            product=product,
-                            quantity=item_data,
-                        )
-                        order_line_item.save()
-                    # if the item has a size, we set the size to the item
-                    # data
-                    else:
-                        for size, quantity in item_data['items_by_size'].items(): # noqa
-                            order_line_item = OrderLineItem(
-                                order=order,
-                                product=product,
-                                quantity=quantity,
-                                product_size=size,
-                            )
-                            order_line_item.save()
+                # we save the order and its line items in one transaction,
+                # so nothing is left behind if this fails
+                save_order(order, loads_bag(bag))
             except Exception as e:
-                # if there is an error, we delete the order if it exists
-                if order:
-                    order.delete()
+                # the checkout view may have saved the order for this payment
+                # intent after we stopped waiting, in which case we use it
+                order = None
+                if isinstance(e, IntegrityError):
+                    order = Order.objects.filter(stripe_pid=pid).first()
+                if not order:
+                    return HttpResponse(
+                        content=f'Webhook received: {event["type"]} | \
+                            ERROR: {e}',
+                        status=500)
+                self._send_confirmation_email(order)
                 return HttpResponse(
-                    content=f'Webhook received: {event["type"]} | ERROR: {e}',
-                            status=500)
+                    content=f'Webhook received: {event["type"]} | SUCCESS: \
+                        Verified order already in database',
+                    status=200)
         # we send a confirmation email if cuaght by webhook
         self._send_confirmation_email(order)
         return HttpResponse(
@@ -0,0 +1,71 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .claims import claim_rows
+from .models import WebhookEvent
+from .webhook_handler import StripeWH_Handler
+
+import stripe
+
+
+def enqueue_event(event, payload):
+    """ Store a verified Stripe event for a worker to process, ignoring
+        events Stripe has already delivered """
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(
+                stripe_event_id=event['id'],
+                event_type=event['type'],
+                payload=payload,
+            )
+        return True
+    except IntegrityError:
+        # Stripe retries deliveries, we already have this one
+        return False
+
+
+def claim_events(batch_size):
+    """ Claim up to batch_size events which are ready to be processed.
+        Events left processing by a worker which died are claimed again
+        once STRIPE_WH_CLAIM_TIMEOUT seconds have passed, up to
+        STRIPE_WH_MAX_ATTEMPTS times. """
+    return claim_rows(
+        WebhookEvent, batch_size, pending=WebhookEvent.PENDING,
+        claimed=WebhookEvent.PROCESSING, failed=WebhookEvent.FAILED,
+        timeout=settings.STRIPE_WH_CLAIM_TIMEOUT,
+        max_attempts=settings.STRIPE_WH_MAX_ATTEMPTS)
+
+
+def process_event(webhook_event):
+    """ Run a claimed event through the Stripe webhook handler, scheduling
+        a retry with a growing delay if it fails """
+    try:
+        event = stripe.Event.construct_from(
+            json.loads(webhook_event.payload), settings.STRIPE_SECRET_KEY)
+        response = StripeWH_Handler(None).dispatch(event)
+        error = None
+        if response.status_code >= 400:
+            error = response.content.decode('utf-8')
+    except Exception as e:
+        error = str(e)
+
+    webhook_event.attempts += 1
+    if error is None:
+        webhook_event.status = WebhookEvent.DONE
+        webhook_event.processed_at = timezone.now()
+        webhook_event.last_error = ''
+    elif webhook_event.attempts >= settings.STRIPE_WH_MAX_ATTEMPTS:
+        webhook_event.status = WebhookEvent.FAILED
+        webhook_event.last_error = error
+    else:
+        webhook_event.status = WebhookEvent.PENDING
+        webhook_event.available_at = timezone.now() + timedelta(
+            seconds=min(2 ** webhook_event.attempts, 300))
+        webhook_event.last_error = error
+    webhook_event.save(update_fields=[
+        'attempts', 'status', 'processed_at', 'available_at', 'last_error'])
+    return error is None
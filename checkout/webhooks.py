@@ -3,7 +3,7 @@ from django.http import HttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 
-from checkout.webhook_handler import StripeWH_Handler
+from checkout.webhook_inbox import enqueue_event
 
 import stripe
 
@@ -16,8 +16,7 @@ def webhook(request):
     # we use the webhook secret and the request body
     # we use the stripe library to construct the event
     # we catch any stripe errors and return a 400 response
-    # we assign the webhook event type to a variable
-    # we use a webhook handler to handle the event
+    # we store the event for the process_webhook_events worker
     # we return an HTTP response to indicate it was received
     # successfully
 
@@ -43,23 +42,13 @@ def webhook(request):
     except Exception as e:
         return HttpResponse(content=str(e), status=400)
 
-    # Set up a webhook handler
-    handler = StripeWH_Handler(request)
-
-    # Map webhook events to relevant handler functions
-    event_map = {
-        'payment_intent.succeeded': handler.handle_payment_intent_succeeded,
-        'payment_intent.payment_failed':
-            handler.handle_payment_intent_payment_failed,
-    }
-
-    # Get the webhook type from Stripe
-    event_type = event['type']
-
-    # If there's a handler for it, get it from the event map
-    # Use the generic one by default
-    event_handler = event_map.get(event_type, handler.handle_event)
-
-    # Call the event handler with the event
-    response = event_handler(event)
-    return response
+    # Store the event for the worker to process, so Stripe gets its
+    # response straight away. Events Stripe has already delivered are
+    # acknowledged without being stored again
+    if enqueue_event(event, payload.decode('utf-8')):
+        return HttpResponse(
+            content=f'Webhook received: {event["type"]} | Queued',
+            status=200)
+    return HttpResponse(
+        content=f'Webhook received: {event["type"]} | Already queued',
+        status=200)
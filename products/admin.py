@@ -1,4 +1,6 @@
 from django.contrib import admin
+
+from boutique_ado.paginators import EstimatedCountPaginator
 from .models import Product, Category
 
 # Register your models here.
@@ -14,8 +16,16 @@ class ProductAdmin(admin.ModelAdmin):
         'image',
     )
 
+    list_select_related = ('category',)
+
     ordering = ('sku',)
 
+    # used by the line item autocomplete as well as the product list
+    search_fields = ('sku', 'name',)
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = (
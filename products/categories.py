@@ -0,0 +1,92 @@
+from django.conf import settings
+
+from .models import Category
+from .versions import VersionedIndex
+
+# The category menus in the main nav. Each link lists the categories it
+# shows, and each menu ends with a link to every category in it.
+# Categories which don't exist are left out.
+NAV_MENUS = (
+    ('clothing', 'Clothing', 'All Clothing', (
+        ('activewear', 'essentials'), ('jeans',), ('shirts',))),
+    ('homeware', 'Homeware', 'All Homeware', (
+        ('bed_bath',), ('kitchen_dining',))),
+    ('specials', 'Special Offers', 'All Specials', (
+        ('new_arrivals',), ('deals',), ('clearance',))),
+)
+
+
+class CategoryRegistry(VersionedIndex):
+    """ Every category, held in memory by each process and loaded again
+        when any process changes one. The catalog has a handful of
+        categories which rarely change, so forms, the listing and the nav
+        look them up here rather than in the database. """
+
+    version_name = 'categories'
+
+    @property
+    def check_interval(self):
+        # every page shows the nav, and in production the version is in
+        # the database cache, so it isn't looked up on every request
+        return settings.CATEGORY_VERSION_CHECK_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self._categories = ()
+        self._by_name = {}
+        self._nav_menus = []
+
+    def _build(self):
+        categories = tuple(Category.objects.order_by('pk'))
+        self._by_name = {c.name: c for c in categories}
+        self._categories = categories
+        self._nav_menus = self._build_nav_menus()
+
+    def _build_nav_menus(self):
+        menus = []
+        for slug, label, all_label, links in NAV_MENUS:
+            menu_links = []
+            for names in links:
+                categories = [self._by_name[name] for name in names
+                              if name in self._by_name]
+                if categories:
+                    menu_links.append({
+                        'label': ' & '.join(
+                            c.get_friendly_name() or c.name
+                            for c in categories),
+                        'category': ','.join(c.name for c in categories),
+                    })
+            if menu_links:
+                menus.append({
+                    'id': f'{slug}-link',
+                    'label': label,
+                    'links': menu_links,
+                    'all_label': all_label,
+                    'all_link': ','.join(
+                        link['category'] for link in menu_links),
+                })
+        return menus
+
+    def all(self):
+        """ Every category, in the order they were created """
+        self._ensure_current()
+        return self._categories
+
+    def by_names(self, names):
+        """ The categories with the given names, ignoring any which don't
+            exist """
+        self._ensure_current()
+        return [self._by_name[name] for name in names
+                if name in self._by_name]
+
+    def choices(self):
+        """ The (id, friendly name) choices for a category field """
+        return [(c.id, c.get_friendly_name()) for c in self.all()]
+
+    def nav_menus(self):
+        """ The category menus for the main nav """
+        self._ensure_current()
+        return self._nav_menus
+
+
+category_registry = CategoryRegistry()
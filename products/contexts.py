@@ -0,0 +1,7 @@
+from .categories import category_registry
+
+
+def category_nav(request):  # This function is available to all templates
+    # the menus are only built if the page renders the nav, and then
+    # come from memory rather than the database
+    return {'category_menus': category_registry.nav_menus}
@@ -0,0 +1,178 @@
+from django.db.models import Q
+
+from .models import Product
+from .versions import VersionedIndex
+
+# The bands the price and rating facets split products into, as
+# (key, label, lowest, highest) where lowest is included and highest
+# isn't. A band with neither end matches products with no value.
+PRICE_BANDS = (
+    ('under-25', 'Under $25', None, 25),
+    ('25-50', '$25 to $50', 25, 50),
+    ('50-100', '$50 to $100', 50, 100),
+    ('100-up', '$100 and over', 100, None),
+)
+RATING_BANDS = (
+    ('4-up', '4 and up', 4, None),
+    ('3-4', '3 to 4', 3, 4),
+    ('under-3', 'Under 3', None, 3),
+    ('unrated', 'No rating', None, None),
+)
+SIZE_CHOICES = (
+    ('yes', 'Available in sizes', True),
+    ('no', 'One size', False),
+)
+
+# The field each banded facet splits, by its query parameter
+BAND_FACETS = {
+    'price': ('price', PRICE_BANDS),
+    'rating': ('rating', RATING_BANDS),
+}
+FACET_LABELS = {
+    'category': 'Category',
+    'price': 'Price',
+    'rating': 'Rating',
+    'sizes': 'Sizes',
+}
+FACET_PARAMS = tuple(FACET_LABELS)
+
+
+def facet_values(facet):
+    """ The (key, label) of every value of a facet other than category """
+    if facet == 'sizes':
+        return [(key, label) for key, label, _ in SIZE_CHOICES]
+    return [(key, label) for key, label, _, _ in BAND_FACETS[facet][1]]
+
+
+def facet_filter(facet, key):
+    """ The filter for products with the given value of a facet other
+        than category """
+    if facet == 'sizes':
+        has_sizes = dict((k, v) for k, _, v in SIZE_CHOICES)[key]
+        # has_sizes can be NULL, which means one size
+        return Q(has_sizes=True) if has_sizes else ~Q(has_sizes=True)
+    field, bands = BAND_FACETS[facet]
+    _, _, lowest, highest = next(band for band in bands if band[0] == key)
+    if lowest is None and highest is None:
+        return Q(**{f'{field}__isnull': True})
+    q = Q()
+    if lowest is not None:
+        q &= Q(**{f'{field}__gte': lowest})
+    if highest is not None:
+        q &= Q(**{f'{field}__lt': highest})
+    return q
+
+
+def _band(bands, value):
+    for key, _, lowest, highest in bands:
+        if value is None:
+            if lowest is None and highest is None:
+                return key
+        elif ((lowest is None or value >= lowest)
+                and (highest is None or value < highest)
+                and not (lowest is None and highest is None)):
+            return key
+    return None
+
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:
+    # int.bit_count arrived in Python 3.10
+    def _popcount(bits):
+        return bin(bits).count('1')
+
+
+class FacetIndex(VersionedIndex):
+    """ A bitmap for every facet value, with a bit for each product, held
+        in memory by each process and rebuilt when the catalog version
+        changes.
+
+        Counting a facet value is then just and-ing a few bitmaps and
+        counting the bits, rather than a GROUP BY per facet per request,
+        so it costs much the same however many products match. """
+
+    def __init__(self):
+        super().__init__()
+        self._size = 0
+        self._positions = {}
+        self._bitmaps = {}
+        self._all = 0
+
+    def _build(self):
+        rows = list(Product.objects.order_by('pk').values_list(
+            'pk', 'category_id', 'price', 'rating', 'has_sizes'))
+        size = (len(rows) + 7) // 8
+        positions = {}
+        # the bits are set in byte arrays and turned into ints at the end,
+        # setting them in ints would copy the whole int for each product
+        arrays = {}
+
+        def set_bit(key, position):
+            if key not in arrays:
+                arrays[key] = bytearray(size)
+            arrays[key][position >> 3] |= 1 << (position & 7)
+
+        for position, (pk, category_id, price, rating, has_sizes) in \
+                enumerate(rows):
+            positions[pk] = position
+            set_bit(('category', category_id), position)
+            set_bit(('price', _band(PRICE_BANDS, price)), position)
+            set_bit(('rating', _band(RATING_BANDS, rating)), position)
+            set_bit(('sizes', 'yes' if has_sizes else 'no'), position)
+
+        self._size = size
+        self._positions = positions
+        self._bitmaps = {key: int.from_bytes(array, 'little')
+                         for key, array in arrays.items()}
+        self._all = (1 << len(rows)) - 1
+
+    def bits_for(self, ids):
+        """ The bitmap of the products with the given ids """
+        self._ensure_current()
+        array = bytearray(self._size)
+        for pk in ids:
+            position = self._positions.get(pk)
+            if position is not None:
+                array[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(array, 'little')
+
+    def counts(self, selections, base=None):
+        """ Count the products for every facet value, given the values
+            already selected for each facet and optionally the bitmap of
+            the products the search matched.
+
+            Values in the same facet are alternatives, so each facet is
+            counted against the selections in every other facet. Returns
+            the counts by facet and value, and the number of products
+            matching every selection. """
+        self._ensure_current()
+        if base is None:
+            base = self._all
+        masks = {}
+        for facet, keys in selections.items():
+            if keys:
+                mask = 0
+                for key in keys:
+                    mask |= self._bitmaps.get((facet, key), 0)
+                masks[facet] = mask
+
+        counts = {}
+        for facet in FACET_PARAMS:
+            matching = base
+            for other, mask in masks.items():
+                if other != facet:
+                    matching &= mask
+            counts[facet] = {
+                key: _popcount(matching & bits)
+                for (bitmap_facet, key), bits in self._bitmaps.items()
+                if bitmap_facet == facet
+            }
+
+        total = base
+        for mask in masks.values():
+            total &= mask
+        return counts, _popcount(total)
+
+
+facet_index = FacetIndex()
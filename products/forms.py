@@ -1,6 +1,8 @@
 from django import forms
 from .widgets import CustomClearableFileInput
-from .models import Product, Category
+from .models import Product
+from .categories import category_registry
+from .images import update_thumbnails
 
 
 class ProductForm(forms.ModelForm):
@@ -16,9 +18,9 @@ class ProductForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         """ Add placeholders and classes to form inputs """
         super().__init__(*args, **kwargs)
-        categories = Category.objects.all()  # get all categories
-        # we create a list of tuples of the friendly names - list comprehension
-        friendly_names = [(c.id, c.get_friendly_name()) for c in categories]
+        # we get a list of tuples of the ids and friendly names, from the
+        # categories each process keeps in memory
+        friendly_names = category_registry.choices()
 
         # we update the category field on the form with the friendly names
         self.fields['category'].choices = friendly_names
@@ -26,3 +28,13 @@ class ProductForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             # we add a class attribute to each field
             field.widget.attrs['class'] = 'border-black rounded-0'
+
+    def save(self, commit=True):
+        """ Generate thumbnails for a newly uploaded image. The upload is
+            only stored once the product is saved, so they are made
+            afterwards. """
+        product = super().save(commit)
+        if commit and 'image' in self.changed_data:
+            update_thumbnails(product)
+            product.save(update_fields=['thumbnails_of', 'image_width'])
+        return product
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# The formats each thumbnail is saved in, with the Pillow options for
+# each. Browsers which can't show WebP fall back to the JPEG.
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def thumbnail_name(name, width, extension):
+    """ Where the thumbnail of the image called name at width is stored,
+        e.g. thumbnails/shirt-400w.webp for shirt.jpg """
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(
+        directory, 'thumbnails', f'{stem}-{width}w.{extension}')
+
+
+def thumbnail_widths(image_width):
+    """ The width in a thumbnail's name and the width it really is, for
+        each thumbnail of an image image_width wide. Images are never
+        enlarged, so past the original's width there is just one more
+        thumbnail, at the original size. """
+    widths = []
+    for width in sorted(settings.PRODUCT_IMAGE_WIDTHS):
+        if width >= image_width:
+            widths.append((width, image_width))
+            break
+        widths.append((width, width))
+    return widths
+
+
+def generate_thumbnails(name, storage=None, content=None):
+    """ Save the thumbnails of the image called name at the widths in
+        PRODUCT_IMAGE_WIDTHS and in every format, replacing any there
+        already. The image is read from storage unless its content is
+        passed in. Returns the width of the image and the names saved. """
+    storage = storage or default_storage
+    if content is None:
+        with storage.open(name) as original:
+            content = original.read()
+    image = Image.open(BytesIO(content))
+    # phone photos are often stored sideways with a note to rotate
+    image = ImageOps.exif_transpose(image).convert('RGB')
+
+    saved = []
+    for width, real_width in thumbnail_widths(image.width):
+        resized = image
+        if real_width < image.width:
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+        for extension, (image_format, options) in THUMBNAIL_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            thumbnail = thumbnail_name(name, width, extension)
+            # storages add a suffix rather than overwrite, so the old
+            # thumbnail goes first to keep the name predictable
+            if storage.exists(thumbnail):
+                storage.delete(thumbnail)
+            saved.append(storage.save(thumbnail, ContentFile(
+                buffer.getvalue())))
+    return image.width, saved
+
+
+def thumbnail_settings():
+    """ A short signature of the widths and formats thumbnails are made
+        with, which changes whenever they would come out differently """
+    return hashlib.sha1(json.dumps(
+        [settings.PRODUCT_IMAGE_WIDTHS, THUMBNAIL_FORMATS],
+        sort_keys=True).encode()).hexdigest()[:12]
+
+
+def thumbnail_srcset(name, image_width, extension, storage=None):
+    """ The srcset listing every thumbnail of the image called name in
+        one format, each with the width it really is """
+    storage = storage or default_storage
+    return ', '.join(
+        f'{storage.url(thumbnail_name(name, width, extension))} '
+        f'{real_width}w'
+        for width, real_width in thumbnail_widths(image_width))
+
+
+def update_thumbnails(product):
+    """ Generate the thumbnails for a product's image, if it has one, and
+        note which image they were made from """
+    if product.image:
+        product.image_width, _ = generate_thumbnails(product.image.name)
+        product.thumbnails_of = product.image.name
+    else:
+        product.thumbnails_of = ''
+        product.image_width = None
@@ -0,0 +1,291 @@
+import csv
+import json
+import re
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Category, Product
+from .search import get_search_backend
+from .versions import bump_version
+
+# The product fields a feed can set. Anything else in a record is ignored.
+PRODUCT_FIELDS = ('sku', 'name', 'description', 'price', 'rating',
+                  'has_sizes', 'image_url', 'image')
+# The fields a record has to set for a product to be created from it
+REQUIRED_FIELDS = ('name', 'price')
+READ_SIZE = 64 * 1024
+# A record which still won't parse once this much has been read for it is
+# taken to be malformed, so a bad one can't pull the rest of the file in
+MAX_RECORD_SIZE = 1024 * 1024
+# where reading carries on after a malformed record, a line starting an
+# object as the records in JSON Lines and indented arrays do
+NEXT_OBJECT = re.compile(r'\n[ \t]*(?=\{)')
+
+
+def iter_json_records(file):
+    """ Yield each object in a JSON array, or in a file of objects one
+        after another such as JSON Lines, reading only as much of the file
+        at a time as it takes to hold one object.
+
+        A record which can't be parsed is yielded as a ValueError saying
+        why, and reading carries on from the next line starting an object,
+        so one bad record doesn't stop the rest being imported. """
+    # prices are read as decimals, as a float can't hold 53.99 exactly
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    buffer = ''
+    position = 0
+    at_end = False
+    skipping = False
+    while True:
+        if skipping:
+            match = NEXT_OBJECT.search(buffer, position)
+            if match:
+                position = match.end()
+                skipping = False
+            else:
+                # only a last line of whitespace could still start one
+                position = buffer.rfind('\n')
+                if position < 0 or buffer[position:].strip():
+                    position = len(buffer)
+        if not skipping:
+            # skip the brackets, commas and whitespace around each object
+            while (position < len(buffer)
+                   and buffer[position] in ' \t\r\n,[]'):
+                position += 1
+            if position < len(buffer):
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as error:
+                    # an object cut short by the end of what has been
+                    # read fails on its last line, so a failure with a
+                    # line after it is in the object itself
+                    if (at_end or '\n' in buffer[error.pos:]
+                            or len(buffer) - position > MAX_RECORD_SIZE):
+                        yield ValueError(f'invalid JSON, {error.msg}')
+                        position = error.pos
+                        skipping = True
+                        continue
+                else:
+                    yield record
+                    continue
+        if at_end:
+            return
+        # whatever is left is an object cut short, so the next part of
+        # the file is added to it
+        chunk = file.read(READ_SIZE)
+        at_end = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_csv_records(file):
+    """ Yield each row of a CSV file with a header row, as a dict. A row
+        which can't be read is yielded as a ValueError saying why. """
+    rows = csv.DictReader(file)
+    while True:
+        try:
+            yield next(rows)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            yield ValueError(f'invalid CSV, {error}')
+
+
+class CatalogImporter:
+    """ Import categories and products from a stream of records, keeping
+        only one batch of products in memory at a time.
+
+        Products are matched to the ones already in the catalog by SKU,
+        those found are updated and the rest created, a batch at a time
+        with one bulk insert and one update statement. Their category can be given by
+        name, or by the pk of a category record earlier in the same
+        import as loaddata fixtures do. Categories are kept in a map by
+        name, and any not seen before are created.
+
+        Bulk queries don't send the save signals, so the catalog caches
+        and search index are brought up to date once at the end. """
+
+    def __init__(self, batch_size=500, stderr=None):
+        self.batch_size = batch_size
+        self.stderr = stderr
+        self.now = timezone.now()
+        self.category_ids = dict(Category.objects.values_list('name', 'pk'))
+        # the pks categories had in the file, for fixtures which refer to
+        # them that way
+        self.file_categories = {}
+        self.changed_categories = set()
+        self.batch = []
+        self.created = self.updated = self.failed = 0
+
+    def import_records(self, records):
+        """ Import every record. Call finish once every file has been
+            imported. """
+        for number, record in enumerate(records, 1):
+            try:
+                if isinstance(record, ValueError):
+                    # one the reader couldn't parse
+                    raise record
+                if record.get('model') == 'products.category':
+                    self._import_category(record)
+                    continue
+                if record.get('model') not in (None, 'products.product'):
+                    continue
+                self.batch.append(
+                    (number, *self._product(record.get('fields', record))))
+            except (ValidationError, ValueError, TypeError, KeyError,
+                    AttributeError) as error:
+                self._skip(number, error)
+                continue
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+        self._flush()
+
+    def _skip(self, number, error):
+        self.failed += 1
+        if self.stderr:
+            if isinstance(error, KeyError):
+                error = f'no {error.args[0]}'
+            self.stderr.write(f'Skipped record {number}: {error}')
+
+    def _import_category(self, record):
+        fields = record['fields']
+        name = fields['name']
+        if not name:
+            raise ValueError('a category needs a name')
+        if 'pk' in record:
+            self.file_categories[record['pk']] = name
+        friendly_name = fields.get('friendly_name')
+        if name in self.category_ids:
+            updated = Category.objects.filter(name=name).exclude(
+                friendly_name=friendly_name).update(
+                friendly_name=friendly_name)
+            if updated:
+                self.changed_categories.add(self.category_ids[name])
+        else:
+            self._create_category(name, friendly_name)
+
+    def _create_category(self, name, friendly_name=None):
+        category, = Category.objects.bulk_create(
+            [Category(name=name, friendly_name=friendly_name)])
+        if category.pk is None:
+            # not every database hands back the pks from a bulk insert
+            category = Category.objects.get(name=name)
+        self.category_ids[name] = category.pk
+        self.changed_categories.add(category.pk)
+        return category.pk
+
+    def _category_id(self, value):
+        if value in (None, ''):
+            return None
+        if isinstance(value, int):
+            if value not in self.file_categories:
+                raise ValueError(f'category {value} is not in the import')
+            value = self.file_categories[value]
+        if value in self.category_ids:
+            return self.category_ids[value]
+        return self._create_category(value)
+
+    def _product(self, fields):
+        """ The unsaved product a record describes, with the names of the
+            fields the record sets """
+        values = {}
+        for name in PRODUCT_FIELDS:
+            if name not in fields:
+                continue
+            field = Product._meta.get_field(name)
+            value = fields[name]
+            if value == '' and field.null:
+                value = None
+            elif isinstance(value, str) and name == 'has_sizes':
+                # CSV has no booleans, so the usual spellings are accepted
+                value = value.strip().lower() in ('1', 't', 'true', 'yes')
+            values[name] = field.clean(value, None)
+        if 'category' in fields:
+            values['category_id'] = self._category_id(fields['category'])
+        values['updated_at'] = self.now
+        return Product(**values), tuple(values)
+
+    @transaction.atomic
+    def _flush(self):
+        # the batch is taken first, so one which fails to write is never
+        # written again by finish
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        # a SKU repeated in one batch is the same product, the last record
+        # for it wins
+        by_sku = {}
+        new = []
+        for number, product, fields in batch:
+            if product.sku:
+                by_sku[product.sku] = (number, product, fields)
+            else:
+                new.append((number, product, fields))
+        existing = dict(Product.objects.filter(
+            sku__in=by_sku).values_list('sku', 'pk'))
+
+        # records can set different fields, and only the fields a record
+        # sets are updated
+        to_update = {}
+        for sku, (number, product, fields) in by_sku.items():
+            if sku in existing:
+                product.pk = existing[sku]
+                to_update.setdefault(fields, []).append(product)
+            else:
+                new.append((number, product, fields))
+
+        # a record only updating some fields of a product is fine, but a
+        # new product needs the fields the table can't leave empty
+        to_create = []
+        for number, product, fields in sorted(new, key=lambda new: new[0]):
+            missing = [name for name in REQUIRED_FIELDS if name not in fields]
+            if missing:
+                self._skip(number, f'no {", ".join(missing)} for a new '
+                                   'product')
+            else:
+                to_create.append(product)
+
+        Product.objects.bulk_create(to_create)
+        for fields, products in to_update.items():
+            self._update(products, [f for f in fields if f != 'sku'])
+        self.created += len(to_create)
+        self.updated += sum(len(products) for products in to_update.values())
+
+    def _update(self, products, fields):
+        """ Write fields of every product with one statement run for each
+            of them. bulk_update builds a CASE for every field of every
+            product, which takes far longer to put together than to run. """
+        columns = [Product._meta.get_field(name) for name in fields]
+        quote = connection.ops.quote_name
+        sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+            quote(Product._meta.db_table),
+            ', '.join(f'{quote(column.column)} = %s' for column in columns),
+            quote(Product._meta.pk.column))
+        params = [
+            [column.get_db_prep_save(getattr(product, column.attname),
+                                     connection) for column in columns]
+            + [product.pk]
+            for product in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    def finish(self):
+        """ Bring the catalog caches and search index up to date with
+            everything imported, returning how many products were created,
+            updated and skipped as invalid. Call it even when an import
+            fails part way, as the batches written already are live. """
+        self._flush()
+        if self.changed_categories:
+            # the category shows on its products' pages
+            Product.objects.filter(
+                category__in=self.changed_categories).update(
+                updated_at=self.now)
+            bump_version('categories')
+        if self.created or self.updated or self.changed_categories:
+            bump_version('catalog')
+            bump_version('prices')
+            get_search_backend().rebuild()
+        return self.created, self.updated, self.failed
@@ -0,0 +1,215 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q
+
+from products.facets import (FACET_PARAMS, facet_filter, facet_index,
+                             facet_values)
+from products.models import Category, Product
+from products.search import get_search_backend
+from products.suggest import suggestion_index
+from products.versions import bump_version
+
+# The versions of everything kept from the synthetic catalog, moved on
+# once it has been rolled back so nothing goes on showing it
+VERSIONS = ('catalog', 'categories', 'prices', 'search')
+SEED_BATCH_SIZE = 5000
+SYLLABLES = ('ba', 'ko', 'ri', 'ten', 'mo', 'sha', 'lu', 'vin', 'de',
+             'po', 'ga', 'nel', 'ti', 'ra', 'zu', 'fen', 'cro', 'mi', 'sol',
+             'ta', 'wen', 'dri', 'al', 'ke')
+
+
+def _vocabulary(size=5000):
+    """ Made up words, the first ones the commonest, so searches for
+        words further down the list match fewer products as real ones do """
+    rng = random.Random(0)
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+VOCABULARY = _vocabulary()
+# word frequencies falling off as in real text
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+# a common word, some rarer ones, two words together and one which is
+# found in a handful of products
+SEARCH_QUERIES = (VOCABULARY[3], VOCABULARY[60], VOCABULARY[600],
+                  f'{VOCABULARY[3]} {VOCABULARY[60]}', VOCABULARY[4000])
+
+
+def _times_ms(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def _median_ms(func, repeat):
+    return statistics.median(_times_ms(func, repeat))
+
+
+def _seed(rng, categories, start, stop):
+    """ Add synthetic products numbered start to stop """
+    for first in range(start, stop, SEED_BATCH_SIZE):
+        Product.objects.bulk_create([
+            Product(
+                sku=f'bench{number}',
+                name=' '.join(
+                    rng.choices(VOCABULARY, WEIGHTS, k=3)).capitalize(),
+                description=' '.join(
+                    rng.choices(VOCABULARY, WEIGHTS, k=30)),
+                price=rng.randrange(100, 20000) / 100,
+                rating=(None if rng.random() < 0.1
+                        else rng.randrange(100, 500) / 100),
+                has_sizes=rng.random() < 0.5,
+                category=rng.choice(categories))
+            for number in range(first, min(first + SEED_BATCH_SIZE, stop))])
+
+
+def benchmark_search(repeat):
+    """ The full text index against the icontains search it replaced,
+        fetching the first page of 50 """
+    backend = get_search_backend()
+    products = Product.objects.all()
+
+    def icontains():
+        for query in SEARCH_QUERIES:
+            list(products.filter(
+                Q(name__icontains=query)
+                | Q(description__icontains=query))[:50])
+
+    def indexed(rank):
+        for query in SEARCH_QUERIES:
+            list(backend.search(products, query, rank=rank)[:50])
+
+    per_query = len(SEARCH_QUERIES)
+    return [
+        ('icontains', _median_ms(icontains, repeat) / per_query),
+        (type(backend).__name__,
+         _median_ms(lambda: indexed(False), repeat) / per_query),
+        ('ranked', _median_ms(lambda: indexed(True), repeat) / per_query),
+    ]
+
+
+def benchmark_facets(repeat):
+    """ The facet counts from the bitmaps against a GROUP BY for each
+        facet, with a price band and a rating band picked """
+    selections = {'category': [], 'price': ['25-50'], 'rating': ['4-up'],
+                  'sizes': []}
+    build = _times_ms(lambda: facet_index.counts(selections), 1)[0]
+
+    def group_by():
+        for facet in FACET_PARAMS:
+            products = Product.objects.all()
+            for other, keys in selections.items():
+                if other != facet and keys:
+                    q = Q()
+                    for key in keys:
+                        q |= facet_filter(other, key)
+                    products = products.filter(q)
+            if facet == 'category':
+                list(products.values('category_id').annotate(Count('pk')))
+            else:
+                products.aggregate(**{
+                    key: Count('pk', filter=facet_filter(facet, key))
+                    for key, _ in facet_values(facet)})
+
+    return [
+        ('bitmaps', _median_ms(lambda: facet_index.counts(selections),
+                               repeat)),
+        ('GROUP BY per facet', _median_ms(group_by, repeat)),
+        ('building the bitmaps', build),
+    ]
+
+
+def benchmark_suggest(repeat):
+    """ Suggestion lookups for prefixes of common and rare words, a
+        whole name and a SKU """
+    prefixes = (VOCABULARY[0][:2], VOCABULARY[10][:3], VOCABULARY[300],
+                f'{VOCABULARY[0]} {VOCABULARY[1][:2]}', 'bench12')
+    build = _times_ms(lambda: suggestion_index.suggest(prefixes[0]), 1)[0]
+    times = []
+    for prefix in prefixes:
+        times += _times_ms(lambda: suggestion_index.suggest(prefix), repeat)
+    times.sort()
+    return [
+        ('lookup p50', statistics.median(times)),
+        ('p99', times[min(len(times) - 1, len(times) * 99 // 100)]),
+        ('building the index', build),
+    ]
+
+
+BENCHMARKS = {
+    'facets': benchmark_facets,
+    'search': benchmark_search,
+    'suggest': benchmark_suggest,
+}
+
+
+class Command(BaseCommand):
+    help = ('Time the catalog\'s indexes on a synthetic catalog of each '
+            'size given. The products are added in a transaction which is '
+            'rolled back, so the database is left as it was.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks', nargs='*',
+            help='The benchmarks to run, out of '
+                 f'{", ".join(sorted(BENCHMARKS))}, all of them if none '
+                 'are given')
+        parser.add_argument(
+            '--products', default='1000,10000,100000',
+            help='Comma separated catalog sizes to time them at')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Times each one is run, the median is reported')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in
+                           options['products'].split(','))
+        except ValueError:
+            raise CommandError('--products takes numbers such as 1000,10000')
+        names = options['benchmarks'] or sorted(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(
+                f'No benchmark called {", ".join(sorted(unknown))}')
+
+        try:
+            with transaction.atomic():
+                self._run(sizes, names, options['repeat'])
+                transaction.set_rollback(True)
+        finally:
+            for name in VERSIONS:
+                bump_version(name)
+
+    def _run(self, sizes, names, repeat):
+        rng = random.Random(0)
+        categories = [Category.objects.create(name=f'bench_{word}')
+                      for word in VOCABULARY[:8]]
+        seeded = 0
+        for size in sizes:
+            start = time.monotonic()
+            _seed(rng, categories, seeded, size)
+            seeded = size
+            get_search_backend().rebuild()
+            for name in VERSIONS:
+                bump_version(name)
+            self.stdout.write(
+                f'{size} products, seeded in '
+                f'{time.monotonic() - start:.1f}s')
+            for name in names:
+                results = BENCHMARKS[name](repeat)
+                self.stdout.write(f'  {name}: ' + ', '.join(
+                    f'{label} {ms:.2f}ms' for label, ms in results))
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from PIL import Image
+
+from products.images import generate_thumbnails, thumbnail_settings
+from products.models import Product
+from products.versions import bump_version
+
+# The content hash of every image the thumbnails were last made from,
+# along with the widths and formats they were made with, and why any
+# which couldn't be made failed
+MANIFEST_NAME = 'thumbnails/manifest.json'
+# what reading or resizing a broken or oversized image can raise. Pillow
+# raises SyntaxError and EOFError for some broken files, and
+# DecompressionBombError for images over Image.MAX_IMAGE_PIXELS.
+IMAGE_ERRORS = (OSError, ValueError, SyntaxError, EOFError,
+                Image.DecompressionBombError)
+# how many images are finished between saving the manifest, so an
+# interrupted run loses little when it is run again
+MANIFEST_SAVE_EVERY = 25
+
+
+def _init_worker():
+    # workers started fresh, rather than forked, have to set Django up
+    # before they can read the settings and storage
+    import django
+    django.setup()
+
+
+def process_image(name, known_hash):
+    """ Make the thumbnails for an image unless its content still has the
+        hash they were last made from. Runs in a worker process, so it
+        returns (name, hash, width, error) rather than raising, with the
+        width only for an image whose thumbnails were made. """
+    try:
+        with default_storage.open(name) as original:
+            content = original.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == known_hash:
+            return name, content_hash, None, None
+        width, _ = generate_thumbnails(name, content=content)
+        return name, content_hash, width, None
+    except IMAGE_ERRORS as error:
+        return name, None, None, str(error) or type(error).__name__
+
+
+class Command(BaseCommand):
+    help = ('Generate the thumbnails for every product image, in parallel, '
+            'skipping images which haven\'t changed since the last run')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Generate them again for every image')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='How many processes to resize images in, 1 runs them '
+                 'in this one')
+
+    def handle(self, *args, **options):
+        manifest = self._load_manifest()
+        if options['force'] or manifest['settings'] != thumbnail_settings():
+            manifest = {'settings': thumbnail_settings(), 'images': {},
+                        'failed': {}}
+        manifest.setdefault('failed', {})
+
+        # several products can share an image, which is only done once.
+        # An image whose products don't point at its thumbnails yet, or
+        # don't know its width, is done whatever the manifest says.
+        current = {}
+        for name, thumbnails_of, width in Product.objects.exclude(
+                image='').exclude(image=None).values_list(
+                'image', 'thumbnails_of', 'image_width'):
+            current[name] = (current.get(name, True)
+                             and thumbnails_of == name and bool(width))
+        tasks = [(name, manifest['images'].get(name) if current[name]
+                  else None) for name in sorted(current)]
+
+        self.generated = self.skipped = self.failed = 0
+        started = time.monotonic()
+        try:
+            for done, result in enumerate(
+                    self._run(tasks, options['workers']), 1):
+                self._record(manifest, *result)
+                if done % MANIFEST_SAVE_EVERY == 0:
+                    self._save_manifest(manifest)
+        except KeyboardInterrupt:
+            self._finish(manifest)
+            raise CommandError(
+                'Interrupted, run the command again to carry on from here')
+        self._finish(manifest)
+
+        elapsed = time.monotonic() - started
+        rate = len(tasks) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {len(tasks)} images in {elapsed:.1f}s '
+            f'({rate:.1f} images/s): {self.generated} generated, '
+            f'{self.skipped} unchanged, {self.failed} failed'))
+
+    def _run(self, tasks, workers):
+        """ Process every image, yielding the results as they finish """
+        if workers <= 1:
+            for task in tasks:
+                yield process_image(*task)
+            return
+        # forked workers mustn't share the database connection
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(process_image, *task) for task in tasks]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            except KeyboardInterrupt:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    def _record(self, manifest, name, content_hash, width, error):
+        if error:
+            # it has no hash in the manifest, so it is tried again next time
+            self.failed += 1
+            self.stderr.write(f'Skipped {name}: {error}')
+            manifest['images'].pop(name, None)
+            manifest['failed'][name] = error
+            return
+        manifest['images'][name] = content_hash
+        manifest['failed'].pop(name, None)
+        if width is None:
+            self.skipped += 1
+            return
+        self.generated += 1
+        # an update rather than a save for each product, so the catalog
+        # version only moves on once at the end
+        Product.objects.filter(image=name).update(
+            thumbnails_of=name, image_width=width,
+            updated_at=timezone.now())
+
+    def _finish(self, manifest):
+        self._save_manifest(manifest)
+        if self.generated:
+            bump_version('catalog')
+
+    def _load_manifest(self):
+        try:
+            with default_storage.open(MANIFEST_NAME) as manifest:
+                return json.load(manifest)
+        except (OSError, ValueError):
+            return {'settings': None, 'images': {}, 'failed': {}}
+
+    def _save_manifest(self, manifest):
+        if default_storage.exists(MANIFEST_NAME):
+            default_storage.delete(MANIFEST_NAME)
+        default_storage.save(MANIFEST_NAME, ContentFile(
+            json.dumps(manifest, indent=1, sort_keys=True).encode()))
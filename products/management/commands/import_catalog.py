@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import (
+    CatalogImporter, iter_csv_records, iter_json_records)
+
+
+class Command(BaseCommand):
+    help = ('Import categories and products from JSON, JSON Lines or CSV '
+            'files, updating the products whose SKU is already in the '
+            'catalog')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+',
+            help='Files to import, in order. Fixtures such as '
+                 'products/fixtures/categories.json work too.')
+        parser.add_argument(
+            '--format', choices=('json', 'csv'),
+            help='The format of the files, worked out from their '
+                 'extension if not given')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of products written in each query')
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(options['batch_size'], stderr=self.stderr)
+        start = time.monotonic()
+        try:
+            for path in options['paths']:
+                self._import_file(importer, path, options['format'])
+        finally:
+            # the caches and search index are updated once, after every
+            # file, and after a failed one too as the batches written
+            # before it are already in the catalog
+            created, updated, failed = importer.finish()
+        elapsed = time.monotonic() - start
+
+        rows = created + updated
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} products ({created} created, {updated} '
+            f'updated, {failed} skipped) in {elapsed:.2f}s, {rate:.0f} '
+            'rows/s'))
+
+    def _import_file(self, importer, path, file_format):
+        csv_file = (file_format == 'csv' if file_format
+                    else path.lower().endswith('.csv'))
+        try:
+            with open(path, newline='' if csv_file else None,
+                      encoding='utf-8') as file:
+                records = (iter_csv_records(file) if csv_file
+                           else iter_json_records(file))
+                importer.import_records(records)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Could not import {path}: {error}')
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+FTS_TABLE = 'products_product_fts'
+POSTGRES_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+def create_search_index(apps, schema_editor):
+    """ Add the full text search structures the database supports,
+        filled from the existing products """
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE products_product ADD COLUMN search_vector tsvector')
+        schema_editor.execute(
+            f'UPDATE products_product SET search_vector = '
+            f'{POSTGRES_SEARCH_VECTOR}')
+        schema_editor.execute(
+            'CREATE INDEX products_product_search_vector_idx '
+            'ON products_product USING gin (search_vector)')
+    elif connection.vendor == 'sqlite' and sqlite_has_fts5(connection):
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            f"USING fts5(name, description, tokenize='porter unicode61')")
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            f'SELECT id, name, description FROM products_product')
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE products_product DROP COLUMN search_vector')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_auto_20240109_2354'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.2.24 on 2026-10-18 01:31
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.text
+
+
+def merge_duplicate_categories(apps, schema_editor):
+    """ The listing filters categories by name, so categories sharing one
+        were already shown as one. Their products are moved to the first
+        of them and the others deleted, so the name can be made unique. """
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+    duplicated = Category.objects.values('name').annotate(
+        categories=models.Count('pk')).filter(
+        categories__gt=1).values_list('name', flat=True)
+    for name in list(duplicated):
+        first, *others = Category.objects.filter(name=name).order_by('pk')
+        Product.objects.filter(category__in=others).update(category=first)
+        Category.objects.filter(pk__in=[c.pk for c in others]).delete()
+
+
+def create_rating_desc_index(apps, schema_editor):
+    """ Postgres can only scan product_rating_idx backwards as
+        rating DESC NULLS FIRST, so the high to low sort, which puts
+        unrated products last, needs an index of its own. SQLite serves
+        both directions from product_rating_idx. """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX product_rating_desc_idx ON products_product '
+            '(rating DESC NULLS LAST, id DESC)')
+
+
+def drop_rating_desc_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS product_rating_desc_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_categories,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=254, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Lower('name'), django.db.models.expressions.F('id'), name='product_lower_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating', 'id'], name='product_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['sku'], name='product_sku_idx'),
+        ),
+        migrations.RunPython(create_rating_desc_index, drop_rating_desc_index),
+    ]
@@ -1,10 +1,13 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
 
 class Category(models.Model):
     class Meta:
         verbose_name_plural = 'Categories'
 
-    name = models.CharField(max_length=254)
+    name = models.CharField(max_length=254, unique=True)
     friendly_name = models.CharField(max_length=254, null=True, blank=True)
     
     def __str__(self):
@@ -14,6 +17,17 @@ class Category(models.Model):
         return self.friendly_name
     
 class Product(models.Model):
+    class Meta:
+        # the listing pages by (sort value, id), so each sort index ends
+        # with the id to serve the tiebreak as well
+        indexes = [
+            models.Index(Lower('name'), F('id'),
+                         name='product_lower_name_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['rating', 'id'], name='product_rating_idx'),
+            models.Index(fields=['sku'], name='product_sku_idx'),
+        ]
+
     category = models.ForeignKey('Category', null=True, blank=True, on_delete=models.SET_NULL)
     sku = models.CharField(max_length=254, null=True, blank=True) #sku = stock keeping unit
     name = models.CharField(max_length=254)
@@ -23,6 +37,25 @@ class Product(models.Model):
     rating = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     image_url = models.URLField(max_length=1024, null=True, blank=True)
     image = models.ImageField(null=True, blank=True)
+    # the image the thumbnails were last generated from, so pages only
+    # point at thumbnails which exist for the current image
+    thumbnails_of = models.CharField(
+        max_length=254, blank=True, default='', editable=False)
+    # the width of that image, as thumbnails are never wider than it
+    image_width = models.PositiveIntegerField(
+        null=True, blank=True, editable=False)
+    # set on every save, the default covers fixtures which are loaded
+    # without calling save
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
     
+    def save(self, *args, **kwargs):
+        """ Override the original save method to record when the
+            product was last changed """
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'updated_at'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
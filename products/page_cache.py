@@ -0,0 +1,213 @@
+import base64
+import hashlib
+import json
+import re
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse, QueryDict
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.safestring import mark_safe
+
+from .categories import category_registry
+from .facets import facet_values
+from .versions import get_version
+
+PLACEHOLDER_RE = re.compile(r'<!--personal:([A-Za-z0-9_=-]+)-->')
+# Pages with any of these parameters are rendered each time. Searches and
+# the pages after the first can come in endless variations, which would
+# only push the pages everyone asks for out of the cache.
+UNCACHED_PARAMS = ('q', 'cursor')
+
+
+def render_personal(request, template_name, values):
+    """ Render one of the per user parts of a page, e.g. the bag total """
+    return render_to_string(template_name, values, request=request)
+
+
+def rendering_for_page_cache(request):
+    """ Whether this request is rendering a page to be cached for everyone,
+        in which case the per user parts are left as placeholders """
+    return getattr(request, '_rendering_for_page_cache', False)
+
+
+def placeholder(template_name, values):
+    """ The marker left in a cached page for a per user part, which is
+        rendered from template_name and values for each visitor """
+    data = json.dumps([template_name, values], separators=(',', ':'))
+    token = base64.urlsafe_b64encode(data.encode()).decode()
+    return mark_safe(f'<!--personal:{token}-->')
+
+
+def fill_placeholders(request, html):
+    """ Replace every placeholder in a cached page with its part rendered
+        for this visitor """
+    def fill(match):
+        template_name, values = json.loads(
+            base64.urlsafe_b64decode(match.group(1)))
+        return render_personal(request, template_name, values)
+    return PLACEHOLDER_RE.sub(fill, html)
+
+
+def normalize_listing_params(params):
+    """ The listing's query parameters in a canonical form, so urls which
+        show the same page share a cache entry. Category and facet value
+        lists are sorted, categories and facet values which don't exist
+        and anything the listing doesn't use are dropped. """
+    normalized = QueryDict(mutable=True)
+    if params.get('category'):
+        categories = category_registry.by_names(
+            set(params['category'].split(',')))
+        if categories:
+            normalized['category'] = ','.join(
+                sorted(c.name for c in categories))
+    for facet in ('price', 'rating', 'sizes'):
+        if params.get(facet):
+            picked = set(params[facet].split(','))
+            keys = [key for key, _ in facet_values(facet) if key in picked]
+            if keys:
+                normalized[facet] = ','.join(sorted(keys))
+    if 'q' in params:
+        normalized['q'] = params['q']
+    if params.get('sort'):
+        normalized['sort'] = params['sort']
+        if params.get('direction'):
+            normalized['direction'] = params['direction']
+    if params.get('cursor'):
+        normalized['cursor'] = params['cursor']
+    return normalized
+
+
+def personal_state(request):
+    """ Everything the per user parts of a page depend on for this
+        visitor, or None if they can't be validated because there are
+        messages waiting to be shown """
+    if len(get_messages(request)):
+        return None
+    return [
+        request.user.pk,
+        request.user.is_superuser,
+        request.session.get('bag'),
+        # the csrf token in forms is derived from the cookie
+        request.META.get('CSRF_COOKIE'),
+    ]
+
+
+def cache_catalog_page(normalize_params=None, last_modified_func=None):
+    """ Cache the page a view renders against the catalog version.
+
+        The page is rendered once with placeholders where the per user
+        parts go (the bag total, messages, account menu, superuser links
+        and csrf token). Each request then only renders those parts, so
+        a cached page is served without running the view. The query
+        string is first put through normalize_params, if given, and is
+        otherwise dropped. Pages with UNCACHED_PARAMS aren't cached.
+
+        Pages are also sent with an ETag covering the catalog version and
+        the visitor's per user parts, so a browser or crawler asking again
+        gets a 304 before anything is rendered. Visitors with nothing per
+        user to show also get the Last-Modified time last_modified_func
+        returns for the page. """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            params = (normalize_params(request.GET) if normalize_params
+                      else QueryDict())
+            # the view only ever sees the normalized parameters, so every
+            # url sharing the cache entry renders the same page
+            request.GET = params
+            page_key = [get_version('catalog'), request.path,
+                        params.urlencode()]
+            cache_key = hashlib.sha1(
+                json.dumps(page_key).encode()).hexdigest()
+            cache_key = f'catalog_page:{cache_key}'
+            cacheable = not any(name in params for name in UNCACHED_PARAMS)
+
+            last_modified = None
+            state = personal_state(request)
+            if state is not None:
+                etag = _etag(page_key, state)
+                # a visitor with no account or bag sees nothing which
+                # changes without the page itself changing
+                if (last_modified_func and not request.user.is_authenticated
+                        and not request.session.get('bag')):
+                    # the time can only change along with the catalog
+                    # version, so it is looked up once per version
+                    if cacheable:
+                        last_modified = caches['pages'].get_or_set(
+                            f'{cache_key}:last_modified',
+                            lambda: last_modified_func(
+                                request, *args, **kwargs))
+                    else:
+                        last_modified = last_modified_func(
+                            request, *args, **kwargs)
+                not_modified = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified)
+                if not_modified is not None:
+                    return not_modified
+
+            if cacheable and settings.CATALOG_PAGE_CACHE:
+                response = _cached_page(
+                    request, cache_key, view_func, args, kwargs)
+            else:
+                response = view_func(request, *args, **kwargs)
+
+            if response.status_code == 200:
+                # rendering may have set the csrf cookie for the first
+                # time, so the etag is worked out again
+                state = personal_state(request)
+                if state is not None:
+                    response['ETag'] = _etag(page_key, state)
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+                # browsers have to check back each time, and shared caches
+                # mustn't keep a page with someone's bag in it
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _etag(page_key, state):
+    return quote_etag(hashlib.sha1(json.dumps(
+        page_key + state, default=str).encode()).hexdigest())
+
+
+def _cached_page(request, key, view_func, args, kwargs):
+    """ The page from the cache with its placeholders filled in, running
+        the view to render and cache it if it isn't there """
+    page_cache = caches['pages']
+    html = page_cache.get(key)
+    cache_status = 'hit'
+    if html is None:
+        request._rendering_for_page_cache = True
+        try:
+            response = view_func(request, *args, **kwargs)
+        finally:
+            request._rendering_for_page_cache = False
+        if response.status_code != 200 or response.streaming:
+            # redirects and errors aren't cached
+            return _fill_response(request, response)
+        html = response.content.decode(response.charset)
+        page_cache.set(key, html)
+        cache_status = 'miss'
+
+    response = HttpResponse(fill_placeholders(request, html))
+    response['X-Catalog-Cache'] = cache_status
+    return response
+
+
+def _fill_response(request, response):
+    """ Fill the placeholders in an uncached response """
+    if (not response.streaming
+            and response.get('Content-Type', '').startswith('text/html')):
+        response.content = fill_placeholders(
+            request, response.content.decode(response.charset))
+    return response
@@ -0,0 +1,186 @@
+import base64
+import json
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+
+
+def encode_cursor(data):
+    """ Turn cursor data into a short url safe string """
+    text = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Read a cursor made by encode_cursor, returning None if it has
+        been tampered with """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+
+
+class Page:
+    """ A page of results along with the cursors either side of it """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """ Paginate a queryset by seeking past the last row already shown
+        rather than using an offset, so every page costs the same as the
+        first.
+
+        Rows are ordered by sort_field and then by pk in the same
+        direction, so ties always come out in the same order and an index
+        on (sort_field, id) can serve the whole query. NULLs are sorted
+        last in both directions on every database. Without a sort_field
+        the queryset's own ordering is kept and pages fall back to
+        offsets, which is used for search results ordered by relevance. """
+
+    def __init__(self, queryset, sort_field='pk', descending=False,
+                 per_page=24, nullable=None):
+        self.queryset = queryset
+        self.sort_field = sort_field
+        self.descending = descending
+        self.per_page = per_page
+        if nullable is None:
+            # annotations aren't model fields, so unless we're told
+            # otherwise we assume they can be NULL
+            try:
+                nullable = queryset.model._meta.get_field(sort_field).null
+            except FieldDoesNotExist:
+                nullable = sort_field != 'pk'
+        self.nullable = nullable
+
+    def _signature(self):
+        return f'{self.sort_field}:{"desc" if self.descending else "asc"}'
+
+    def _ordering(self, reverse):
+        descending = self.descending != reverse
+        field = F(self.sort_field)
+        pk = F('pk').desc() if descending else F('pk').asc()
+        if self.sort_field == 'pk':
+            return [pk]
+        if not self.nullable:
+            # no NULLS modifier, which would stop Postgres using the index
+            return [field.desc() if descending else field.asc(), pk]
+        # NULLs stay at the end of the page order, so they move to the
+        # front when reading backwards
+        ordering = (field.desc(nulls_last=not reverse,
+                               nulls_first=reverse) if descending
+                    else field.asc(nulls_last=not reverse,
+                                   nulls_first=reverse))
+        return [ordering, pk]
+
+    def _seek(self, value, pk, reverse):
+        """ The filters for rows which come after (value, pk) when reading
+            forwards, or before it when reading backwards. Rows matching
+            the first filter come first, and so on, which keeps NULLs in
+            a query of their own so each query can be read in order from
+            an index. """
+        descending = self.descending != reverse
+        pk_after = Q(pk__lt=pk) if descending else Q(pk__gt=pk)
+        if self.sort_field == 'pk':
+            return [pk_after]
+
+        is_null = Q(**{f'{self.sort_field}__isnull': True})
+        if value is None:
+            if reverse:
+                # reading backwards from a NULL, every non NULL is before
+                return [is_null & pk_after, ~is_null]
+            return [is_null & pk_after]
+
+        # the redundant inclusive bound gives the database a range to
+        # start the index scan from
+        bound, beyond = ('lte', 'lt') if descending else ('gte', 'gt')
+        seek = Q(**{f'{self.sort_field}__{bound}': value}) & (
+            Q(**{f'{self.sort_field}__{beyond}': value})
+            | (Q(**{self.sort_field: value}) & pk_after))
+        if self.nullable and not reverse:
+            return [seek, is_null]
+        return [seek]
+
+    def _key(self, obj):
+        # sort_field has to be a field or annotation on the model itself,
+        # so related fields are annotated by the caller
+        value = getattr(obj, self.sort_field)
+        if isinstance(value, Decimal):
+            value = str(value)
+        return [value, obj.pk]
+
+    def page(self, cursor=None):
+        """ Return the page the cursor points at, or the first page """
+        data = decode_cursor(cursor) if cursor else None
+        if self.sort_field is None:
+            return self._offset_page(data)
+
+        querysets = None
+        # a cursor from another sort order, or one which has been edited,
+        # just gives the first page
+        if (isinstance(data, dict) and data.get('s') == self._signature()
+                and isinstance(data.get('k'), list) and len(data['k']) == 2):
+            reverse = data.get('d') == 'prev'
+            try:
+                querysets = [self.queryset.filter(seek) for seek in
+                             self._seek(*data['k'], reverse)]
+            except (ValidationError, ValueError, TypeError):
+                querysets = None
+
+        seeking = querysets is not None
+        if not seeking:
+            reverse = False
+            querysets = [self.queryset]
+
+        # one extra row tells us whether there is another page
+        rows = []
+        ordering = self._ordering(reverse)
+        for queryset in querysets:
+            rows += queryset.order_by(
+                *ordering)[:self.per_page + 1 - len(rows)]
+            if len(rows) > self.per_page:
+                break
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            if not has_more:
+                # we've walked back to the start, so show a full first page
+                return self.page()
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or reverse:
+                next_cursor = self._cursor(rows[-1], 'next')
+            if seeking:
+                previous_cursor = self._cursor(rows[0], 'prev')
+        return Page(rows, next_cursor, previous_cursor)
+
+    def _cursor(self, obj, direction):
+        return encode_cursor(
+            {'s': self._signature(), 'k': self._key(obj), 'd': direction})
+
+    def _offset_page(self, data):
+        offset = 0
+        if isinstance(data, dict) and isinstance(data.get('o'), int):
+            offset = max(data['o'], 0)
+        rows = list(self.queryset[offset:offset + self.per_page + 1])
+        next_cursor = previous_cursor = None
+        if len(rows) > self.per_page:
+            next_cursor = encode_cursor({'o': offset + self.per_page})
+        if offset:
+            previous_cursor = encode_cursor(
+                {'o': max(offset - self.per_page, 0)})
+        return Page(rows[:self.per_page], next_cursor, previous_cursor)
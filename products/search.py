@@ -0,0 +1,213 @@
+import bisect
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product
+from .versions import VersionedIndex, bump_version
+
+FTS_TABLE = 'products_product_fts'
+
+# Weights match the ranking Postgres gives to name (A) and description (B)
+POSTGRES_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def tokenize(text):
+    """ Split text into the lower case words the indexes are built on """
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def sqlite_has_fts5(db_connection):
+    """ Whether this SQLite build includes the FTS5 extension """
+    with db_connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+class SearchBackend:
+    """ The interface every product search backend provides """
+
+    def search(self, queryset, query, rank=False):
+        """ Filter the queryset down to the products matching the query,
+            ordering them by relevance if rank is True and the backend
+            supports it """
+        raise NotImplementedError
+
+    def index_product(self, product):
+        """ Add or update a single product in the index """
+        raise NotImplementedError
+
+    def remove_product(self, product_id):
+        """ Remove a single product from the index """
+        raise NotImplementedError
+
+    def rebuild(self):
+        """ Rebuild the whole index from the product table """
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(SearchBackend):
+    """ Search a tsvector column kept on the product table, which has a
+        GIN index, ranking the results with ts_rank """
+
+    match = "search_vector @@ plainto_tsquery('english', %s)"
+    rank_sql = "ts_rank(search_vector, plainto_tsquery('english', %s))"
+
+    def search(self, queryset, query, rank=False):
+        queryset = queryset.extra(where=[self.match], params=[query])
+        if rank:
+            queryset = queryset.annotate(
+                search_rank=RawSQL(self.rank_sql, (query,))
+            ).order_by('-search_rank', 'pk')
+        return queryset
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE products_product SET search_vector = '
+                f'{POSTGRES_SEARCH_VECTOR} WHERE id = %s', [product.pk])
+
+    def remove_product(self, product_id):
+        # the vector is deleted along with the product row
+        pass
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE products_product SET search_vector = '
+                f'{POSTGRES_SEARCH_VECTOR}')
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """ Search an FTS5 shadow table whose rowid is the product id,
+        ranking the results with bm25 """
+
+    def _fts_query(self, query):
+        # every word has to match, as a prefix, and is quoted so the
+        # user can't use the FTS5 query syntax
+        return ' '.join(
+            '"{}"*'.format(token.replace('"', '""'))
+            for token in tokenize(query))
+
+    def search(self, queryset, query, rank=False):
+        fts_query = self._fts_query(query)
+        if not fts_query:
+            return queryset.none()
+        # the FTS table is joined on its rowid, which is the product id
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = products_product.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[fts_query])
+        if rank:
+            # bm25 is lower for better matches, with name weighted
+            # above description
+            queryset = queryset.extra(
+                select={'search_rank': f'bm25({FTS_TABLE}, 10.0, 1.0)'}
+            ).order_by('search_rank', 'pk')
+        return queryset
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+                f'VALUES (%s, %s, %s)',
+                [product.pk, product.name, product.description])
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+                f'SELECT id, name, description FROM products_product')
+
+
+class PythonSearchBackend(VersionedIndex, SearchBackend):
+    """ An in-memory inverted index for databases without full text
+        search. Each process builds its own copy the first time it is
+        used and rebuilds it when another process changes the catalog.
+        Results are not ranked. """
+
+    version_name = 'search'
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}
+        self._tokens = []
+
+    def _build(self):
+        postings = defaultdict(set)
+        for pk, name, description in Product.objects.values_list(
+                'pk', 'name', 'description').iterator():
+            for token in tokenize(name) + tokenize(description):
+                postings[token].add(pk)
+        self._postings = dict(postings)
+        self._tokens = sorted(self._postings)
+
+    def _matching_ids(self, token):
+        """ The ids of every product with a word starting with token """
+        ids = set()
+        start = bisect.bisect_left(self._tokens, token)
+        for indexed in self._tokens[start:]:
+            if not indexed.startswith(token):
+                break
+            ids |= self._postings[indexed]
+        return ids
+
+    def search(self, queryset, query, rank=False):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        self._ensure_current()
+        ids = None
+        for token in tokens:
+            matches = self._matching_ids(token)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return queryset.none()
+        return queryset.filter(pk__in=ids)
+
+    def index_product(self, product):
+        # the next search in every process, this one included, rebuilds
+        # the index from the database
+        bump_version('search')
+
+    def remove_product(self, product_id):
+        bump_version('search')
+
+    def rebuild(self):
+        bump_version('search')
+
+
+_backend = None
+
+
+def get_search_backend():
+    """ Return the search backend set in PRODUCT_SEARCH_BACKEND, or the
+        best one the database supports """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        elif connection.vendor == 'sqlite' and sqlite_has_fts5(connection):
+            _backend = SQLiteSearchBackend()
+        else:
+            _backend = PythonSearchBackend()
+    return _backend
@@ -0,0 +1,69 @@
+from django.db.models.signals import (
+    pre_save, post_save, pre_delete, post_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Category, Product
+from .search import get_search_backend
+from .versions import bump_version
+
+
+@receiver(pre_save, sender=Product)
+def check_price_change(sender, instance, **kwargs):
+    """ Note whether the product's price is being changed """
+    instance._price_changed = True
+    if instance.pk:
+        old_price = sender.objects.filter(
+            pk=instance.pk).values_list('price', flat=True).first()
+        instance._price_changed = old_price != instance.price
+
+
+@receiver(post_save, sender=Product)
+def update_price_version_on_save(sender, instance, created, **kwargs):
+    """ Invalidate cached bag totals when a product price changes """
+    if not created and getattr(instance, '_price_changed', True):
+        bump_version('prices')
+
+
+@receiver(post_delete, sender=Product)
+def update_price_version_on_delete(sender, instance, **kwargs):
+    """ Invalidate cached bag totals when a product is deleted """
+    bump_version('prices')
+
+
+@receiver(post_save, sender=Product)
+def update_search_index_on_save(sender, instance, **kwargs):
+    """ Keep the search index in step with the product """
+    get_search_backend().index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    """ Remove the deleted product from the search index """
+    get_search_backend().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def update_catalog_version(sender, **kwargs):
+    """ Invalidate anything cached from the product listing, such as
+        result counts, whenever a product or category changes """
+    bump_version('catalog')
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def touch_category_products(sender, instance, **kwargs):
+    """ Mark the category's products as updated, as their pages show the
+        category and so are no longer the pages a browser has cached """
+    Product.objects.filter(category=instance).update(
+        updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def update_category_version(sender, **kwargs):
+    """ Make every process load the categories again """
+    bump_version('categories')
@@ -0,0 +1,86 @@
+import bisect
+
+from django.urls import reverse
+
+from .categories import category_registry
+from .models import Product
+from .search import tokenize
+from .versions import VersionedIndex
+
+
+def _terms(text):
+    """ The text from each word onwards, so 'blue sh' and 'sh' both find
+        'Blue Shirt' """
+    words = tokenize(text)
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class SuggestionIndex(VersionedIndex):
+    """ Sorted arrays of the product names, SKUs and category names held
+        in memory by each process, for suggesting matches as a visitor
+        types in the search box. Every word a name starts from is kept
+        in order, so a prefix is found by a binary search and read off
+        until it stops matching. The arrays are rebuilt when the catalog
+        version changes. """
+
+    def __init__(self):
+        super().__init__()
+        self._products = ([], [])
+        self._categories = ([], [])
+
+    def _build(self):
+        products = []
+        for pk, name, sku in Product.objects.values_list(
+                'pk', 'name', 'sku').iterator():
+            for term in _terms(name):
+                products.append((term, pk, name))
+            if sku:
+                products.append((' '.join(tokenize(sku)), pk, name))
+        categories = []
+        for category in category_registry.all():
+            label = category.get_friendly_name() or category.name
+            for term in set(_terms(label) + [category.name.lower()]):
+                categories.append((term, category.name, label))
+        self._products = self._arrays(products)
+        self._categories = self._arrays(categories)
+
+    def _arrays(self, entries):
+        # the terms are searched apart from what they point to, so the
+        # binary search only compares strings
+        entries.sort()
+        return ([term for term, _, _ in entries],
+                [(key, label) for _, key, label in entries])
+
+    def _matches(self, arrays, prefix, limit):
+        terms, targets = arrays
+        found = {}
+        start = bisect.bisect_left(terms, prefix)
+        for i in range(start, len(terms)):
+            if len(found) >= limit or not terms[i].startswith(prefix):
+                break
+            key, label = targets[i]
+            found.setdefault(key, label)
+        return found.items()
+
+    def suggest(self, query, limit=8):
+        """ Up to limit categories and products with a word, or the SKU,
+            starting with query, categories first """
+        prefix = ' '.join(tokenize(query))
+        if not prefix:
+            return []
+        self._ensure_current()
+        suggestions = [{
+            'kind': 'category',
+            'label': label,
+            'url': f'{reverse("products")}?category={name}',
+        } for name, label in self._matches(self._categories, prefix, limit)]
+        suggestions += [{
+            'kind': 'product',
+            'label': label,
+            'url': reverse('product_detail', args=[pk]),
+        } for pk, label in self._matches(
+            self._products, prefix, limit - len(suggestions))]
+        return suggestions
+
+
+suggestion_index = SuggestionIndex()
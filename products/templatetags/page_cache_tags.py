@@ -0,0 +1,19 @@
+from django import template
+
+from products.page_cache import placeholder, rendering_for_page_cache
+
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def personal(context, template_name, **values):
+    """ Include a part of the page which differs from visitor to visitor,
+        e.g. the bag total. If the page is being cached, a placeholder is
+        left to be filled in for each request instead. """
+    if rendering_for_page_cache(context.get('request')):
+        return placeholder(template_name, values)
+    # otherwise it is rendered just like {% include %} would
+    included = context.template.engine.get_template(template_name)
+    with context.push(**values):
+        return included.render(context)
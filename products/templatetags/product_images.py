@@ -0,0 +1,26 @@
+from django import template
+from django.conf import settings
+
+from products.images import thumbnail_srcset
+
+
+register = template.Library()
+
+
+@register.inclusion_tag('products/includes/product_image.html')
+def product_image(product, sizes, css_class=''):
+    """ The product's image, letting the browser pick the smallest
+        thumbnail which fills sizes at the screen's resolution. Images
+        without thumbnails yet are shown at full size. """
+    context = {
+        'product': product,
+        'sizes': sizes,
+        'css_class': css_class,
+        'noimage_url': f'{settings.MEDIA_URL}noimage.png',
+    }
+    if (product.image and product.image_width
+            and product.thumbnails_of == product.image.name):
+        for extension in ('webp', 'jpg'):
+            context[f'{extension}_srcset'] = thumbnail_srcset(
+                product.image.name, product.image_width, extension)
+    return context
@@ -1,3 +1,1244 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.db.models import Q
+from django.http import QueryDict
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date, parse_http_date
+from PIL import Image
+
+from .categories import CategoryRegistry, category_registry
+from .facets import FacetIndex, facet_filter
+from .forms import ProductForm
+from .images import generate_thumbnails, thumbnail_name
+from .importer import CatalogImporter, iter_json_records
+from .management.commands.generate_thumbnails import process_image
+from .models import Category, Product
+from .page_cache import normalize_listing_params
+from .pagination import KeysetPaginator, encode_cursor
+from .search import PythonSearchBackend, SQLiteSearchBackend
+from .suggest import SuggestionIndex
+from .versions import bump_version, get_version
+
+
+class SearchBackendTestMixin:
+    """ Tests every search backend has to pass """
+
+    backend_class = None
+
+    def setUp(self):
+        self.backend = self.backend_class()
+        self.jeans = Product.objects.create(
+            name='Bootcut Jeans', description='Cotton denim', price=50)
+        self.shirt = Product.objects.create(
+            name='Oxford Shirt', description='Goes well with jeans',
+            price=30)
+        self.mug = Product.objects.create(
+            name='Mug', description='Stoneware', price=10)
+
+    def _search(self, query, rank=False):
+        return list(self.backend.search(
+            Product.objects.all(), query, rank=rank))
+
+    def test_matches_name_and_description(self):
+        self.assertEqual(
+            set(self._search('jeans')), {self.jeans, self.shirt})
+        self.assertEqual(self._search('stoneware'), [self.mug])
+
+    def test_matches_word_prefixes(self):
+        self.assertEqual(self._search('boot'), [self.jeans])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self._search('cotton jeans'), [self.jeans])
+        self.assertEqual(self._search('cotton mug'), [])
+
+    def test_query_syntax_is_ignored(self):
+        self.assertEqual(self._search('"jeans" OR -*'), [])
+        self.assertEqual(self._search('!!'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.mug.name = 'Travel Mug'
+        self.mug.save()
+        self.assertEqual(self._search('travel'), [self.mug])
+        self.jeans.delete()
+        self.assertEqual(self._search('bootcut'), [])
+
+
+class SQLiteSearchBackendTest(SearchBackendTestMixin, TestCase):
+    backend_class = SQLiteSearchBackend
+
+    def test_ranks_name_matches_first(self):
+        self.assertEqual(
+            self._search('jeans', rank=True), [self.jeans, self.shirt])
+
+
+class PythonSearchBackendTest(SearchBackendTestMixin, TestCase):
+    backend_class = PythonSearchBackend
+
+
+@override_settings(CATALOG_PAGE_CACHE=False)
+class AllProductsSearchTest(TestCase):
+    """ Tests for searching from the product listing """
+
+    def test_search_query(self):
+        jeans = Product.objects.create(
+            name='Bootcut Jeans', description='Cotton denim', price=50)
+        Product.objects.create(name='Mug', description='Stoneware', price=10)
+        response = self.client.get(reverse('products'), {'q': 'jeans'})
+        self.assertEqual(list(response.context['products']), [jeans])
+
+
+@override_settings(PRODUCTS_PER_PAGE=4, CATALOG_PAGE_CACHE=False)
+class AllProductsPaginationTest(TestCase):
+    """ Tests for paging through the product listing """
+
+    def setUp(self):
+        cache.clear()
+        clothing = Category.objects.create(name='clothing')
+        kitchen = Category.objects.create(name='kitchen')
+        # plenty of ties and NULLs, so the pk tiebreaker is needed
+        for i in range(15):
+            Product.objects.create(
+                name=f'{"Ab"[i % 2]} product {i % 3}',
+                price=10 + i % 4,
+                rating=None if i % 5 == 0 else i % 3,
+                category=[clothing, kitchen, None][i % 3])
+
+    def _walk(self, params):
+        """ Follow the next links from the first page to the last """
+        seen = []
+        url = reverse('products')
+        response = self.client.get(url, params)
+        while True:
+            seen += list(response.context['products'])
+            url = response.context['next_page_url']
+            if not url:
+                return seen, response
+            response = self.client.get(url)
+
+    def _expected(self, key, descending):
+        products = list(Product.objects.order_by('pk'))
+        present = [p for p in products if key(p) is not None]
+        missing = [p for p in products if key(p) is None]
+        # ties are broken by pk in the same direction, NULLs always last
+        present.sort(key=lambda p: (key(p), p.pk), reverse=descending)
+        missing.sort(key=lambda p: p.pk, reverse=descending)
+        return present + missing
+
+    def test_every_sort_visits_each_product_once_in_order(self):
+        keys = {
+            'name': lambda p: p.name.lower(),
+            'price': lambda p: p.price,
+            'rating': lambda p: p.rating,
+            'category': lambda p: p.category and p.category.name,
+        }
+        for sort, key in keys.items():
+            for direction in ('asc', 'desc'):
+                with self.subTest(sort=sort, direction=direction):
+                    seen, _ = self._walk(
+                        {'sort': sort, 'direction': direction})
+                    self.assertEqual(
+                        seen, self._expected(key, direction == 'desc'))
+
+    def test_default_listing_is_paged_by_id(self):
+        seen, response = self._walk({})
+        self.assertEqual(seen, list(Product.objects.order_by('pk')))
+        self.assertEqual(response.context['products_total'], 15)
+
+    def test_previous_links_walk_back_through_the_same_pages(self):
+        params = {'sort': 'rating', 'direction': 'desc'}
+        pages = []
+        response = self.client.get(reverse('products'), params)
+        while True:
+            pages.append(list(response.context['products']))
+            if not response.context['next_page_url']:
+                break
+            response = self.client.get(response.context['next_page_url'])
+        for page in reversed(pages[:-1]):
+            response = self.client.get(
+                response.context['previous_page_url'])
+            self.assertEqual(list(response.context['products']), page)
+        self.assertIsNone(response.context['previous_page_url'])
+
+    def test_deep_pages_take_the_same_queries_as_the_first(self):
+        paginator = KeysetPaginator(
+            Product.objects.all(), 'price', per_page=4)
+        with self.assertNumQueries(1):
+            page = paginator.page()
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                page = paginator.page(page.next_cursor)
+        self.assertIsNone(page.next_cursor)
+
+    def test_count_is_cached_between_pages(self):
+        self.client.get(reverse('products'), {'sort': 'price'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('products'), {'sort': 'price'})
+        self.assertFalse(
+            [q for q in queries if 'COUNT' in q['sql']])
+
+    def test_count_is_recalculated_when_the_catalog_changes(self):
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.context['products_total'], 15)
+        Product.objects.create(name='New', price=1)
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.context['products_total'], 16)
+
+    def test_bad_cursors_give_the_first_page(self):
+        first = list(self.client.get(
+            reverse('products'), {'sort': 'price'}).context['products'])
+        other_sort = self.client.get(
+            reverse('products'), {'sort': 'name'}
+        ).context['next_page_url'].split('cursor=')[1]
+        tampered = encode_cursor(
+            {'s': 'price:asc', 'k': ['cheap', 1], 'd': 'next'})
+        for cursor in ('not-a-cursor', other_sort, tampered):
+            response = self.client.get(
+                reverse('products'), {'sort': 'price', 'cursor': cursor})
+            self.assertEqual(list(response.context['products']), first)
+
+    def test_search_results_are_paged_in_rank_order(self):
+        seen, _ = self._walk({'q': 'product'})
+        self.assertEqual(len(seen), 15)
+        self.assertEqual(len(set(seen)), 15)
+
+
+@override_settings(CATALOG_PAGE_CACHE=False)
+# cache.clear() moves the category version on, and it is looked up
+# every time so each request sees that
+@override_settings(CATEGORY_VERSION_CHECK_INTERVAL=0)
+class ProductQueryCountTest(TestCase):
+    """ Tests the product pages take the same number of queries
+        however many products there are """
+
+    def setUp(self):
+        cache.clear()
+        self.categories = [
+            Category.objects.create(name=f'cat{i}', friendly_name=f'Cat {i}')
+            for i in range(3)]
+
+    def _add_products(self, count):
+        for i in range(count):
+            Product.objects.create(
+                name=f'Product {i}', description='Useful', price=10,
+                rating=4, category=self.categories[i % 3])
+
+    def _count_queries(self, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(*args)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_listing_queries_do_not_grow_with_the_catalog(self):
+        for params in ({}, {'sort': 'category'}, {'category': 'cat0,cat1'},
+                       {'q': 'product'}):
+            with self.subTest(params=params):
+                Product.objects.all().delete()
+                self._add_products(2)
+                cache.clear()
+                few = self._count_queries(reverse('products'), params)
+                self._add_products(20)
+                cache.clear()
+                many = self._count_queries(reverse('products'), params)
+                self.assertEqual(few, many)
+
+    def test_listing_joins_categories_and_filters_once(self):
+        self._add_products(6)
+        self.client.get(reverse('products'), {'category': 'cat0,cat1'})
+        # the categories come from memory and the count is cached, so
+        # the page of products is the only query
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('products'), {'category': 'cat0,cat1'})
+            for product in response.context['products']:
+                product.category.friendly_name
+        self.assertEqual(len(response.context['products']), 4)
+
+    def test_listing_only_loads_the_columns_it_renders(self):
+        self._add_products(1)
+        response = self.client.get(reverse('products'))
+        product = response.context['products'].object_list[0]
+        self.assertEqual(
+            product.get_deferred_fields(),
+            {'sku', 'has_sizes', 'description', 'image_url', 'updated_at'})
+
+    def test_detail_is_a_single_query(self):
+        self._add_products(1)
+        product = Product.objects.get()
+        url = reverse('product_detail', args=[product.id])
+        self.client.get(url)  # looks up the Last-Modified time once
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'Cat 0')
+        self.assertContains(response, 'Useful')
+
+
+def explain(sql, params=()):
+    """ The query plan the database picks for sql, as text """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # a test sized table is quicker to scan, so we make the
+            # planner show us the plan it would use on a real catalog
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+        else:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+
+def uses_index(plan):
+    markers = ('USING INDEX', 'USING COVERING INDEX', 'PRIMARY KEY',
+               'Index Scan', 'Index Only Scan')
+    return any(marker in plan for marker in markers)
+
+
+def sorts_in_memory(plan):
+    return 'TEMP B-TREE FOR ORDER BY' in plan or 'Sort Key' in plan
+
+
+@override_settings(PRODUCTS_PER_PAGE=4, CATALOG_PAGE_CACHE=False)
+class ListingIndexTest(TestCase):
+    """ Checks the query plan of every listing query shape, so a change
+        to the listing or the indexes can't quietly fall back to scanning
+        and sorting the whole product table """
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='kitchen')
+        for i in range(30):
+            Product.objects.create(
+                name=f'Product {i}', price=i % 7, rating=i % 5 or None,
+                sku=f'sku{i}', category=self.category if i % 2 else None)
+
+    def _page_queries(self, params):
+        """ The product queries for the first and second listing page """
+        sqls = []
+        url = reverse('products')
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            sqls += [q['sql'] for q in queries
+                     if q['sql'].startswith('SELECT "products_product"')
+                     and 'LIMIT' in q['sql']]
+            self.assertEqual(response.status_code, 200)
+            url, params = response.context['next_page_url'], None
+        return sqls
+
+    def test_sorted_pages_are_read_from_an_index(self):
+        for sort in ('name', 'price', 'rating', None):
+            for direction in ('asc', 'desc'):
+                params = {'sort': sort, 'direction': direction} if sort \
+                    else {}
+                for sql in self._page_queries(params):
+                    with self.subTest(params=params, sql=sql):
+                        plan = explain(sql)
+                        self.assertTrue(uses_index(plan), plan)
+                        self.assertFalse(sorts_in_memory(plan), plan)
+
+    def test_category_queries_use_an_index(self):
+        for params in ({'sort': 'category'},
+                       {'sort': 'category', 'direction': 'desc'},
+                       {'category': 'kitchen', 'sort': 'price'}):
+            for sql in self._page_queries(params):
+                with self.subTest(params=params, sql=sql):
+                    self.assertTrue(uses_index(explain(sql)))
+
+    def test_category_names_are_unique(self):
+        with self.assertRaises(IntegrityError):
+            Category.objects.create(name='kitchen')
+
+    def test_sku_lookup_uses_an_index(self):
+        sql, params = Product.objects.filter(
+            sku='sku3').query.sql_with_params()
+        self.assertTrue(uses_index(explain(sql, params)))
+
+
+@override_settings(CATALOG_PAGE_CACHE=False)
+class ProductCardCacheTest(TestCase):
+    """ Tests for the cached product cards on the listing """
+
+    def setUp(self):
+        cache.clear()
+        caches['fragments'].clear()
+        self.category = Category.objects.create(
+            name='kitchen', friendly_name='Kitchen')
+        self.product = Product.objects.create(
+            name='Mug', price=10, category=self.category)
+
+    def test_cards_are_reused_until_the_catalog_changes(self):
+        self.assertContains(self.client.get(reverse('products')), 'Mug')
+        # an update which skips the signals leaves the cached card alone
+        Product.objects.filter(pk=self.product.pk).update(name='Cup')
+        self.assertContains(self.client.get(reverse('products')), 'Mug')
+
+        self.product.refresh_from_db()
+        self.product.save()
+        self.assertContains(self.client.get(reverse('products')), 'Cup')
+
+    def test_category_changes_render_the_cards_again(self):
+        self.client.get(reverse('products'))
+        self.category.friendly_name = 'Kitchenware'
+        self.category.save()
+        self.assertContains(
+            self.client.get(reverse('products')), 'Kitchenware')
+
+    def test_superuser_links_are_not_cached(self):
+        edit_url = reverse('edit_product', args=[self.product.id])
+        self.assertNotContains(
+            self.client.get(reverse('products')), edit_url)
+        User.objects.create_superuser('admin', 'a@example.com', 'pass')
+        self.client.login(username='admin', password='pass')
+        self.assertContains(self.client.get(reverse('products')), edit_url)
+        self.client.logout()
+        self.assertNotContains(
+            self.client.get(reverse('products')), edit_url)
+
+
+class CatalogPageCacheTest(TestCase):
+    """ Tests for serving the listing and product pages from the cache """
+
+    def setUp(self):
+        cache.clear()
+        caches['fragments'].clear()
+        caches['pages'].clear()
+        self.jeans = Category.objects.create(name='jeans')
+        self.shirts = Category.objects.create(name='shirts')
+        self.product = Product.objects.create(
+            name='Bootcut Jeans', price=50, category=self.jeans)
+
+    def test_equivalent_listing_urls_share_a_page(self):
+        url = reverse('products')
+        first = self.client.get(url, {'category': 'shirts,jeans'})
+        self.assertEqual(first['X-Catalog-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            second = self.client.get(
+                url, {'category': 'jeans,shirts,jeans', 'utm_source': 'x'})
+        self.assertEqual(second['X-Catalog-Cache'], 'hit')
+        self.assertEqual(first.content, second.content)
+
+    def test_searches_and_later_pages_are_not_cached(self):
+        url = reverse('products')
+        for params in ({'q': 'jeans'}, {'cursor': 'abc'}):
+            for _ in range(2):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Catalog-Cache', response)
+        self.client.get(url)
+        # whole pages are kept apart from the product cards
+        self.assertEqual(len(caches['pages']._cache), 2)
+        self.assertFalse(any(
+            'catalog_page' in key for key in caches['fragments']._cache))
+
+    def test_detail_page_is_cached(self):
+        url = reverse('product_detail', args=[self.product.id])
+        self.assertEqual(self.client.get(url)['X-Catalog-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Catalog-Cache'], 'hit')
+        self.assertContains(response, 'Bootcut Jeans')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_catalog_changes_invalidate_pages(self):
+        url = reverse('product_detail', args=[self.product.id])
+        self.client.get(url)
+        self.product.name = 'Skinny Jeans'
+        self.product.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Catalog-Cache'], 'miss')
+        self.assertContains(response, 'Skinny Jeans')
+
+    def test_bag_and_messages_are_filled_in_per_visitor(self):
+        url = reverse('product_detail', args=[self.product.id])
+        self.client.get(url)
+        self.client.post(
+            reverse('add_to_bag', args=[self.product.id]),
+            {'quantity': 2, 'redirect_url': url})
+        response = self.client.get(url)
+        self.assertEqual(response['X-Catalog-Cache'], 'hit')
+        self.assertContains(response, '$100.00')
+        self.assertContains(response, 'Added Bootcut Jeans to your bag')
+        # the message has been shown, so the next view is back to normal
+        self.assertNotContains(
+            self.client.get(url), 'Added Bootcut Jeans to your bag')
+        self.assertContains(Client().get(url), '$0.00')
+
+    def test_superuser_controls_are_filled_in_per_visitor(self):
+        edit_url = reverse('edit_product', args=[self.product.id])
+        self.assertNotContains(self.client.get(reverse('products')), edit_url)
+        User.objects.create_superuser('admin', 'a@example.com', 'pass')
+        self.client.login(username='admin', password='pass')
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response['X-Catalog-Cache'], 'hit')
+        self.assertContains(response, edit_url)
+        self.assertContains(response, 'Product Management')
+
+    def test_redirects_are_not_cached(self):
+        response = self.client.get(reverse('products'), {'q': ''})
+        self.assertRedirects(
+            response, reverse('products'), fetch_redirect_response=False)
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, 'enter any search criteria')
+
+
+class ConditionalCatalogPageTest(TestCase):
+    """ Tests for answering repeat visits to catalog pages with a 304 """
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='jeans')
+        self.product = Product.objects.create(
+            name='Bootcut Jeans', price=50, category=self.category)
+        self.url = reverse('product_detail', args=[self.product.id])
+
+    def test_matching_etag_is_not_modified(self):
+        for url in (self.url, reverse('products')):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_crawlers_are_answered_by_last_modified(self):
+        last_modified = Client().get(self.url)['Last-Modified']
+        response = Client().get(
+            self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_and_category_changes_modify_the_page(self):
+        for change in (self.product, self.category):
+            with self.subTest(change=change):
+                response = Client().get(self.url)
+                etag = response['ETag']
+                since = http_date(
+                    parse_http_date(response['Last-Modified']) - 1)
+                change.save()
+                for headers in ({'HTTP_IF_NONE_MATCH': etag},
+                                {'HTTP_IF_MODIFIED_SINCE': since}):
+                    response = Client().get(self.url, **headers)
+                    self.assertEqual(response.status_code, 200)
+
+    def test_etag_follows_the_visitors_bag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(
+            reverse('add_to_bag', args=[self.product.id]),
+            {'quantity': 1, 'redirect_url': self.url})
+        # the success message makes this page impossible to validate
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        # the bag total differs from the page the etag was sent with
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_pages_are_private_and_revalidated(self):
+        cache_control = self.client.get(self.url)['Cache-Control']
+        self.assertIn('private', cache_control)
+        self.assertIn('no-cache', cache_control)
+
+
+class CategoryRegistryTest(TestCase):
+    """ Tests for the categories each process keeps in memory """
+
+    def setUp(self):
+        cache.clear()
+        self.jeans = Category.objects.create(
+            name='jeans', friendly_name='Jeans')
+        self.shirts = Category.objects.create(
+            name='shirts', friendly_name='Shirts')
+        self.registry = CategoryRegistry()
+
+    def test_categories_are_loaded_once(self):
+        self.registry.all()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.registry.all(), (self.jeans, self.shirts))
+            self.assertEqual(
+                self.registry.by_names(['shirts', 'bogus']), [self.shirts])
+            self.assertEqual(self.registry.choices(),
+                             [(self.jeans.id, 'Jeans'),
+                              (self.shirts.id, 'Shirts')])
+
+    def test_changes_in_another_process_are_picked_up(self):
+        other_process = CategoryRegistry()
+        other_process.all()
+        self.registry.all()
+        Category.objects.create(name='deals', friendly_name='Deals')
+        self.shirts.delete()
+        for registry in (self.registry, other_process):
+            self.assertEqual(
+                [c.name for c in registry.all()], ['jeans', 'deals'])
+
+    def test_version_is_checked_once_an_interval(self):
+        self.registry.all()
+        with patch('products.versions.get_version') as get:
+            self.registry.all()
+            self.registry.nav_menus()
+        get.assert_not_called()
+        # a change made in another process shows once the interval is up
+        with patch.dict('products.versions._bumped_here'):
+            bump_version('categories')
+        Category.objects.filter(pk=self.shirts.pk).update(name='tops')
+        self.assertEqual(
+            [c.name for c in self.registry.all()], ['jeans', 'shirts'])
+        with override_settings(CATEGORY_VERSION_CHECK_INTERVAL=0):
+            self.assertEqual(
+                [c.name for c in self.registry.all()], ['jeans', 'tops'])
+
+    def test_home_page_makes_no_queries(self):
+        self.client.get(reverse('home'))
+        # in production the version is in the database cache, so looking
+        # it up would be a query
+        with patch('products.versions.get_version') as get, \
+                self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        get.assert_not_called()
+        self.assertContains(response, '?category=jeans,shirts')
+
+    def test_nav_menus_only_show_categories_which_exist(self):
+        Category.objects.create(name='activewear', friendly_name='Activewear')
+        registry = CategoryRegistry()
+        clothing, = registry.nav_menus()
+        self.assertEqual(clothing['label'], 'Clothing')
+        self.assertEqual(
+            [(link['label'], link['category']) for link in clothing['links']],
+            [('Activewear', 'activewear'), ('Jeans', 'jeans'),
+             ('Shirts', 'shirts')])
+        self.assertEqual(clothing['all_link'], 'activewear,jeans,shirts')
+
+    def test_pages_and_forms_make_no_category_queries(self):
+        category_registry.all()
+        with CaptureQueriesContext(connection) as queries:
+            ProductForm()
+            response = self.client.get(
+                reverse('products'), {'category': 'jeans,bogus'})
+        self.assertFalse(
+            [q for q in queries if 'FROM "products_category"' in q['sql']
+             and 'JOIN' not in q['sql']])
+        self.assertContains(response, '?category=jeans,shirts')
+        self.assertEqual(
+            list(response.context['current_categories']), [self.jeans])
+
+
+@override_settings(CATALOG_PAGE_CACHE=False)
+class FacetCountTest(TestCase):
+    """ Tests for the facet counts kept in memory as bitmaps """
+
+    def setUp(self):
+        cache.clear()
+        self.jeans = Category.objects.create(name='jeans')
+        self.shirts = Category.objects.create(name='shirts')
+        for i in range(30):
+            Product.objects.create(
+                name=f'{"Blue" if i % 2 else "Red"} thing {i}',
+                price=[5, 30, 75, 150][i % 4],
+                rating=None if i % 7 == 0 else [4.5, 3.5, 1][i % 3],
+                has_sizes=[True, False, None][i % 5 % 3],
+                category=[self.jeans, self.shirts, None][i % 3])
+        self.index = FacetIndex()
+
+    def _expected(self, selections, facet=None, key=None):
+        """ Count the products with key in facet, and the selections in
+            every other facet, in the database. Without a facet every
+            selection counts. """
+        products = Product.objects.all()
+        for other, keys in selections.items():
+            if other == facet or not keys:
+                continue
+            if other == 'category':
+                products = products.filter(category__in=keys)
+            else:
+                q = Q()
+                for other_key in keys:
+                    q |= facet_filter(other, other_key)
+                products = products.filter(q)
+        if facet is None:
+            return products.count()
+        if facet == 'category':
+            return products.filter(category=key).count()
+        return products.filter(facet_filter(facet, key)).count()
+
+    def test_counts_match_the_database(self):
+        for selections in (
+                {},
+                {'price': ['under-25']},
+                {'category': [self.jeans.id], 'rating': ['4-up', 'unrated']},
+                {'price': ['25-50', '100-up'], 'sizes': ['no'],
+                 'category': [self.jeans.id, self.shirts.id]}):
+            with self.subTest(selections=selections):
+                counts, total = self.index.counts(selections)
+                for facet, values in counts.items():
+                    for key, count in values.items():
+                        self.assertEqual(
+                            count, self._expected(selections, facet, key))
+                self.assertEqual(total, self._expected(selections))
+
+    def test_counts_are_kept_in_memory(self):
+        self.index.counts({})
+        with self.assertNumQueries(0):
+            self.index.counts({'price': ['50-100'], 'sizes': ['yes']})
+
+    def test_counts_follow_catalog_changes(self):
+        _, total = self.index.counts({'price': ['100-up']})
+        Product.objects.create(name='Coat', price=200)
+        _, new_total = self.index.counts({'price': ['100-up']})
+        self.assertEqual(new_total, total + 1)
+
+    def test_listing_filters_and_counts_by_facet(self):
+        response = self.client.get(
+            reverse('products'), {'price': '100-up,under-25', 'q': 'blue'})
+        expected = Product.objects.filter(
+            name__startswith='Blue').filter(
+            facet_filter('price', '100-up')
+            | facet_filter('price', 'under-25'))
+        self.assertEqual(
+            set(response.context['products']), set(expected))
+        self.assertEqual(
+            response.context['products_total'], expected.count())
+        price, = [menu for menu in response.context['facet_menus']
+                  if menu['param'] == 'price']
+        # the price counts ignore the price picked, but not the search
+        self.assertEqual(
+            [(value['label'], value['count'], value['selected'])
+             for value in price['values']],
+            [('Under $25', 0, True), ('$25 to $50', 8, False),
+             ('$100 and over', 7, True)])
+        self.assertContains(
+            response, '$25 to $50 <span class="text-muted">(8)</span>')
+
+    def test_facet_links_toggle_a_value_and_go_back_to_the_first_page(self):
+        response = self.client.get(
+            reverse('products'),
+            {'sizes': 'yes', 'cursor': encode_cursor({'o': 24})})
+        sizes, = [menu for menu in response.context['facet_menus']
+                  if menu['param'] == 'sizes']
+        self.assertEqual([value['url'] for value in sizes['values']], [
+            reverse('products') + '?',
+            reverse('products') + '?sizes=no%2Cyes',
+        ])
+
+    def test_unknown_facet_values_are_dropped(self):
+        params = normalize_listing_params(QueryDict(
+            'rating=unrated,bogus,4-up&price=free&sizes=no'))
+        self.assertEqual(
+            params.urlencode(safe=','), 'rating=4-up,unrated&sizes=no')
+
+
+class SearchSuggestionTest(TestCase):
+    """ Tests for the suggestions shown as a visitor types a search """
+
+    def setUp(self):
+        cache.clear()
+        self.jeans = Category.objects.create(
+            name='jeans', friendly_name='Jeans')
+        self.shirt = Product.objects.create(
+            name='Blue Jersey Shirt', sku='pp5001', price=10,
+            category=self.jeans)
+        self.jacket = Product.objects.create(
+            name='Jean Jacket', sku='pp6002', price=20)
+        self.index = SuggestionIndex()
+
+    def _labels(self, query, **kwargs):
+        return [(s['kind'], s['label'])
+                for s in self.index.suggest(query, **kwargs)]
+
+    def test_names_match_from_any_word(self):
+        self.assertEqual(self._labels('jer'),
+                         [('product', 'Blue Jersey Shirt')])
+        self.assertEqual(self._labels('JERSEY sh'),
+                         [('product', 'Blue Jersey Shirt')])
+        self.assertEqual(self._labels('blue shirt'), [])
+
+    def test_categories_come_before_products(self):
+        self.assertEqual(self._labels('jea'), [
+            ('category', 'Jeans'), ('product', 'Jean Jacket')])
+        self.assertEqual(self._labels('jea', limit=1), [
+            ('category', 'Jeans')])
+
+    def test_skus_match_by_prefix(self):
+        self.assertEqual(self._labels('PP6'), [('product', 'Jean Jacket')])
+        self.assertEqual(
+            [s['url'] for s in self.index.suggest('pp500')],
+            [reverse('product_detail', args=[self.shirt.id])])
+
+    def test_each_product_is_suggested_once(self):
+        Product.objects.create(name='Shirt Shirt', price=5)
+        self.assertEqual(self._labels('shirt'), [
+            ('product', 'Blue Jersey Shirt'), ('product', 'Shirt Shirt')])
+
+    def test_suggestions_follow_catalog_changes(self):
+        self.assertEqual(self._labels('coat'), [])
+        Product.objects.create(name='Rain Coat', price=30)
+        self.assertEqual(self._labels('coat'), [('product', 'Rain Coat')])
+
+    def test_endpoint_answers_from_memory(self):
+        self.client.get(reverse('search_suggestions'), {'q': 'j'})
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse('search_suggestions'), {'q': 'jea'})
+        self.assertEqual(response.json()['suggestions'][0], {
+            'kind': 'category',
+            'label': 'Jeans',
+            'url': reverse('products') + '?category=jeans',
+        })
+        self.assertIn('max-age=60', response['Cache-Control'])
+        response = self.client.get(reverse('search_suggestions'))
+        self.assertEqual(response.json(), {'suggestions': []})
+
+
+def jpeg(width, height):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'navy').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(CATALOG_PAGE_CACHE=False, PRODUCT_IMAGE_WIDTHS=[200, 400])
+class ProductThumbnailTest(TestCase):
+    """ Tests for the thumbnails generated from product images """
+
+    def setUp(self):
+        cache.clear()
+        caches['fragments'].clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.category = Category.objects.create(name='jeans')
+
+    def _saved_widths(self, name, extension):
+        return [Image.open(default_storage.open(
+            thumbnail_name(name, width, extension))).width
+            for width in (200, 400)]
+
+    def test_thumbnails_are_made_at_each_width_without_enlarging(self):
+        default_storage.save('coat.jpg', SimpleUploadedFile(
+            'coat.jpg', jpeg(300, 600)))
+        width, saved = generate_thumbnails('coat.jpg')
+        self.assertEqual(width, 300)
+        self.assertEqual(sorted(saved), [
+            'thumbnails/coat-200w.jpg', 'thumbnails/coat-200w.webp',
+            'thumbnails/coat-400w.jpg', 'thumbnails/coat-400w.webp'])
+        self.assertEqual(self._saved_widths('coat.jpg', 'webp'), [200, 300])
+        # making them again replaces them rather than adding more
+        self.assertEqual(sorted(generate_thumbnails('coat.jpg')[1]),
+                         sorted(saved))
+
+    def test_srcset_only_lists_widths_the_image_has(self):
+        admin = User.objects.create_superuser('admin', 'a@example.com', 'pw')
+        self.client.force_login(admin)
+        for name, width in (('coat', 300), ('hat', 50)):
+            self.client.post(reverse('add_product'), {
+                'category': self.category.id, 'name': name, 'price': '20',
+                'description': 'Warm',
+                'image': SimpleUploadedFile(f'{name}.jpg', jpeg(width, 50),
+                                            content_type='image/jpeg'),
+            })
+        self.assertEqual(
+            list(Product.objects.values_list('name', 'image_width')
+                 .order_by('name')), [('coat', 300), ('hat', 50)])
+        self.assertFalse(default_storage.exists('thumbnails/hat-400w.jpg'))
+        response = self.client.get(reverse('products'))
+        # the thumbnail at 400w is the original, 300 pixels wide
+        self.assertContains(response, 'srcset="'
+                            '/media/thumbnails/coat-200w.jpg 200w, '
+                            '/media/thumbnails/coat-400w.jpg 300w"')
+        self.assertContains(response, 'srcset="'
+                            '/media/thumbnails/hat-200w.jpg 50w"')
+
+    def test_uploading_an_image_makes_its_thumbnails(self):
+        admin = User.objects.create_superuser('admin', 'a@example.com', 'pw')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('add_product'), {
+            'category': self.category.id, 'name': 'Coat', 'price': '20',
+            'description': 'Warm',
+            'image': SimpleUploadedFile('coat.jpg', jpeg(800, 800),
+                                        content_type='image/jpeg'),
+        })
+        product = Product.objects.get()
+        self.assertRedirects(
+            response, reverse('product_detail', args=[product.id]),
+            fetch_redirect_response=False)
+        self.assertEqual(product.thumbnails_of, product.image.name)
+        self.assertEqual(self._saved_widths(product.image.name, 'jpg'),
+                         [200, 400])
+
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, '<source type="image/webp" srcset="'
+                            '/media/thumbnails/coat-200w.webp 200w, '
+                            '/media/thumbnails/coat-400w.webp 400w"')
+
+    def test_images_without_thumbnails_are_shown_at_full_size(self):
+        Product.objects.create(
+            name='Coat', price=20, image='coat.jpg', category=self.category)
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, 'src="/media/coat.jpg"')
+        self.assertNotContains(response, 'srcset')
+
+    def _generate(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('generate_thumbnails', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_command_makes_thumbnails_for_every_image(self):
+        for name in ('coat.jpg', 'hat.jpg'):
+            default_storage.save(name, SimpleUploadedFile(name, jpeg(50, 50)))
+        Product.objects.create(name='Coat', price=20, image='coat.jpg')
+        Product.objects.create(name='Hat', price=5, image='hat.jpg')
+        Product.objects.create(name='Cap', price=5, image='hat.jpg')
+        Product.objects.create(name='Scarf', price=5, image='scarf.jpg')
+        Product.objects.create(name='Socks', price=5)
+        version = get_version('catalog')
+
+        out, err = self._generate('--workers', '2')
+        self.assertIn('Processed 3 images', out)
+        self.assertIn('2 generated, 0 unchanged, 1 failed', out)
+        self.assertIn('scarf.jpg', err)
+        # 50px images only need the smallest
+        self.assertTrue(default_storage.exists('thumbnails/hat-200w.webp'))
+        self.assertFalse(default_storage.exists('thumbnails/hat-400w.webp'))
+        self.assertEqual(
+            list(Product.objects.exclude(thumbnails_of='').values_list(
+                'name', 'thumbnails_of').order_by('name')),
+            [('Cap', 'hat.jpg'), ('Coat', 'coat.jpg'), ('Hat', 'hat.jpg')])
+        self.assertEqual(Product.objects.get(name='Cap').image_width, 50)
+        self.assertNotEqual(get_version('catalog'), version)
+
+    def test_command_records_images_pillow_cannot_open(self):
+        default_storage.save('huge.jpg', SimpleUploadedFile(
+            'huge.jpg', jpeg(50, 50)))
+        default_storage.save('broken.jpg', SimpleUploadedFile(
+            'broken.jpg', b'not an image'))
+        Product.objects.create(name='Huge', price=5, image='huge.jpg')
+        Product.objects.create(name='Broken', price=5, image='broken.jpg')
+
+        # anything over twice this many pixels is refused as a bomb
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 100):
+            out, err = self._generate('--workers', '1')
+        self.assertIn('0 generated, 0 unchanged, 2 failed', out)
+        with default_storage.open('thumbnails/manifest.json') as manifest:
+            manifest = json.load(manifest)
+        self.assertEqual(sorted(manifest['failed']),
+                         ['broken.jpg', 'huge.jpg'])
+        self.assertIn('decompression bomb', manifest['failed']['huge.jpg'])
+        self.assertEqual(manifest['images'], {})
+
+        # once it can be read it is made, and no longer listed as failed
+        out, _ = self._generate('--workers', '1')
+        self.assertIn('1 generated, 0 unchanged, 1 failed', out)
+        with default_storage.open('thumbnails/manifest.json') as manifest:
+            self.assertEqual(list(json.load(manifest)['failed']),
+                             ['broken.jpg'])
+
+    def test_command_skips_images_which_have_not_changed(self):
+        default_storage.save('coat.jpg', SimpleUploadedFile(
+            'coat.jpg', jpeg(50, 50)))
+        default_storage.save('hat.jpg', SimpleUploadedFile(
+            'hat.jpg', jpeg(50, 50)))
+        Product.objects.create(name='Coat', price=20, image='coat.jpg')
+        Product.objects.create(name='Hat', price=5, image='hat.jpg')
+        self._generate('--workers', '1')
+
+        version = get_version('catalog')
+        out, _ = self._generate('--workers', '1')
+        self.assertIn('0 generated, 2 unchanged', out)
+        self.assertEqual(get_version('catalog'), version)
+
+        # an image replaced under the same name is done again
+        default_storage.delete('hat.jpg')
+        default_storage.save('hat.jpg', SimpleUploadedFile(
+            'hat.jpg', jpeg(60, 50)))
+        out, _ = self._generate('--workers', '1')
+        self.assertIn('1 generated, 1 unchanged', out)
+
+        # as is every image once the widths change
+        with self.settings(PRODUCT_IMAGE_WIDTHS=[100]):
+            out, _ = self._generate('--workers', '1')
+        self.assertIn('2 generated, 0 unchanged', out)
+
+    def test_interrupted_runs_carry_on_where_they_stopped(self):
+        for i in range(3):
+            name = f'coat{i}.jpg'
+            default_storage.save(name, SimpleUploadedFile(name, jpeg(50, 50)))
+            Product.objects.create(name=f'Coat {i}', price=20, image=name)
+
+        def interrupt_second(name, known_hash):
+            if name == 'coat1.jpg':
+                raise KeyboardInterrupt
+            return process_image(name, known_hash)
+
+        with patch(
+                'products.management.commands.generate_thumbnails'
+                '.process_image', interrupt_second):
+            with self.assertRaisesMessage(CommandError, 'Interrupted'):
+                self._generate('--workers', '1')
+        out, _ = self._generate('--workers', '1')
+        self.assertIn('2 generated, 1 unchanged', out)
+
+
+class CatalogImportTest(TestCase):
+    """ Tests for importing products in bulk from a feed """
+
+    def setUp(self):
+        cache.clear()
+
+    def _import(self, *paths, **kwargs):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', *paths, stdout=out, stderr=err,
+                     **kwargs)
+        return out.getvalue(), err.getvalue()
+
+    def _write(self, text, suffix):
+        feed = tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, delete=False, encoding='utf-8')
+        self.addCleanup(os.remove, feed.name)
+        with feed:
+            feed.write(text)
+        return feed.name
+
+    def test_json_is_read_a_piece_at_a_time(self):
+        records = [{'sku': str(i), 'name': 'x' * i} for i in range(20)]
+        array = json.dumps(records, indent=2)
+        lines = '\n'.join(json.dumps(record) for record in records)
+        with patch('products.importer.READ_SIZE', 7):
+            for text in (array, lines, '[]', ''):
+                self.assertEqual(
+                    list(iter_json_records(StringIO(text))),
+                    records if len(text) > 2 else [])
+        records = list(iter_json_records(StringIO('[{"sku": "1"}, {"sku"')))
+        self.assertEqual(records[0], {'sku': '1'})
+        self.assertIsInstance(records[1], ValueError)
+
+    def test_malformed_json_records_are_skipped(self):
+        good = [json.dumps({'sku': f's{i}', 'name': 'Mug', 'price': 5})
+                for i in range(1000)]
+        feed = StringIO('\n'.join([good[0], '{"sku": oops}'] + good))
+        with patch('products.importer.READ_SIZE', 100):
+            records = iter_json_records(feed)
+            self.assertEqual(next(records), {'sku': 's0', 'name': 'Mug',
+                                             'price': 5})
+            self.assertIsInstance(next(records), ValueError)
+            # the bad record is found without reading on through the file
+            self.assertLess(feed.tell(), 300)
+            self.assertEqual(len(list(records)), 1000)
+
+        # records in an indented array carry on from the next object
+        records = list(iter_json_records(StringIO(
+            '[\n  {"sku": "1"},\n  {"sku": "2", "price": [1,,\n'
+            '    "name": "x"},\n  {"sku": "3"}\n]')))
+        self.assertEqual(records[0], {'sku': '1'})
+        self.assertIsInstance(records[1], ValueError)
+        self.assertEqual(records[2:], [{'sku': '3'}])
+
+        # nor does a record too big to be one
+        with patch('products.importer.READ_SIZE', 100), \
+                patch('products.importer.MAX_RECORD_SIZE', 500):
+            records = list(iter_json_records(StringIO(
+                '{"name": "' + 'x' * 1000 + '"}\n{"sku": "2"}')))
+        self.assertIsInstance(records[0], ValueError)
+        self.assertEqual(records[1:], [{'sku': '2'}])
+
+    def test_unreadable_records_are_reported_and_skipped(self):
+        json_path = self._write(
+            '{"sku": "a1", "name": "Mug", "price": 5}\n{"sku": ]\n'
+            '{"sku": "a2", "name": "Jug", "price": 6}\n', '.jsonl')
+        csv_path = self._write(
+            'sku,name,price\nb1,Cup,3\nb2,' + 'x' * 200 + ',4\n'
+            'b3,Bowl,2\n', '.csv')
+        limit = csv.field_size_limit(100)
+        self.addCleanup(csv.field_size_limit, limit)
+        out, err = self._import(json_path, csv_path)
+        self.assertIn('4 created, 0 updated, 2 skipped', out)
+        self.assertIn('Skipped record 2: invalid JSON', err)
+        self.assertIn('Skipped record 2: invalid CSV', err)
+
+    def test_records_missing_required_fields_are_skipped(self):
+        Product.objects.create(sku='old', name='Old mug', price=5,
+                               description='Kept')
+        path = self._write('\n'.join([
+            '{"model": "products.category", "fields": {"friendly": "x"}}',
+            '{"sku": "new1", "name": "Linen cup"}',
+            '{"sku": "new2", "name": "Linen jug", "price": 4}',
+            '{"sku": "old", "price": 6}',
+            '{"price": 3}',
+        ]), '.jsonl')
+        version = get_version('catalog')
+        out, err = self._import(path)
+        self.assertIn('1 created, 1 updated, 3 skipped', out)
+        self.assertIn('Skipped record 1: no name', err)
+        self.assertIn('Skipped record 2: no price for a new product', err)
+        self.assertIn('Skipped record 5: no name for a new product', err)
+        self.assertEqual(Product.objects.get(sku='old').price, 6)
+        # the rest of the batch is still written and published
+        self.assertNotEqual(get_version('catalog'), version)
+        response = self.client.get(reverse('products'), {'q': 'linen'})
+        self.assertEqual(response.context['products_total'], 1)
+
+    def test_a_batch_which_fails_to_write_is_not_written_again(self):
+        importer = CatalogImporter()
+        importer.import_records([{'sku': 'a1', 'name': 'Mug', 'price': 5}])
+        importer.batch = [(2, Product(sku='b1', name='Bowl', price=3),
+                           ('sku', 'name', 'price'))]
+        with patch.object(Product.objects, 'bulk_create',
+                          side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                importer._flush()
+        self.assertEqual(importer.batch, [])
+        with patch('products.importer.bump_version') as bump:
+            self.assertEqual(importer.finish(), (1, 0, 0))
+        self.assertTrue(bump.called)
+
+    def test_a_failed_import_still_updates_the_catalog(self):
+        path = self._write(
+            '{"sku": "a1", "name": "Linen mug", "price": 5}\n', '.jsonl')
+        version = get_version('catalog')
+        with self.assertRaises(CommandError):
+            self._import(path, path + '.missing')
+        self.assertNotEqual(get_version('catalog'), version)
+        response = self.client.get(reverse('products'), {'q': 'linen'})
+        self.assertEqual(response.context['products_total'], 1)
+
+    def test_fixtures_import_like_loaddata(self):
+        out, _ = self._import('products/fixtures/categories.json',
+                              'products/fixtures/products.json')
+        self.assertIn('172 created, 0 updated, 0 skipped', out)
+        product = Product.objects.get(sku='pp5001340155')
+        self.assertEqual(product.name, 'Arizona Original Bootcut Jeans')
+        self.assertEqual(str(product.price), '53.99')
+        self.assertEqual(product.category.friendly_name, 'Jeans')
+        self.assertEqual(product.image.name, 'DP0709201205510679M.jpg')
+        self.assertEqual(Category.objects.count(), 9)
+
+        # importing again updates every product rather than adding more
+        out, _ = self._import('products/fixtures/categories.json',
+                              'products/fixtures/products.json')
+        self.assertIn('0 created, 172 updated', out)
+        self.assertEqual(Product.objects.count(), 172)
+
+    def test_csv_updates_only_the_columns_it_has(self):
+        jeans = Category.objects.create(name='jeans')
+        Product.objects.create(sku='a1', name='Old', price=5, rating=4,
+                               description='Kept', category=jeans)
+        path = self._write(
+            'sku,name,price,has_sizes,category\n'
+            'a1,Bootcut,19.99,true,jeans\n'
+            'b2,Mug,4.50,,kitchen\n'
+            'c3,Broken,lots,,\n'
+            'b2,Big Mug,6,no,kitchen\n', '.csv')
+        out, err = self._import(path)
+        self.assertIn('1 created, 1 updated, 1 skipped', out)
+        self.assertIn('record 3', err)
+
+        updated = Product.objects.get(sku='a1')
+        self.assertEqual(
+            (updated.name, str(updated.price), updated.rating,
+             updated.description, updated.has_sizes),
+            ('Bootcut', '19.99', 4, 'Kept', True))
+        # the last row for a SKU wins, and new categories are created
+        mug = Product.objects.get(sku='b2')
+        self.assertEqual((mug.name, mug.has_sizes, mug.category.name),
+                         ('Big Mug', False, 'kitchen'))
+
+    def test_catalog_is_brought_up_to_date_once(self):
+        path = self._write('\n'.join(json.dumps(
+            {'sku': f's{i}', 'name': f'Linen shirt {i}', 'price': 10,
+             'description': 'Cool', 'category': 'shirts'})
+            for i in range(30)), '.jsonl')
+        versions = [get_version(name)
+                    for name in ('catalog', 'categories', 'prices')]
+        with patch('products.importer.bump_version') as bump:
+            with CaptureQueriesContext(connection) as queries:
+                importer = CatalogImporter(batch_size=10)
+                with open(path) as feed:
+                    importer.import_records(iter_json_records(feed))
+            self.assertFalse(bump.called)
+            # a lookup, an insert and a savepoint pair per batch, rather
+            # than queries per product
+            self.assertLess(len(queries), 20)
+            importer.finish()
+            self.assertEqual(
+                sorted(call.args[0] for call in bump.call_args_list),
+                ['catalog', 'categories', 'prices'])
+        self.assertEqual(versions, [get_version(name) for name in (
+            'catalog', 'categories', 'prices')])
+
+        self._import(path)
+        self.assertNotEqual(get_version('catalog'), versions[0])
+        response = self.client.get(reverse('products'), {'q': 'linen'})
+        self.assertEqual(response.context['products_total'], 30)
+
+
+class ProductAdminTest(TestCase):
+    """ Tests that the product admin stays quick with a large catalog """
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.categories = Category.objects.bulk_create([
+            Category(name=f'category_{i}') for i in range(20)])
+
+    def _add_products(self, count):
+        categories = list(Category.objects.all())
+        Product.objects.bulk_create([
+            Product(sku=f'sku{i:05d}', name=f'Product {i}',
+                    description='Test', price='1.00',
+                    category=categories[i % len(categories)])
+            for i in range(Product.objects.count(), count)])
+
+    def test_changelist_queries_do_not_grow_with_products(self):
+        url = reverse('admin:products_product_changelist')
+        self._add_products(10)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self._add_products(10000)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(many), len(few))
+        self.assertContains(response, 'category_1')
+
+    def test_autocomplete_searches_by_sku(self):
+        self._add_products(10000)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'checkout', 'model_name': 'orderlineitem',
+            'field_name': 'product', 'term': 'sku09999'})
+        results = json.loads(response.content)['results']
+        self.assertEqual([result['text'] for result in results],
+                         ['Product 9999'])
+
+
+class BenchmarkCatalogTest(TestCase):
+    """ Tests that the catalog benchmark runs and leaves nothing behind """
+
+    def test_benchmark_is_rolled_back(self):
+        out = StringIO()
+        call_command('benchmark_catalog', '--products', '50,100',
+                     '--repeat', '1', stdout=out)
+        self.assertIn('100 products', out.getvalue())
+        self.assertIn('search: icontains', out.getvalue())
+        self.assertIn('facets: bitmaps', out.getvalue())
+        self.assertIn('suggest: lookup p50', out.getvalue())
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+    def test_unknown_benchmark(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_catalog', 'nothing', stdout=StringIO())
@@ -0,0 +1,90 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+
+# when this process last moved each version on
+_bumped_here = {}
+
+
+def _version_key(name):
+    return f'catalog_version:{name}'
+
+
+def _version_time_key(name):
+    return f'catalog_version_time:{name}'
+
+
+def get_version(name):
+    """ Return the current version number for the named part of the
+        catalog, e.g. 'prices' """
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time so a version which was lost from
+        # the cache can never be mistaken for one handed out before
+        cache.add(key, time.time_ns(), None)
+        cache.add(_version_time_key(name), time.time(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """ Move the named version on, invalidating anything stamped
+        with the previous one """
+    key = _version_key(name)
+    _bumped_here[name] = time.monotonic()
+    cache.set(_version_time_key(name), time.time(), None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key isn't in the cache yet
+        cache.set(key, time.time_ns(), None)
+        return cache.get(key)
+
+
+def get_version_time(name):
+    """ Return when the named version last moved on, as a timestamp, or
+        None if that isn't known """
+    return cache.get(_version_time_key(name))
+
+
+class VersionedIndex:
+    """ Something each process builds in memory from the database and
+        builds again when the named version moves on. Subclasses set
+        version_name, build themselves in _build, and call
+        _ensure_current before reading what they built.
+
+        The version is looked up at most once every check_interval
+        seconds, so a change made by another process can take that long
+        to show. A change made by this process shows straight away. """
+
+    version_name = 'catalog'
+    check_interval = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = None
+
+    def _build(self):
+        raise NotImplementedError
+
+    def _ensure_current(self):
+        checked = time.monotonic()
+        if (self._checked is not None
+                and checked - self._checked < self.check_interval
+                and _bumped_here.get(self.version_name, 0) < self._checked):
+            return
+        version = get_version(self.version_name)
+        if self._version == version:
+            self._checked = checked
+            return
+        # only one thread builds, and the others wait for it and then
+        # find it current
+        with self._lock:
+            if self._version != version:
+                self._build()
+                self._version = version
+            self._checked = checked
@@ -1,21 +1,55 @@
 from django.shortcuts import render, get_object_or_404, redirect, reverse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.db.models import F, Q
 from django.db.models.functions import Lower
 
-from .models import Product, Category
+from .models import Product
+from .categories import category_registry
+from .facets import FACET_LABELS, facet_filter, facet_index, facet_values
 from .forms import ProductForm
+from .page_cache import cache_catalog_page, normalize_listing_params
+from .pagination import KeysetPaginator
+from .search import get_search_backend
+from .suggest import suggestion_index
+from .versions import get_version, get_version_time
 
+# The columns each page's template actually renders, with the category
+# joined in the same query rather than looked up product by product
+LISTING_FIELDS = ('name', 'price', 'rating', 'image', 'thumbnails_of',
+                  'image_width', 'category__name', 'category__friendly_name')
+DETAIL_FIELDS = LISTING_FIELDS + ('description', 'has_sizes')
 
+
+def _listing_last_modified(request):
+    """ The listing changes whenever any product or category does """
+    changed = get_version_time('catalog')
+    return int(changed) if changed else None
+
+
+def _product_last_modified(request, product_id):
+    updated_at = Product.objects.filter(pk=product_id).values_list(
+        'updated_at', flat=True).first()
+    return int(updated_at.timestamp()) if updated_at else None
+
+
+@cache_catalog_page(normalize_listing_params, _listing_last_modified)
 def all_products(request):
     """ A view to show all products, including sorting and search queries """
 
-    products = Product.objects.all()
+    products = Product.objects.select_related('category').only(
+        *LISTING_FIELDS)
     query = None  # to prevent error if no search term is entered
     categories = None
     sort = None
     direction = None
+    sort_field = 'pk'  # the column the pages are ordered and seeked by
+    # the facet values picked for each facet, several values in one facet
+    # show products with any of them
+    selections = {'category': [], 'price': [], 'rating': [], 'sizes': []}
 
     if request.GET:
         if 'sort' in request.GET:
@@ -23,28 +57,38 @@ def all_products(request):
             sort = sortkey  # this is used to keep the sort term in the
             # search box after the search is performed
             if sortkey == 'name':
-                sortkey = 'lower_name'
+                sort_field = 'lower_name'
                 products = products.annotate(lower_name=Lower('name'))
                 # annotate current list of products with a new field called
                 # lower_name which is the name field converted to lower case
-            if sortkey == 'category':
-                sortkey = 'category__name'
+            elif sortkey == 'category':
+                # the paginator reads the sort value from each product,
+                # so the category name is annotated onto it
+                sort_field = 'category_name'
+                products = products.annotate(
+                    category_name=F('category__name'))
+            elif sortkey in ('price', 'rating'):
+                sort_field = sortkey
             if 'direction' in request.GET:
                 direction = request.GET['direction']
-                if direction == 'desc':
-                    sortkey = f'-{sortkey}'
-                    # the - in front of the sortkey reverses the sort order
-
-            products = products.order_by(sortkey)
-            # sort the products by the sortkey
 
         if 'category' in request.GET:
-            categories = request.GET['category'].split(',')
-            products = products.filter(category__name__in=categories)
-            # __in is a Django field lookup that allows us to check
-            # if a given item is in a list
-            categories = Category.objects.filter(name__in=categories)
+            categories = category_registry.by_names(
+                request.GET['category'].split(','))
             # displays the category name in the search box after the search
+            products = products.filter(category__in=categories)
+            # __in is a Django field lookup that allows us to check
+            # if a given item is in a list, we already have the categories
+            # so we filter on their ids rather than joining on the name
+            selections['category'] = [c.id for c in categories]
+
+        for facet in ('price', 'rating', 'sizes'):
+            if facet in request.GET:
+                selections[facet] = request.GET[facet].split(',')
+                facet_q = Q()
+                for key in selections[facet]:
+                    facet_q |= facet_filter(facet, key)
+                products = products.filter(facet_q)
 
         if 'q' in request.GET:
             query = request.GET['q']
@@ -53,17 +97,43 @@ def all_products(request):
                     request, "You didn't enter any search criteria!")
                 return redirect(reverse('products'))
 
-            # Q is a complex query that allows us to use the OR operator (|)
-            # to build a query that matches on either name or description
-            queries = Q(name__icontains=query) | Q(
-                description__icontains=query)
-            # filter the products queryset to match the queries
-            products = products.filter(queries)
+            # the search backend matches the words in the query against
+            # the name and description using the database's full text
+            # index, putting the best matches first unless sorting
+            products = get_search_backend().search(
+                products, query, rank=sort is None)
+            if sort is None:
+                # relevance isn't a column we can seek by, so search
+                # results keep their ranking and are paged by offset
+                sort_field = None
 
     current_sorting = f'{sort}_{direction}'
 
+    # each page seeks past the last product of the one before, so a deep
+    # page costs the same as the first one
+    paginator = KeysetPaginator(
+        products, sort_field, descending=direction == 'desc',
+        per_page=settings.PRODUCTS_PER_PAGE,
+        # products without a category have no category name
+        nullable=sort_field in ('rating', 'category_name'))
+    page = paginator.page(request.GET.get('cursor'))
+
+    # the counts come from the facet bitmaps kept in memory, so the only
+    # query they need is for the ids a search matches
+    searched = None
+    if query:
+        searched = facet_index.bits_for(get_search_backend().search(
+            Product.objects.all(), query).values_list('pk', flat=True))
+    facet_counts, products_total = facet_index.counts(selections, searched)
+
     context = {
-        'products': products,
+        'products': page,
+        'products_total': products_total,
+        'facet_menus': _facet_menus(request, selections, facet_counts),
+        'current_facets': any(
+            selections[facet] for facet in ('price', 'rating', 'sizes')),
+        'next_page_url': _page_url(request, page.next_cursor),
+        'previous_page_url': _page_url(request, page.previous_cursor),
         # this is used to keep the search term in the
         # search box after the search is performed
         'search_term': query,
@@ -71,15 +141,80 @@ def all_products(request):
         # this is used to display the category name in the
         # search box after the search is performed
         'current_sorting': current_sorting,
+        # the product cards are cached against this, so any change to a
+        # product or category renders them afresh
+        'catalog_version': get_version('catalog'),
     }
 
     return render(request, 'products/products.html', context)
 
 
+def _page_url(request, cursor):
+    """ The listing url for the page at cursor, keeping the current
+        sort, category and search """
+    if not cursor:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f'{reverse("products")}?{params.urlencode()}'
+
+
+def _facet_menus(request, selections, counts):
+    """ The values of each facet with the number of products each would
+        show and a link which picks or unpicks it. Values which would show
+        nothing are left out. """
+    category_ids = set(selections['category'])
+    menus = [{
+        'param': 'category',
+        'label': FACET_LABELS['category'],
+        'values': [
+            (c.name, c.get_friendly_name() or c.name,
+             counts['category'].get(c.id, 0), c.id in category_ids)
+            for c in category_registry.all()],
+    }]
+    for facet in ('price', 'rating', 'sizes'):
+        menus.append({
+            'param': facet,
+            'label': FACET_LABELS[facet],
+            'values': [
+                (key, label, counts[facet].get(key, 0),
+                 key in selections[facet])
+                for key, label in facet_values(facet)],
+        })
+
+    for menu in menus:
+        menu['values'] = [{
+            'label': label,
+            'count': count,
+            'selected': selected,
+            'url': _facet_url(request, menu['param'], key),
+        } for key, label, count, selected in menu['values']
+            if count or selected]
+        menu['selected'] = any(value['selected'] for value in menu['values'])
+    return [menu for menu in menus if menu['values']]
+
+
+def _facet_url(request, facet, key):
+    """ The listing url with a facet value picked, or unpicked if it
+        already is, starting again from the first page """
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    picked = set(params[facet].split(',')) if params.get(facet) else set()
+    picked ^= {key}
+    if picked:
+        params[facet] = ','.join(sorted(picked))
+    else:
+        params.pop(facet, None)
+    return f'{reverse("products")}?{params.urlencode()}'
+
+
+@cache_catalog_page(last_modified_func=_product_last_modified)
 def product_detail(request, product_id):
     """ A view to show individual product details """
 
-    product = get_object_or_404(Product, pk=product_id)
+    product = get_object_or_404(
+        Product.objects.select_related('category').only(*DETAIL_FIELDS),
+        pk=product_id)
 
     context = {
         'product': product,
@@ -88,6 +223,19 @@ def product_detail(request, product_id):
     return render(request, 'products/product_detail.html', context)
 
 
+def search_suggestions(request):
+    """ Suggest categories and products as the visitor types in the
+        search box """
+    # the suggestions come from an index kept in memory, so answering
+    # needs no queries
+    suggestions = suggestion_index.suggest(request.GET.get('q', '')[:100])
+    response = JsonResponse({'suggestions': suggestions})
+    # the browser reuses an answer when the visitor types back to a
+    # prefix it has already asked for
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
 @login_required
 def add_product(request):
     """ Add a product to the store """